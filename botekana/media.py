@@ -0,0 +1,206 @@
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, parse_etags
+from django.views.decorators.http import require_safe
+
+
+# Names under the SHA-256 of their content, see `products.storage`.
+HASHED_NAME_RE = re.compile(r'(^|/)[0-9a-f]{64}(__[a-z0-9_]+)?\.[a-z0-9]+$')
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# Smaller variants of JPEG and PNG files, by preference. They're written
+# next to the original, see `products.images`.
+ALTERNATIVE_FORMATS = [('image/avif', '.avif'), ('image/webp', '.webp')]
+NEGOTIATED_EXTENSIONS = {'.jpg', '.jpeg', '.png'}
+
+# Directories of MEDIA_ROOT that are never served: `tmp/` holds uploads
+# being written and the `gc_media` checkpoint.
+INTERNAL_DIRECTORIES = {'tmp'}
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'public, max-age=3600'
+
+
+class RangeFile:
+    """
+    File reader stopping after `length` bytes from the current position.
+
+    Keeps `fileno()`, so servers with a `wsgi.file_wrapper` can still
+    `sendfile()` the range, bounded by the response's Content-Length.
+    """
+
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def parse_accept(header):
+    """
+    Return the quality of each media range of an `Accept` header,
+    `{'image/webp': 1.0, '*/*': 0.8}`. Ranges with an invalid quality are
+    left out.
+    """
+    accepted = {}
+    for media_range in header.split(','):
+        media_type, *params = media_range.split(';')
+        media_type = media_type.strip().lower()
+        if not media_type:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = None
+        if quality is not None:
+            accepted[media_type] = quality
+    return accepted
+
+
+def negotiate(request, path):
+    """
+    Return the path of the best variant of `path` the client accepts and
+    whether the choice depended on the `Accept` header.
+
+    Alternatives are only sent to clients naming their type, wildcards
+    don't say which formats a client decodes.
+    """
+    stem, extension = os.path.splitext(path)
+    if extension.lower() not in NEGOTIATED_EXTENSIONS:
+        return path, False
+    accepted = parse_accept(request.META.get('HTTP_ACCEPT', ''))
+    # Highest quality first, `ALTERNATIVE_FORMATS` order on ties.
+    candidates = sorted(
+        (-accepted[content_type], index, alternative)
+        for index, (content_type, alternative) in enumerate(
+            ALTERNATIVE_FORMATS)
+        if accepted.get(content_type, 0) > 0)
+    for _, _, alternative in candidates:
+        if os.path.isfile(stem + alternative):
+            return stem + alternative, True
+    return path, True
+
+
+def parse_range(header, size):
+    """
+    Return the `(start, end)` of a single byte range, inclusive, None to
+    send the whole file or raise ValueError if it can't be satisfied.
+    """
+    match = RANGE_RE.match(header.replace(' ', ''))
+    if match is None:
+        # Malformed or multiple ranges, both are ignored.
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start > end or start >= size:
+        raise ValueError(header)
+    return start, end
+
+
+@require_safe
+def serve(request, path):
+    """
+    Serve a file of MEDIA_ROOT with validators, long lived caching of
+    content addressed names and single byte ranges.
+
+    The file is handed to the server's `wsgi.file_wrapper`, or to the
+    front end server with `X-Accel-Redirect` when
+    `settings.MEDIA_ACCEL_REDIRECT` names its internal location.
+    """
+    try:
+        fullpath = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404
+    name = os.path.relpath(fullpath, settings.MEDIA_ROOT)
+    if name.split(os.sep)[0] in INTERNAL_DIRECTORIES:
+        raise Http404
+    if not os.path.isfile(fullpath):
+        raise Http404
+    fullpath, negotiated = negotiate(request, fullpath)
+    stat = os.stat(fullpath)
+    name = os.path.relpath(fullpath, settings.MEDIA_ROOT)
+    name = name.replace(os.sep, '/')
+
+    etag = '"%x-%x"' % (int(stat.st_mtime), stat.st_size)
+    if negotiated:
+        etag = '"%s-%s"' % (etag.strip('"'),
+                            os.path.splitext(name)[1].lstrip('.'))
+    response = get_conditional_response(
+        request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is None:
+        response = file_response(request, fullpath, name, stat.st_size,
+                                 etag)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Cache-Control'] = (IMMUTABLE if HASHED_NAME_RE.search(name)
+                                 else REVALIDATE)
+    if negotiated:
+        patch_vary_headers(response, ['Accept'])
+    return response
+
+
+def file_response(request, fullpath, name, size, etag):
+    content_type = (mimetypes.guess_type(fullpath)[0] or
+                    'application/octet-stream')
+    byte_range = None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if 'HTTP_RANGE' in request.META and (if_range is None or
+                                         etag in parse_etags(if_range)):
+        try:
+            byte_range = parse_range(request.META['HTTP_RANGE'], size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */%d' % size
+            return response
+
+    accel_redirect = settings.MEDIA_ACCEL_REDIRECT
+    if accel_redirect:
+        # The front end server handles ranges from the redirect.
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = '%s/%s' % (
+            accel_redirect.rstrip('/'), name)
+        response['Accept-Ranges'] = 'bytes'
+        return response
+
+    file = open(fullpath, 'rb')
+    if byte_range is None:
+        response = FileResponse(file, content_type=content_type)
+        response['Content-Length'] = size
+    else:
+        start, end = byte_range
+        file.seek(start)
+        response = FileResponse(RangeFile(file, end - start + 1),
+                                status=206, content_type=content_type)
+        response['Content-Length'] = end - start + 1
+        response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, size)
+    response['Accept-Ranges'] = 'bytes'
+    return response
@@ -0,0 +1,136 @@
+import re
+import zlib
+
+from django.conf import settings
+from django.http import FileResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+
+ACCEPT_ENCODING_RE = re.compile(r'^\s*([a-z0-9*-]+)\s*(?:;\s*q=([0-9.]+))?',
+                                re.IGNORECASE)
+
+COMPRESSIBLE_TYPES = {
+    'application/javascript',
+    'application/json',
+    'application/msgpack',
+    'application/x-ndjson',
+    'application/xml',
+    'image/svg+xml',
+}
+
+# Levels trading some ratio for speed, responses are compressed per request.
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+def get_encodings(request):
+    """
+    Return the encodings of the request's Accept-Encoding header we can
+    use, best first.
+    """
+    accepted = {}
+    for part in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        match = ACCEPT_ENCODING_RE.match(part)
+        if not match:
+            continue
+        try:
+            quality = float(match.group(2) or 1)
+        except ValueError:
+            continue
+        accepted[match.group(1).lower()] = quality
+    encodings = ['br', 'gzip'] if brotli is not None else ['gzip']
+    wildcard = accepted.get('*', 0)
+    return [encoding for encoding in encodings
+            if accepted.get(encoding, wildcard) > 0]
+
+
+def get_encoding(request):
+    encodings = get_encodings(request)
+    return encodings[0] if encodings else None
+
+
+def compress(content, encoding):
+    if encoding == 'br':
+        return brotli.compress(content, quality=BROTLI_QUALITY)
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, GZIP_WBITS)
+    return compressor.compress(content) + compressor.flush()
+
+
+def compress_sequence(chunks, encoding):
+    """
+    Compress an iterable of chunks, flushing after each one so clients
+    get every chunk as soon as it's produced.
+    """
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        process, flush = compressor.process, compressor.flush
+        finish = compressor.finish
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, GZIP_WBITS)
+        process = compressor.compress
+        flush = lambda: compressor.flush(zlib.Z_SYNC_FLUSH)  # noqa: E731
+        finish = compressor.flush
+    for chunk in chunks:
+        data = process(chunk) + flush()
+        if data:
+            yield data
+    yield finish()
+
+
+def is_compressible(response):
+    content_type = response.get('Content-Type', '').split(';')[0].strip()
+    return (content_type.startswith('text/') or
+            content_type in COMPRESSIBLE_TYPES)
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    Compress responses with brotli, when it's installed and accepted, or
+    gzip.
+
+    Bodies smaller than `settings.COMPRESSION_MIN_SIZE`, files (media is
+    already compressed and served with ranges) and responses that already
+    have a Content-Encoding are sent as they are. Streaming responses are
+    compressed as they're streamed.
+    """
+
+    def process_response(self, request, response):
+        if (response.has_header('Content-Encoding') or
+                isinstance(response, FileResponse) or
+                response.status_code == 206 or
+                not is_compressible(response)):
+            return response
+        if (not response.streaming and
+                len(response.content) < settings.COMPRESSION_MIN_SIZE):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = get_encoding(request)
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            response.streaming_content = compress_sequence(
+                response.streaming_content, encoding)
+            del response['Content-Length']
+        else:
+            content = compress(response.content, encoding)
+            if len(content) >= len(response.content):
+                return response
+            response.content = content
+            response['Content-Length'] = str(len(content))
+
+        # The compressed body isn't byte for byte the one the ETag was
+        # computed for.
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
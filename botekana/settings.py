@@ -56,6 +56,7 @@ SITE_ID = 1
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'botekana.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -67,6 +68,13 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'botekana.urls'
 
+# Smaller responses aren't worth compressing.
+COMPRESSION_MIN_SIZE = 1024
+
+# Seconds stock stays held for a cart item, see `users.reservations`. Run
+# `manage.py sweep_reservations` every minute to release expired holds.
+RESERVATION_TTL = 15 * 60
+
 # Django rest framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
@@ -78,6 +86,19 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_PAGINATION_CLASS':
         'rest_framework.pagination.LimitOffsetPagination',
+    # JSON is encoded with orjson when it's installed. Mobile apps can ask
+    # for MessagePack with `Accept: application/msgpack`.
+    'DEFAULT_RENDERER_CLASSES': [
+        'botekana.renderers.FastJSONRenderer',
+        'botekana.renderers.MessagePackRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'botekana.parsers.FastJSONParser',
+        'botekana.parsers.MessagePackParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
 }
 
 REST_USE_JWT = True
@@ -133,6 +154,21 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # On disk, so the threads of concurrency tests wait for each other's
+        # writes instead of failing on the in-memory database's table locks.
+        'TEST': {'NAME': os.path.join(BASE_DIR, 'test_db.sqlite3')},
+    }
+}
+
+
+# Cache
+# Catalog responses are invalidated through tag versions kept in the cache
+# (see products/caching.py), so deployments running several processes
+# need a shared backend such as memcached or redis here.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
 }
 
@@ -182,6 +218,24 @@ STATIC_DIRS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Uploads are stored once per distinct content, under `ab/cd/<sha256>.ext`.
+DEFAULT_FILE_STORAGE = 'products.storage.ContentAddressedStorage'
+
+# Media is served by `botekana.media.serve`. Set this to the internal nginx
+# location aliasing MEDIA_ROOT to have nginx send the files instead, e.g.
+# '/protected-media/'.
+MEDIA_ACCEL_REDIRECT = None
+
+# Uploaded images are resized to these bounding boxes (in pixels) by a pool
+# of IMAGE_WORKERS processes, see products/images.py. Set IMAGE_WORKERS to 0
+# to render inline.
+IMAGE_RENDITIONS = {
+    'thumbnail': 200,
+    'medium': 600,
+    'large': 1200,
+}
+IMAGE_WORKERS = 2
+
 APPEND_SLASH = True
 
 django_heroku.settings(locals())
@@ -13,15 +13,18 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+import re
+
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
-from django.conf.urls.static import static
 
 from rest_framework.documentation import include_docs_urls
 from rest_auth.views import LoginView
 from rest_auth.registration.views import RegisterView
 
+from . import media
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path("api/docs/", include_docs_urls(title="Botekana API Docs",
@@ -30,4 +33,6 @@ urlpatterns = [
     path('api/auth/register/', RegisterView.as_view(), name='register'),
     path("api/users/", include("users.urls")),
     path("api/products/", include("products.urls")),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    re_path(r'^%s(?P<path>.+)$' % re.escape(settings.MEDIA_URL.lstrip('/')),
+            media.serve, name='media'),
+]
@@ -1,11 +1,56 @@
 from django.contrib import admin
+from django.db import transaction
 
-from . import models
+from . import ledger, models, variants
+
+
+class ProductVariantInline(admin.TabularInline):
+    """
+    The stock of each variant. The variants themselves follow the
+    product's colors and sizes, see `products.variants`.
+    """
+    model = models.ProductVariant
+    fields = ['color', 'color_ar', 'size', 'stock']
+    readonly_fields = ['color', 'color_ar', 'size']
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
 
 
 @admin.register(models.Product)
 class ProductAdmin(admin.ModelAdmin):
-    pass
+    inlines = [ProductVariantInline]
+
+    def save_model(self, request, obj, form, change):
+        """
+        Record the stock of new products in the stock ledger and append
+        quantity edits to it, like `ProductCreateSerializer` does.
+        """
+        with transaction.atomic():
+            if not change:
+                super().save_model(request, obj, form, change)
+                models.StockMovement.objects.create(
+                    product=obj, change=obj.quantity,
+                    reason=models.StockMovement.OPENING, user=request.user,
+                    is_settled=True)
+                return
+            # Leave the quantity and the reserved stock to the ledger and
+            # the holds.
+            fields = [name for name in form.changed_data
+                      if name != 'quantity']
+            obj.save(update_fields=fields + ['effective_price',
+                                             'updated_at'])
+            if 'quantity' in form.changed_data:
+                ledger.adjust({obj.pk: obj.quantity},
+                              models.StockMovement.ADJUSTMENT, request.user)
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # Drop what the stock edits may have saved back of variants the
+        # new colors and sizes removed.
+        variants.sync_variants([form.instance.pk])
 
 
 admin.site.register([models.Category, models.SubCategory, models.Brand])
@@ -0,0 +1,181 @@
+import hashlib
+import time
+from datetime import date
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils import translation
+from django.utils.cache import patch_vary_headers
+from django.utils.http import urlencode
+from rest_framework.response import Response
+
+from botekana.middleware import compress, get_encoding
+
+
+TAG_KEY = 'catalog-tag:%s'
+STATS_KEY = 'catalog-cache:%s'
+
+
+def get_tag_versions(tags):
+    """
+    Return the current version of each tag. Cache keys embed these
+    versions, so bumping a tag drops every entry built from it.
+    """
+    keys = [TAG_KEY % tag for tag in tags]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, new_version(), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def invalidate_tags(*tags):
+    for tag in tags:
+        key = TAG_KEY % tag
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, new_version(), None)
+
+
+def new_version():
+    # Time based, so a version lost to eviction is never handed out again.
+    return int(time.time() * 1000)
+
+
+def make_key(prefix, request, tags, ignored_params=()):
+    """
+    Build a cache key from the host (payloads hold absolute URLs), the
+    normalized query string, the request language, today's date (discounts
+    expire by date) and the versions of `tags`.
+    """
+    params = sorted(
+        (key, value)
+        for key, values in request.query_params.lists()
+        if key not in ignored_params
+        for value in values
+    )
+    parts = [
+        request.build_absolute_uri('/'),
+        urlencode(params),
+        translation.get_language_from_request(request),
+        date.today().isoformat(),
+    ] + [str(version) for version in get_tag_versions(tags)]
+    digest = hashlib.md5('|'.join(parts).encode('utf-8')).hexdigest()
+    return '%s:%s' % (prefix, digest)
+
+
+def record(event):
+    key = STATS_KEY % event
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        pass
+
+
+def get_stats():
+    stats = cache.get_many([STATS_KEY % 'hits', STATS_KEY % 'misses'])
+    hits = stats.get(STATS_KEY % 'hits', 0)
+    misses = stats.get(STATS_KEY % 'misses', 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': hits / total if total else None,
+    }
+
+
+class CachedListMixin:
+    """
+    Cache the serialized `list()` response of a view.
+
+    Entries are keyed by `caching.make_key()` and dropped when one of
+    `cache_tags` is invalidated, see `products.signals`. Cached payloads
+    are rendered without a user, and the per-user `cache_user_fields` are
+    filled in for the requesting user afterwards.
+
+    Responses that are the same for everyone, in one of
+    `cache_rendered_formats`, are also cached rendered and compressed the
+    way the client accepts, so a hit is sent as it is.
+    """
+    cache_tags = ()
+    cache_user_fields = ()
+    cache_timeout = 60 * 10
+    cache_rendered_formats = ('json', 'msgpack')
+
+    def list(self, request, *args, **kwargs):
+        key = make_key('catalog-list:%s' % self.__class__.__name__,
+                       request, self.cache_tags)
+        if self.is_shared_response():
+            return self.rendered_list(key, request, *args, **kwargs)
+        return Response(self.overlay_user_fields(
+            self.cached_list(key, request, *args, **kwargs)))
+
+    def cached_list(self, key, request, *args, **kwargs):
+        data = cache.get(key)
+        if data is None:
+            record('misses')
+            data = super().list(request, *args, **kwargs).data
+            cache.set(key, data, self.cache_timeout)
+        else:
+            record('hits')
+        return data
+
+    def is_shared_response(self):
+        return (self.request.accepted_renderer.format in
+                self.cache_rendered_formats and
+                (not self.cache_user_fields or
+                 not self.request.user.is_authenticated))
+
+    def rendered_list(self, key, request, *args, **kwargs):
+        renderer = request.accepted_renderer
+        encoding = get_encoding(request)
+        rendered_key = '%s:%s:%s' % (key, request.accepted_media_type,
+                                     encoding)
+        rendered = cache.get(rendered_key)
+        if rendered is None:
+            data = self.cached_list(key, request, *args, **kwargs)
+            content = renderer.render(data, request.accepted_media_type,
+                                      self.get_renderer_context())
+            content_encoding = None
+            if (encoding is not None and
+                    len(content) >= settings.COMPRESSION_MIN_SIZE):
+                content = compress(content, encoding)
+                content_encoding = encoding
+            rendered = (content, content_encoding)
+            cache.set(rendered_key, rendered, self.cache_timeout)
+        else:
+            record('hits')
+        content, content_encoding = rendered
+        content_type = renderer.media_type
+        if renderer.charset:
+            content_type += '; charset=%s' % renderer.charset
+        response = HttpResponse(content, content_type=content_type)
+        if content_encoding is not None:
+            response['Content-Encoding'] = content_encoding
+        patch_vary_headers(response, ('Accept', 'Accept-Encoding'))
+        return response
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        # Render every product as if it wasn't in a wishlist.
+        context['wishlist_ids'] = frozenset()
+        return context
+
+    def overlay_user_fields(self, data):
+        if 'in_wishlist' not in self.cache_user_fields:
+            return data
+        user = self.request.user
+        if not user.is_authenticated:
+            return data
+        rows = data['results'] if isinstance(data, dict) else data
+        if not rows or 'in_wishlist' not in rows[0]:
+            return data
+        wishlist_ids = set(user.wishlist_items.values_list('product_id',
+                                                           flat=True))
+        for row in rows:
+            row['in_wishlist'] = row['id'] in wishlist_ids
+        return data
@@ -0,0 +1,92 @@
+import hashlib
+from calendar import timegm
+from datetime import date
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+
+class ConditionalRetrieveMixin:
+    """
+    Answer `If-None-Match` / `If-Modified-Since` on `retrieve()` from the
+    object's `updated_at` column, before the serializer runs.
+
+    Views add whatever else the payload depends on through
+    `get_etag_parts()`. The requesting user, their wishlist and today's
+    date are always part of the ETag since payloads hold per-user
+    wishlist flags and date bound discounts.
+    """
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        last_modified = self.get_last_modified(instance)
+        etag = self.get_etag(request, instance, last_modified)
+        timestamp = timegm(last_modified.utctimetuple())
+
+        response = get_conditional_response(request, etag=etag,
+                                            last_modified=timestamp)
+        if response is None:
+            serializer = self.get_serializer(instance)
+            response = Response(serializer.data)
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(timestamp)
+        patch_vary_headers(response, ['Authorization'])
+        return response
+
+    def get_last_modified(self, instance):
+        return instance.updated_at
+
+    def get_etag_parts(self, instance):
+        return []
+
+    def get_wishlist_ids(self, request):
+        """
+        Return the ids of the products in the requesting user's wishlist,
+        looked up once and handed to the serializer as well.
+        """
+        if not hasattr(self, 'wishlist_ids'):
+            if request.user.is_authenticated:
+                self.wishlist_ids = set(request.user.wishlist_items
+                                        .values_list('product_id', flat=True))
+            else:
+                self.wishlist_ids = set()
+        return self.wishlist_ids
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if hasattr(self, 'wishlist_ids'):
+            context['wishlist_ids'] = self.wishlist_ids
+        return context
+
+    def get_etag(self, request, instance, last_modified):
+        parts = [
+            instance.__class__.__name__,
+            str(instance.pk),
+            last_modified.isoformat(),
+            str(request.user.pk),
+            date.today().isoformat(),
+            request.META.get('QUERY_STRING', ''),
+            ','.join(map(str, sorted(self.get_wishlist_ids(request)))),
+        ] + [str(part) for part in self.get_etag_parts(instance)]
+        digest = hashlib.md5('|'.join(parts).encode('utf-8')).hexdigest()
+        return 'W/"%s"' % digest
+
+
+class ProductGroupConditionalMixin(ConditionalRetrieveMixin):
+    """
+    Conditional GETs for brands and categories, whose payloads embed their
+    products. One aggregate over the products stands in for them.
+    """
+
+    def get_last_modified(self, instance):
+        products = instance.products.order_by().aggregate(
+            latest=Max('updated_at'), count=Count('pk'))
+        self.products_count = products['count']
+        if products['latest'] is None:
+            return instance.updated_at
+        return max(instance.updated_at, products['latest'])
+
+    def get_etag_parts(self, instance):
+        return [self.products_count]
@@ -0,0 +1,126 @@
+import csv
+import json
+from itertools import islice
+
+from django.db.models import prefetch_related_objects
+from django.http import StreamingHttpResponse
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class Echo:
+    """
+    File-like object handing back what is written, for `csv.writer`.
+    """
+
+    def write(self, value):
+        return value
+
+
+class ExportRenderer(BaseRenderer):
+    """
+    Lets content negotiation pick an export format. The exports stream
+    their own body, so nothing is ever rendered with it.
+    """
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        raise NotImplementedError("Export bodies are streamed by the view.")
+
+
+class CSVRenderer(ExportRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class NDJSONRenderer(ExportRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+
+class StreamingExportMixin:
+    """
+    Stream the filtered queryset of a view as CSV or NDJSON, picked with
+    `?export_format=` or the `Accept` header, rendering each row with the
+    view's serializer. CSV is the default.
+
+    Rows are read with `.iterator()` `export_chunk_size` at a time, the
+    `export_prefetch` lookups are prefetched per chunk, and every chunk is
+    sent as soon as it's rendered. Memory use doesn't depend on the size
+    of the export.
+    """
+    export_formats = {
+        'csv': 'text/csv; charset=utf-8',
+        'ndjson': 'application/x-ndjson; charset=utf-8',
+    }
+    export_chunk_size = 1000
+    export_prefetch = ()
+    export_filename = 'export'
+    # Errors are still answered in JSON.
+    renderer_classes = ([CSVRenderer, NDJSONRenderer] +
+                        api_settings.DEFAULT_RENDERER_CLASSES)
+
+    def get(self, request, *args, **kwargs):
+        export_format = request.query_params.get('export_format')
+        if export_format is None:
+            export_format = request.accepted_renderer.format
+            if export_format not in self.export_formats:
+                export_format = 'csv'
+        if export_format not in self.export_formats:
+            raise ValidationError({'export_format': [
+                "Choose one of %s." % ', '.join(self.export_formats)]})
+        queryset = self.filter_queryset(self.get_queryset())
+        encode = getattr(self, 'encode_%s' % export_format)
+        response = StreamingHttpResponse(
+            encode(self.export_rows(queryset)),
+            content_type=self.export_formats[export_format])
+        response['Content-Disposition'] = 'attachment; filename="%s.%s"' % (
+            self.export_filename, export_format)
+        return response
+
+    def handle_exception(self, exc):
+        if isinstance(getattr(self.request, 'accepted_renderer', None),
+                      ExportRenderer):
+            self.request.accepted_renderer = JSONRenderer()
+            self.request.accepted_media_type = JSONRenderer.media_type
+        return super().handle_exception(exc)
+
+    def export_chunks(self, queryset):
+        objects = queryset.iterator(chunk_size=self.export_chunk_size)
+        while True:
+            chunk = list(islice(objects, self.export_chunk_size))
+            if not chunk:
+                return
+            if self.export_prefetch:
+                prefetch_related_objects(chunk, *self.export_prefetch)
+            yield chunk
+
+    def export_rows(self, queryset):
+        """
+        Yield a list of serialized rows per chunk of the queryset.
+        """
+        serializer = self.get_serializer()
+        for chunk in self.export_chunks(queryset):
+            yield [serializer.to_representation(obj) for obj in chunk]
+
+    def get_export_header(self):
+        return [name for name, field in self.get_serializer().fields.items()
+                if not field.write_only]
+
+    def encode_csv(self, chunks):
+        writer = csv.writer(Echo())
+        header = self.get_export_header()
+        yield writer.writerow(header)
+        for rows in chunks:
+            yield ''.join(
+                writer.writerow(['' if row[key] is None else row[key]
+                                 for key in header])
+                for row in rows)
+
+    def encode_ndjson(self, chunks):
+        for rows in chunks:
+            yield ''.join(
+                json.dumps(row, cls=JSONEncoder, ensure_ascii=False) + '\n'
+                for row in rows)
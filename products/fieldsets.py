@@ -0,0 +1,185 @@
+from django.db.models import Model, Prefetch, prefetch_related_objects
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+
+
+def parse_paths(value):
+    """
+    Turn `"id,name,product.name"` into `{'id': {}, 'name': {},
+    'product': {'name': {}}}`.
+    """
+    tree = {}
+    for path in value.split(','):
+        node = tree
+        for name in path.strip().split('.'):
+            if name:
+                node = node.setdefault(name, {})
+    return tree
+
+
+class Fieldset:
+    """
+    The shape of a response asked for with `?fields=`, `?omit=` and
+    `?expand=`, all comma separated lists of dotted field paths.
+
+    Without `fields` every field is rendered. Without `expand` every
+    nested object is rendered in full; with it, only the listed ones are
+    and the other expandable fields collapse to primary keys.
+    """
+
+    def __init__(self, fields=None, omit=None, expand=None):
+        self.fields = fields
+        self.omit = omit or {}
+        self.expand = expand
+
+    @classmethod
+    def from_request(cls, request):
+        params = request.query_params
+        return cls(*(parse_paths(params[name]) if name in params else None
+                     for name in ('fields', 'omit', 'expand')))
+
+    def includes(self, name):
+        if self.fields is not None and name not in self.fields:
+            return False
+        # `omit=product` drops the field, `omit=product.name` only a part.
+        return self.omit.get(name, True) != {}
+
+    def expands(self, name):
+        if self.expand is None or name in self.expand:
+            return True
+        # Asking for nested fields implies expanding their parent.
+        return bool(self.fields and self.fields.get(name))
+
+    def nested(self, name):
+        fields = self.fields.get(name) if self.fields is not None else None
+        expand = self.expand.get(name, {}) if self.expand is not None else None
+        return Fieldset(fields or None, self.omit.get(name), expand)
+
+
+def prefix_lookup(lookup, prefix):
+    if callable(lookup):
+        lookup = lookup()
+    if isinstance(lookup, Prefetch):
+        return Prefetch(prefix + lookup.prefetch_through,
+                        queryset=lookup.queryset, to_attr=lookup.to_attr)
+    return prefix + lookup
+
+
+class SparseFieldsetMixin:
+    """
+    Let a serializer render only the fields of its `fieldset` and adapt
+    the queryset to them with `optimize_queryset()`.
+
+    `expandable_fields` are nested serializers that collapse to primary
+    keys when not expanded. The lookups each field needs are declared in
+    `select_related_fields` and `prefetch_related_fields`; prefetches may
+    be given as callables returning a `Prefetch`.
+    """
+    expandable_fields = ()
+    select_related_fields = {}
+    prefetch_related_fields = {}
+
+    def __init__(self, *args, fieldset=None, **kwargs):
+        self.fieldset = fieldset
+        super().__init__(*args, **kwargs)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        fieldset = self.fieldset
+        if fieldset is None:
+            return fields
+        for name, field in list(fields.items()):
+            if field.write_only:
+                continue
+            if not fieldset.includes(name):
+                del fields[name]
+            elif name in self.expandable_fields:
+                if not fieldset.expands(name):
+                    fields[name] = self.collapse(name, field)
+                    continue
+                target = getattr(field, 'child', field)
+                if isinstance(target, SparseFieldsetMixin):
+                    target.fieldset = fieldset.nested(name)
+        return fields
+
+    @staticmethod
+    def collapse(name, field):
+        kwargs = {}
+        if field.source not in (None, name):
+            kwargs['source'] = field.source
+        return serializers.PrimaryKeyRelatedField(
+            read_only=True, many=isinstance(field, serializers.ListSerializer),
+            **kwargs)
+
+    @classmethod
+    def get_lookups(cls, fieldset, prefix='', many=False):
+        """
+        Return the `select_related()` and `prefetch_related()` lookups
+        rendering `fieldset` takes, relative to `prefix`. Below a many
+        relation everything is prefetched.
+        """
+        select, prefetch = [], []
+        for name, lookup in cls.select_related_fields.items():
+            if fieldset.includes(name):
+                (prefetch if many else select).append(prefix + lookup)
+        for name, lookup in cls.prefetch_related_fields.items():
+            if fieldset.includes(name):
+                prefetch.append(prefix_lookup(lookup, prefix))
+        for name in cls.expandable_fields:
+            if not fieldset.includes(name):
+                continue
+            field = cls._declared_fields[name]
+            is_list = isinstance(field, serializers.ListSerializer)
+            target = getattr(field, 'child', field)
+            source = prefix + (field.source or name)
+            expanded = fieldset.expands(name)
+            if is_list:
+                # Collapsed lists still need the related primary keys.
+                prefetch.append(source)
+            elif expanded:
+                (prefetch if many else select).append(source)
+            if expanded and isinstance(target, SparseFieldsetMixin):
+                nested_select, nested_prefetch = target.get_lookups(
+                    fieldset.nested(name), source + '__', many or is_list)
+                select += nested_select
+                prefetch += nested_prefetch
+        return select, prefetch
+
+    @classmethod
+    def optimize_queryset(cls, queryset, fieldset=None):
+        select, prefetch = cls.get_lookups(fieldset or Fieldset())
+        if select:
+            queryset = queryset.select_related(*select)
+        if prefetch:
+            queryset = queryset.prefetch_related(*prefetch)
+        return queryset
+
+
+class SparseFieldsetViewMixin:
+    """
+    Pass the fieldset of safe requests to the view's serializer.
+
+    List querysets are adapted with `optimize_queryset()`. A single object
+    gets what its fieldset needs prefetched when its serializer is built,
+    so conditional requests answered before that don't load it.
+    """
+
+    def get_fieldset(self):
+        if self.request.method not in SAFE_METHODS:
+            return None
+        return Fieldset.from_request(self.request)
+
+    def get_serializer(self, *args, **kwargs):
+        serializer_class = self.get_serializer_class()
+        if issubclass(serializer_class, SparseFieldsetMixin):
+            fieldset = self.get_fieldset()
+            kwargs.setdefault('fieldset', fieldset)
+            if (fieldset is not None and args and
+                    isinstance(args[0], Model) and not kwargs.get('many')):
+                lookups = serializer_class.get_lookups(fieldset, many=True)[1]
+                prefetch_related_objects([args[0]], *lookups)
+        return super().get_serializer(*args, **kwargs)
+
+    def optimize_queryset(self, queryset):
+        return self.get_serializer_class().optimize_queryset(
+            queryset, self.get_fieldset())
@@ -2,18 +2,23 @@ from distutils.util import strtobool
 from django_filters import rest_framework
 from rest_framework.filters import SearchFilter
 
-from . import models
+from . import models, search
 
 
 class ProductFilter(rest_framework.FilterSet):
     color = rest_framework.CharFilter(
-        field_name='colors', lookup_expr='contains')
+        field_name='color', method='filter_variants')
+    color_ar = rest_framework.CharFilter(
+        field_name='color_ar', method='filter_variants')
+    size = rest_framework.NumberFilter(
+        field_name='size', method='filter_variants')
     brand = rest_framework.NumberFilter()
+    # Filter on the discounted price.
     price_min = rest_framework.NumberFilter(
-        field_name="price", lookup_expr="gte"
+        field_name="effective_price", lookup_expr="gte"
     )
     price_max = rest_framework.NumberFilter(
-        field_name="price", lookup_expr="lte"
+        field_name="effective_price", lookup_expr="lte"
     )
     quantity_min = rest_framework.NumberFilter(
         field_name="quantity", lookup_expr="gte"
@@ -26,6 +31,11 @@ class ProductFilter(rest_framework.FilterSet):
         model = models.Product
         fields = ['category', 'sub_category']
 
+    def filter_variants(self, queryset, name, value):
+        # Semi join through the (color|size, product) variant indexes.
+        variants = models.ProductVariant.objects.filter(**{name: value})
+        return queryset.filter(pk__in=variants.values('product_id'))
+
 
 class ProductSearchFilter(SearchFilter):
     search_field_prefix = "search_"
@@ -53,3 +63,14 @@ class ProductSearchFilter(SearchFilter):
                 if field in search_fields:
                     params.append(request.query_params.get(query_param, ''))
         return params
+
+
+class ProductFullTextSearchFilter(SearchFilter):
+    """
+    Relevance ranked search over the bilingual product search index.
+    Takes the same `search` query parameter as `SearchFilter`.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '')
+        return search.search_products(queryset, query)
@@ -0,0 +1,196 @@
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from PIL import Image as PILImage, ImageOps
+
+from . import models, storage
+from .caching import invalidate_tags
+
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def get_renditions():
+    return getattr(settings, 'IMAGE_RENDITIONS',
+                   {'thumbnail': 200, 'medium': 600, 'large': 1200})
+
+
+def get_formats():
+    """
+    Formats every rendition is written in, besides the base JPEG/PNG.
+    AVIF is only produced when the installed Pillow can encode it.
+    """
+    PILImage.init()
+    return [fmt for fmt in ('webp', 'avif') if fmt.upper() in PILImage.SAVE]
+
+
+def rendition_name(name, rendition, fmt):
+    return '%s__%s.%s' % (os.path.splitext(name)[0], rendition,
+                          'jpg' if fmt == 'jpeg' else fmt)
+
+
+def render(media_root, name, renditions, formats):
+    """
+    Write every rendition of the image stored as `name` and return their
+    names and widths, `{rendition: {'width': width, format: name}}`.
+
+    Runs in a worker process, so it only touches files.
+    """
+    result = {}
+    with PILImage.open(os.path.join(media_root, name)) as source:
+        source = ImageOps.exif_transpose(source)
+        has_alpha = source.mode in ('RGBA', 'LA', 'P')
+        base = 'png' if has_alpha else 'jpeg'
+        source = source.convert('RGBA' if has_alpha else 'RGB')
+        for rendition, size in renditions.items():
+            image = source.copy()
+            image.thumbnail((size, size), PILImage.LANCZOS)
+            result[rendition] = {'width': image.width}
+            for fmt in [base] + formats:
+                output = rendition_name(name, rendition, fmt)
+                image.save(os.path.join(media_root, output), fmt.upper(),
+                           quality=80, optimize=fmt in ('jpeg', 'png'))
+                result[rendition][fmt] = output
+    return result
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=settings.IMAGE_WORKERS)
+    return _executor
+
+
+def enqueue(*names):
+    """
+    Queue the renditions of the stored images `names` once the current
+    transaction commits. The upload request doesn't wait for them.
+    """
+    names = set(names)
+    if names:
+        transaction.on_commit(lambda: submit(names))
+
+
+class Batch:
+    """
+    Images submitted together, so the cache is invalidated once when the
+    last of them is stored rather than once per image.
+    """
+
+    def __init__(self, names):
+        self.remaining = len(names)
+        self.tags = set()
+        self.lock = threading.Lock()
+
+    def stored(self, tags):
+        """
+        Record the tags one finished image touched. Returns whether it
+        was the last of the batch.
+        """
+        with self.lock:
+            self.tags.update(tags)
+            self.remaining -= 1
+            return not self.remaining
+
+
+def submit(names):
+    names = sorted(names)
+    renditions, formats = get_renditions(), get_formats()
+    if not settings.IMAGE_WORKERS:
+        tags = set()
+        for name in names:
+            try:
+                tags.update(store(name, render(
+                    settings.MEDIA_ROOT, name, renditions, formats)))
+            except Exception:
+                logger.exception("Couldn't render %s", name)
+        invalidate_tags(*tags)
+        return
+    batch = Batch(names)
+    for name in names:
+        future = get_executor().submit(
+            render, settings.MEDIA_ROOT, name, renditions, formats)
+        future.add_done_callback(
+            lambda future, name=name: stored(batch, name, future))
+
+
+def stored(batch, name, future):
+    # Runs in the executor's callback thread, which has its own connection.
+    tags = ()
+    try:
+        tags = store(name, future.result())
+    except Exception:
+        logger.exception("Couldn't render %s", name)
+    finally:
+        if batch.stored(tags):
+            invalidate_tags(*batch.tags)
+        connection.close()
+
+
+def store(name, renditions):
+    """
+    Save the renditions of `name` on the rows using it, touch what those
+    rows belong to, and return the cache tags of the rows that changed.
+    """
+    value = json.dumps({'source': name, 'renditions': renditions})
+    now = timezone.now()
+    tags = set()
+    images = models.Image.objects.filter(image=name)
+    owners = list(images.values_list('product_id', 'category_id',
+                                     'sub_category_id'))
+    if images.update(renditions=value):
+        tags.add('image')
+        for model, ids in zip([models.Product, models.Category,
+                               models.SubCategory], zip(*owners)):
+            model.objects.filter(pk__in=set(ids)).update(updated_at=now)
+    if models.Product.objects.filter(image=name).update(renditions=value,
+                                                        updated_at=now):
+        tags.add('product')
+    return tags
+
+
+def needs_renditions(instance):
+    """
+    Whether `instance.image` has no renditions yet.
+    """
+    name = instance.image.name
+    if not name:
+        return False
+    try:
+        return json.loads(instance.renditions)['source'] != name
+    except (ValueError, KeyError, TypeError):
+        return True
+
+
+def create_images(images):
+    """
+    Insert `images` with one query and do what their `post_save` signals
+    would have: count the stored files, touch the products, categories and
+    sub categories they belong to and queue their renditions.
+    """
+    if not images:
+        return
+    now = timezone.now()
+    with transaction.atomic():
+        models.Image.objects.bulk_create(images)
+        names = [image.image.name for image in images]
+        storage.add_references(names)
+        models.Product.objects.filter(
+            pk__in={image.product_id for image in images}
+        ).update(updated_at=now)
+        models.Category.objects.filter(
+            pk__in={image.category_id for image in images}
+        ).update(updated_at=now)
+        models.SubCategory.objects.filter(
+            pk__in={image.sub_category_id for image in images}
+        ).update(updated_at=now)
+    invalidate_tags('image')
+    enqueue(*names)
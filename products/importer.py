@@ -0,0 +1,254 @@
+import csv
+import json
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+
+from . import images, ledger, models, search, storage, variants
+from .caching import invalidate_tags
+
+
+TEXT_FIELDS = ['name', 'name_ar', 'description', 'description_ar', 'colors',
+               'colors_ar', 'sizes', 'image']
+# Columns holding the name, in English or Arabic, of a related object.
+RELATED_FIELDS = {
+    'brand': models.Brand,
+    'category': models.Category,
+    'sub_category': models.SubCategory,
+}
+FIELDS = TEXT_FIELDS + ['price', 'quantity'] + list(RELATED_FIELDS)
+SKU_MAX_LENGTH = models.Product._meta.get_field('sku').max_length
+
+# Failed rows kept in the report, the rest are only counted.
+MAX_REPORTED_ERRORS = 1000
+
+
+def read_csv(stream):
+    """
+    Yield `(line number, row)` of a CSV text stream with a header line.
+    """
+    reader = csv.DictReader(stream)
+    for row in reader:
+        yield reader.line_num, row
+
+
+def read_jsonl(stream):
+    """
+    Yield `(line number, row)` of a text stream of JSON objects, one per
+    line.
+    """
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            row = {'__error__': str(e)}
+        if not isinstance(row, dict):
+            row = {'__error__': "Expected a JSON object."}
+        yield line_number, row
+
+
+READERS = {'csv': read_csv, 'jsonl': read_jsonl}
+
+
+def get_name_maps():
+    """
+    Map the casefolded English and Arabic names of brands, categories and
+    sub categories to their ids.
+    """
+    maps = {}
+    for field, model in RELATED_FIELDS.items():
+        maps[field] = {}
+        for pk, name, name_ar in model.objects.order_by('-pk').values_list(
+                'pk', 'name', 'name_ar'):
+            maps[field][name.casefold()] = pk
+            maps[field][name_ar.casefold()] = pk
+    return maps
+
+
+class CatalogImporter:
+    """
+    Upsert products by `sku` from an iterable of `(line number, row)`.
+
+    Rows are validated and written `chunk_size` at a time, each chunk in
+    its own transaction with one `bulk_create` and one `bulk_update`, so
+    memory use doesn't grow with the input. Empty values leave the field
+    of an existing product unchanged. The signals `save()` would have
+    sent are replayed per chunk: search documents, variants, discounted
+    prices, stored file counts and renditions. Quantities of existing
+    products are appended to the stock ledger rather than overwritten, and
+    settled with the chunk.
+    """
+
+    def __init__(self, chunk_size=500):
+        self.chunk_size = chunk_size
+        self.name_maps = get_name_maps()
+        self.validators = {
+            field: models.Product._meta.get_field(field).validators
+            for field in ['colors', 'colors_ar', 'sizes']
+        }
+        self.created = self.updated = self.failed = 0
+        self.errors = []
+
+    def run(self, rows):
+        rows = iter(rows)
+        while True:
+            chunk = list(islice(rows, self.chunk_size))
+            if not chunk:
+                break
+            self.import_chunk(chunk)
+        invalidate_tags('product')
+        return self.report()
+
+    def report(self):
+        return {
+            'created': self.created,
+            'updated': self.updated,
+            'failed': self.failed,
+            'errors': self.errors,
+        }
+
+    def add_error(self, line_number, sku, errors):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line_number, 'sku': sku,
+                                'errors': errors})
+
+    def clean(self, row):
+        """
+        Return the model values of `row` and the errors of its columns.
+        """
+        values, errors = {}, {}
+        if '__error__' in row:
+            return values, {'row': row['__error__']}
+        for field in TEXT_FIELDS:
+            value = str(row.get(field) or '').strip()
+            if not value:
+                continue
+            max_length = models.Product._meta.get_field(field).max_length
+            if max_length and len(value) > max_length:
+                errors[field] = "Enter at most %d characters." % max_length
+            if field == 'image' and not default_storage.exists(value):
+                errors[field] = "No stored file named %r." % value
+            for validator in self.validators.get(field, []):
+                try:
+                    validator(value)
+                except ValidationError as e:
+                    errors[field] = ' '.join(e.messages)
+            values[field] = value
+        for field, cast in (('price', float), ('quantity', int)):
+            value = str(row.get(field) or '').strip()
+            if not value:
+                continue
+            try:
+                values[field] = cast(value)
+            except ValueError:
+                errors[field] = "Enter a number."
+                continue
+            if values[field] < 0:
+                errors[field] = "Enter a positive number."
+        for field in RELATED_FIELDS:
+            value = str(row.get(field) or '').strip()
+            if not value:
+                continue
+            try:
+                pk = self.name_maps[field][value.casefold()]
+            except KeyError:
+                errors[field] = "Unknown %s %r." % (field.replace('_', ' '),
+                                                    value)
+                continue
+            values[field + '_id'] = pk
+        return values, errors
+
+    def import_chunk(self, chunk):
+        rows = {}
+        for line_number, row in chunk:
+            sku = str(row.get('sku') or '').strip()
+            values, errors = self.clean(row)
+            if not sku:
+                errors['sku'] = "This field is required."
+            elif len(sku) > SKU_MAX_LENGTH:
+                errors['sku'] = ("Enter at most %d characters." %
+                                 SKU_MAX_LENGTH)
+            if errors:
+                self.add_error(line_number, sku, errors)
+                continue
+            # The last row of a sku wins.
+            rows.pop(sku, None)
+            rows[sku] = (line_number, values)
+
+        existing = models.Product.objects.in_bulk(list(rows),
+                                                  field_name='sku')
+        now = timezone.now()
+        to_create, to_update, fields = [], [], {'updated_at'}
+        added_images, removed_images, quantities = [], [], {}
+        for sku, (line_number, values) in rows.items():
+            product = existing.get(sku)
+            if product is None:
+                missing = [field for field in FIELDS
+                           if field not in values and
+                           field + '_id' not in values]
+                if missing:
+                    self.add_error(line_number, sku, {
+                        field: "This field is required." for field in missing
+                    })
+                    continue
+                product = models.Product(sku=sku, **values)
+                product.effective_price = product.price
+                to_create.append(product)
+                added_images.append(product.image.name)
+                continue
+            if 'image' in values and values['image'] != product.image.name:
+                removed_images.append(product.image.name)
+                added_images.append(values['image'])
+            if 'quantity' in values:
+                quantities[product.pk] = values.pop('quantity')
+            for field, value in values.items():
+                setattr(product, field, value)
+            product.updated_at = now
+            fields.update(values)
+            to_update.append(product)
+
+        try:
+            with transaction.atomic():
+                models.Product.objects.bulk_create(to_create)
+                if to_update:
+                    models.Product.objects.bulk_update(to_update,
+                                                       sorted(fields))
+                skus = [product.sku for product in to_create + to_update]
+                product_ids = dict(models.Product.objects.filter(
+                    sku__in=skus).values_list('sku', 'pk'))
+                models.StockMovement.objects.bulk_create([
+                    models.StockMovement(
+                        product_id=product_ids[product.sku],
+                        change=product.quantity,
+                        reason=models.StockMovement.OPENING,
+                        is_settled=True)
+                    for product in to_create
+                ])
+                ledger.adjust(quantities, models.StockMovement.IMPORT)
+                product_ids = list(product_ids.values())
+                products = models.Product.objects.filter(pk__in=product_ids)
+                products.refresh_discounts()
+                search.update_search_documents(product_ids)
+                variants.sync_variants(product_ids)
+                storage.add_references(added_images)
+                storage.remove_references(removed_images)
+        except DatabaseError as e:
+            for product in to_create + to_update:
+                self.add_error(rows[product.sku][0], product.sku,
+                               {'row': str(e)})
+            return
+        # Fold this chunk's quantities into the stock ledger, outside the
+        # chunk's transaction so checkouts wait on as few locks as possible.
+        if quantities:
+            ledger.settle_products(quantities)
+        images.enqueue(*[product.image.name
+                         for product in to_create + to_update
+                         if images.needs_renditions(product)])
+        self.created += len(to_create)
+        self.updated += len(to_update)
@@ -0,0 +1,123 @@
+from django.db import transaction
+from django.db.models import (Case, ExpressionWrapper, F, IntegerField,
+                              OuterRef, Q, Subquery, Sum, Value, When)
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from . import models
+from .caching import invalidate_tags
+
+
+def amounts_case(amounts):
+    """
+    Expression evaluating to `amounts[pk]` for each row.
+    """
+    return Case(*[When(pk=pk, then=Value(amount))
+                  for pk, amount in amounts.items()],
+                output_field=IntegerField())
+
+
+def sum_by_product(rows):
+    """
+    Sum the quantities of `(product id, quantity)` rows by product.
+    """
+    amounts = {}
+    for product_id, quantity in rows:
+        amounts[product_id] = amounts.get(product_id, 0) + quantity
+    return amounts
+
+
+def get_balances(product_ids):
+    """
+    Map each product to its stock, counting the pending movements.
+    """
+    pending = models.StockMovement.objects.filter(
+        product=OuterRef('pk'), is_settled=False
+    ).order_by().values('product').annotate(
+        change=Sum('change')).values('change')
+    balance = ExpressionWrapper(
+        F('quantity') + Coalesce(Subquery(pending), 0),
+        output_field=IntegerField())
+    return dict(models.Product.objects.filter(
+        pk__in=list(product_ids)).values_list('pk', balance))
+
+
+def adjust(quantities, reason, user=None):
+    """
+    Append the pending movements bringing each product of `quantities`
+    to its quantity there.
+    """
+    balances = get_balances(quantities)
+    models.StockMovement.objects.bulk_create([
+        models.StockMovement(product_id=pk, change=quantity - balances[pk],
+                             reason=reason, user=user)
+        for pk, quantity in quantities.items()
+        if pk in balances and quantity != balances[pk]
+    ])
+
+
+def settle(movements):
+    """
+    Fold the pending movements of the `movements` queryset into the
+    quantity of their products, in one UPDATE, and mark them settled.
+    Return how many were settled.
+
+    A quantity never drops below zero; when it would have, the product
+    shows up in `get_unreconciled()`.
+    """
+    with transaction.atomic():
+        rows = list(movements.filter(is_settled=False).select_for_update()
+                    .values_list('pk', 'product', 'change'))
+        if not rows:
+            return 0
+        amounts = sum_by_product(row[1:] for row in rows)
+        models.Product.objects.filter(pk__in=list(amounts)).update(
+            quantity=Greatest(F('quantity') + amounts_case(amounts),
+                              Value(0), output_field=IntegerField()),
+            updated_at=timezone.now())
+        models.StockMovement.objects.filter(
+            pk__in=[pk for pk, _, _ in rows]).update(is_settled=True)
+    return len(rows)
+
+
+def settle_products(product_ids):
+    """
+    Fold the pending movements of the given products, so their quantity
+    can be checked.
+    """
+    return settle(models.StockMovement.objects.filter(
+        product__in=list(product_ids)))
+
+
+def compact(batch_size=1000):
+    """
+    Settle every pending movement, `batch_size` at a time, each batch in
+    its own transaction. Return the number of movements settled.
+    """
+    settled = 0
+    pending = models.StockMovement.objects.filter(
+        is_settled=False).order_by('pk')
+    while True:
+        with transaction.atomic():
+            pks = list(pending.select_for_update(skip_locked=True)
+                       .values_list('pk', flat=True)[:batch_size])
+            if pks:
+                settled += settle(models.StockMovement.objects.filter(
+                    pk__in=pks))
+        if len(pks) < batch_size:
+            break
+    if settled:
+        invalidate_tags('product')
+    return settled
+
+
+def get_unreconciled():
+    """
+    Return the products whose quantity isn't the sum of their settled
+    movements, annotated with that sum as `ledger_quantity`.
+    """
+    return models.Product.objects.annotate(
+        ledger_quantity=Coalesce(Sum(
+            'stock_movements__change',
+            filter=Q(stock_movements__is_settled=True)), 0)
+    ).exclude(quantity=F('ledger_quantity')).order_by('pk')
@@ -0,0 +1,58 @@
+import time
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+
+from botekana.renderers import FastJSONRenderer, MessagePackRenderer
+from products.views import ProductListView
+from users.views import CartListView
+
+
+VIEWS = {
+    'products': ProductListView,
+    'carts': CartListView,
+}
+RENDERERS = {
+    'json': JSONRenderer,
+    'fast-json': FastJSONRenderer,
+    'msgpack': MessagePackRenderer,
+}
+
+
+class Command(BaseCommand):
+    help = ("Compare the size and the CPU time of the product and cart list "
+            "responses rendered as JSON, with the fast JSON renderer and as "
+            "MessagePack.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--limit', type=int, default=100,
+            help="Objects per response.")
+        parser.add_argument(
+            '--repeat', type=int, default=50,
+            help="Renders timed per response and renderer.")
+
+    def get_data(self, view_class, limit):
+        """
+        Serialize the first `limit` objects the way the list view does,
+        leaving out its response cache.
+        """
+        view = view_class(args=(), kwargs={}, format_kwarg=None)
+        view.request = view.initialize_request(APIRequestFactory().get('/'))
+        queryset = view.filter_queryset(view.get_queryset())[:limit]
+        return view.get_serializer(queryset, many=True).data
+
+    def handle(self, *args, **options):
+        for view_name, view_class in VIEWS.items():
+            data = self.get_data(view_class, options['limit'])
+            for renderer_name, renderer_class in RENDERERS.items():
+                renderer = renderer_class()
+                start = time.process_time()
+                for _ in range(options['repeat']):
+                    content = renderer.render(data)
+                elapsed = time.process_time() - start
+                self.stdout.write(
+                    "%-9s %-10s %9d bytes %8.3f ms" % (
+                        view_name, renderer_name, len(content),
+                        elapsed * 1000 / options['repeat']))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from products import ledger
+
+
+class Command(BaseCommand):
+    help = ("Fold pending stock movements into product quantities. Run "
+            "every few minutes, e.g. from cron.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help="Movements settled per transaction.")
+        parser.add_argument(
+            '--reconcile', action='store_true',
+            help="Then list the products whose quantity isn't the sum of "
+                 "their settled movements.")
+
+    def handle(self, *args, **options):
+        settled = ledger.compact(options['batch_size'])
+        self.stdout.write("Settled %d stock movements." % settled)
+        if options['reconcile']:
+            for product in ledger.get_unreconciled():
+                self.stdout.write("%s: quantity %d, ledger %d" % (
+                    product.sku, product.quantity, product.ledger_quantity))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from products import models
+from products.caching import invalidate_tags
+
+
+class Command(BaseCommand):
+    help = ("Apply discounts that have started and drop discounts that "
+            "have finished from product prices. Run daily, e.g. from the "
+            "Heroku scheduler.")
+
+    def handle(self, *args, **options):
+        products = models.Product.objects.filter(
+            Q(active_discount_percentage__gt=0) |
+            Q(pk__in=models.Discount.objects.active().values('product_id'))
+        )
+        count = products.refresh_discounts()
+        invalidate_tags('product')
+        self.stdout.write("Refreshed prices of %d products." % count)
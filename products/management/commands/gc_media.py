@@ -0,0 +1,222 @@
+import os
+import re
+import shutil
+import time
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from products import models
+from products.images import get_renditions
+
+
+# Directories of MEDIA_ROOT that never hold referenced files.
+SKIPPED_DIRECTORIES = {'tmp'}
+
+RENDITION_RE = re.compile(
+    r'^(?P<stem>.+)__(?P<rendition>[a-z0-9_]+)\.[a-z0-9]+$')
+
+
+def walk(root, start=(), path=()):
+    """
+    Yield the names of the files under `root` in sorted order, one
+    directory listing at a time, skipping names up to `start`.
+    """
+    with os.scandir(os.path.join(root, *path)) as entries:
+        entries = sorted(entries, key=lambda entry: entry.name)
+    for entry in entries:
+        parts = path + (entry.name,)
+        if parts < start[:len(parts)]:
+            continue
+        if entry.is_dir(follow_symlinks=False):
+            yield from walk(root, start, parts)
+        elif entry.is_file(follow_symlinks=False) and parts > start:
+            yield '/'.join(parts)
+
+
+def chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def source_stem(name, renditions):
+    match = RENDITION_RE.match(name)
+    if match and match.group('rendition') in renditions:
+        return match.group('stem')
+    return None
+
+
+def referenced_names(names):
+    """
+    The ones of `names` used by an image or a product, or still counted
+    as used by a `StoredFile`.
+    """
+    referenced = set()
+    for model in (models.Image, models.Product):
+        referenced.update(model.objects.filter(image__in=names)
+                          .values_list('image', flat=True))
+    referenced.update(models.StoredFile.objects.filter(
+        name__in=names, reference_count__gt=0
+    ).values_list('name', flat=True))
+    return referenced
+
+
+def referenced_stems(stems):
+    """
+    The ones of `stems` whose image, of any extension, is still used.
+    """
+    if not stems:
+        return set()
+    lookup = reduce(or_, (Q(image=stem) | Q(image__startswith=stem + '.')
+                          for stem in stems))
+    names = set()
+    for model in (models.Image, models.Product):
+        names.update(model.objects.filter(lookup)
+                     .values_list('image', flat=True))
+    return {os.path.splitext(name)[0] for name in names} | (names & stems)
+
+
+def is_inside(path, root):
+    path, root = os.path.realpath(path), os.path.realpath(root)
+    return os.path.commonpath([path, root]) == root
+
+
+class Command(BaseCommand):
+    help = ("Delete or quarantine media files that no image or product "
+            "uses anymore, including the renditions of such files. "
+            "Interrupted runs resume where they stopped.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help="Only report the files that would be removed.")
+        parser.add_argument(
+            '--quarantine', metavar='DIRECTORY',
+            help="Move orphans under DIRECTORY, outside of MEDIA_ROOT, "
+                 "instead of deleting them.")
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help="Files checked against the database per query.")
+        parser.add_argument(
+            '--rate', type=float, default=0,
+            help="Remove at most this many files per second.")
+        parser.add_argument(
+            '--min-age', type=int, default=60 * 60,
+            help="Leave files modified less than this many seconds ago.")
+        parser.add_argument(
+            '--checkpoint',
+            default=os.path.join(settings.MEDIA_ROOT, 'tmp',
+                                 'gc_media.checkpoint'),
+            help="File recording the progress of the run.")
+        parser.add_argument(
+            '--restart', action='store_true',
+            help="Ignore the checkpoint and walk the whole media tree.")
+
+    def handle(self, *args, **options):
+        self.options = options
+        root = settings.MEDIA_ROOT
+        if options['quarantine'] and is_inside(options['quarantine'], root):
+            # It would be walked, and its files collected, on the next run.
+            raise CommandError("The quarantine directory must be outside "
+                               "of MEDIA_ROOT.")
+        if not os.path.isdir(root):
+            self.stdout.write("No media in %s." % root)
+            return
+        start = () if options['restart'] else self.read_checkpoint()
+        if start:
+            self.stdout.write("Resuming after %s." % '/'.join(start))
+        renditions = set(get_renditions())
+        removed = size = 0
+
+        files = (name for name in walk(root, start)
+                 if name.split('/')[0] not in SKIPPED_DIRECTORIES)
+        for batch in chunks(files, options['batch_size']):
+            referenced = referenced_names(batch)
+            stems = {source_stem(name, renditions) for name in batch} - {None}
+            stems = referenced_stems(stems)
+            orphans = [
+                name for name in batch
+                if name not in referenced and
+                source_stem(name, renditions) not in stems
+            ]
+            done = []
+            for name in orphans:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if time.time() - stat.st_mtime < options['min_age']:
+                    continue
+                self.remove(name)
+                done.append(name)
+                size += stat.st_size
+            if done and not options['dry_run']:
+                models.StoredFile.objects.filter(
+                    name__in=done, reference_count=0).delete()
+            removed += len(done)
+            self.write_checkpoint(batch[-1])
+
+        self.clear_checkpoint()
+        verb = "Would remove" if options['dry_run'] else "Removed"
+        self.stdout.write("%s %d files, %d bytes." % (verb, removed, size))
+
+    def remove(self, name):
+        options = self.options
+        if options['verbosity'] > 1 or options['dry_run']:
+            self.stdout.write(name)
+        if options['dry_run']:
+            return
+        path = os.path.join(settings.MEDIA_ROOT, name)
+        if options['quarantine']:
+            target = os.path.join(options['quarantine'], name)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.move(path, target)
+        else:
+            os.remove(path)
+        self.remove_empty_directories(os.path.dirname(name))
+        if options['rate']:
+            time.sleep(1 / options['rate'])
+
+    def remove_empty_directories(self, directory):
+        # Shard directories are dropped once empty, MEDIA_ROOT is kept.
+        while directory:
+            try:
+                os.rmdir(os.path.join(settings.MEDIA_ROOT, directory))
+            except OSError:
+                return
+            directory = os.path.dirname(directory)
+
+    def read_checkpoint(self):
+        try:
+            with open(self.options['checkpoint']) as checkpoint:
+                name = checkpoint.read().strip()
+        except FileNotFoundError:
+            return ()
+        return tuple(name.split('/')) if name else ()
+
+    def write_checkpoint(self, name):
+        if self.options['dry_run']:
+            return
+        path = self.options['checkpoint']
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.new', 'w') as checkpoint:
+            checkpoint.write(name)
+        os.replace(path + '.new', path)
+
+    def clear_checkpoint(self):
+        if self.options['dry_run']:
+            return
+        try:
+            os.remove(self.options['checkpoint'])
+        except FileNotFoundError:
+            pass
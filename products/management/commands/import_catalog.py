@@ -0,0 +1,36 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products import importer
+
+
+class Command(BaseCommand):
+    help = ("Create or update products by sku from a CSV file with a header "
+            "line or a JSON lines file. Brands and categories are given by "
+            "name.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument(
+            '--format', dest='file_format', choices=list(importer.READERS),
+            help="Defaults to jsonl for .jsonl files and to csv otherwise.")
+        parser.add_argument(
+            '--chunk-size', type=int, default=500,
+            help="Products written per transaction.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['file_format'] or (
+            'jsonl' if path.endswith('.jsonl') else 'csv')
+        try:
+            with open(path, encoding='utf-8-sig', newline='') as stream:
+                report = importer.CatalogImporter(
+                    options['chunk_size']
+                ).run(importer.READERS[file_format](stream))
+        except (OSError, UnicodeDecodeError) as e:
+            raise CommandError(e)
+        for error in report['errors']:
+            self.stderr.write(json.dumps(error, ensure_ascii=False))
+        self.stdout.write("Created %(created)d, updated %(updated)d and "
+                          "rejected %(failed)d products." % report)
@@ -0,0 +1,124 @@
+# Generated by Django 2.2 on 2026-10-18 07:29
+
+import re
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# Copied from `products.search` as it was, so later changes there don't
+# change what this migration does.
+FTS_TABLE = 'products_search_fts'
+
+ARABIC_DIACRITICS = re.compile(
+    '[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]')
+
+ARABIC_FOLDING = str.maketrans({
+    '\u0623': '\u0627',
+    '\u0625': '\u0627',
+    '\u0622': '\u0627',
+    '\u0671': '\u0627',
+    '\u0649': '\u064a',
+    '\u0629': '\u0647',
+})
+
+
+def build_document(*values):
+    text = ' '.join(value for value in values if value)
+    text = ARABIC_DIACRITICS.sub('', text)
+    return text.translate(ARABIC_FOLDING).casefold()
+
+
+SQLITE_INDEX = [
+    "CREATE VIRTUAL TABLE {fts} USING fts5("
+    "document, content='{table}', content_rowid='product_id', "
+    "tokenize='unicode61')",
+    "CREATE TRIGGER {fts}_ai AFTER INSERT ON {table} BEGIN "
+    "INSERT INTO {fts}(rowid, document) "
+    "VALUES (new.product_id, new.document); END",
+    "CREATE TRIGGER {fts}_ad AFTER DELETE ON {table} BEGIN "
+    "INSERT INTO {fts}({fts}, rowid, document) "
+    "VALUES ('delete', old.product_id, old.document); END",
+    "CREATE TRIGGER {fts}_au AFTER UPDATE ON {table} BEGIN "
+    "INSERT INTO {fts}({fts}, rowid, document) "
+    "VALUES ('delete', old.product_id, old.document); "
+    "INSERT INTO {fts}(rowid, document) "
+    "VALUES (new.product_id, new.document); END",
+]
+
+SQLITE_DROP_INDEX = [
+    "DROP TRIGGER IF EXISTS {fts}_ai",
+    "DROP TRIGGER IF EXISTS {fts}_ad",
+    "DROP TRIGGER IF EXISTS {fts}_au",
+    "DROP TABLE IF EXISTS {fts}",
+]
+
+POSTGRES_INDEX = [
+    "ALTER TABLE {table} ADD COLUMN vector tsvector",
+    "CREATE INDEX {table}_vector_idx ON {table} USING GIN (vector)",
+    "CREATE TRIGGER {table}_vector_update BEFORE INSERT OR UPDATE "
+    "ON {table} FOR EACH ROW EXECUTE PROCEDURE "
+    "tsvector_update_trigger(vector, 'pg_catalog.simple', document)",
+]
+
+POSTGRES_DROP_INDEX = [
+    "DROP TRIGGER IF EXISTS {table}_vector_update ON {table}",
+    "DROP INDEX IF EXISTS {table}_vector_idx",
+    "ALTER TABLE {table} DROP COLUMN IF EXISTS vector",
+]
+
+
+def run_statements(schema_editor, statements):
+    table = 'products_productsearchdocument'
+    for statement in statements:
+        schema_editor.execute(statement.format(fts=FTS_TABLE, table=table))
+
+
+def create_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        run_statements(schema_editor, SQLITE_INDEX)
+    elif vendor == 'postgresql':
+        run_statements(schema_editor, POSTGRES_INDEX)
+
+
+def drop_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        run_statements(schema_editor, SQLITE_DROP_INDEX)
+    elif vendor == 'postgresql':
+        run_statements(schema_editor, POSTGRES_DROP_INDEX)
+
+
+def build_documents(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    ProductSearchDocument = apps.get_model('products',
+                                           'ProductSearchDocument')
+    products = Product.objects.order_by().values_list(
+        'id', 'name', 'name_ar', 'description', 'description_ar',
+        'brand__name', 'brand__name_ar', 'sku')
+    documents = [
+        ProductSearchDocument(product_id=values[0],
+                              document=build_document(*values[1:]))
+        for values in products.iterator()
+    ]
+    ProductSearchDocument.objects.bulk_create(documents, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0005_product_ordering'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchDocument',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', related_query_name='search_document', serialize=False, to='products.Product', verbose_name='product')),
+                ('document', models.TextField(verbose_name='document')),
+            ],
+        ),
+        migrations.RunPython(create_index, drop_index),
+        migrations.RunPython(build_documents, migrations.RunPython.noop),
+    ]
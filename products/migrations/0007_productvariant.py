@@ -0,0 +1,69 @@
+# Generated by Django 2.2 on 2026-10-18 07:30
+
+from collections import OrderedDict
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def split_variants(colors, colors_ar, sizes):
+    # Copied from `products.variants` as it was, so later changes there
+    # don't change what this migration does.
+    colors = [color for color in (colors or '').split(',') if color]
+    colors_ar = (colors_ar or '').split(',')
+    sizes = [int(size) for size in (sizes or '').split(',') if size] or [None]
+    variants = OrderedDict()
+    for index, color in enumerate(colors):
+        color_ar = colors_ar[index] if index < len(colors_ar) else ''
+        for size in sizes:
+            variants.setdefault((color, size), color_ar)
+    return [(color, color_ar, size)
+            for (color, size), color_ar in variants.items()]
+
+
+def create_variants(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    ProductVariant = apps.get_model('products', 'ProductVariant')
+    products = Product.objects.order_by().values_list(
+        'id', 'colors', 'colors_ar', 'sizes')
+    variants = [
+        ProductVariant(product_id=product_id, color=color,
+                       color_ar=color_ar, size=size)
+        for product_id, colors, colors_ar, sizes in products.iterator()
+        for color, color_ar, size in split_variants(colors, colors_ar, sizes)
+    ]
+    ProductVariant.objects.bulk_create(variants, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0006_productsearchdocument'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductVariant',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('color', models.CharField(max_length=50, verbose_name='color')),
+                ('color_ar', models.CharField(blank=True, max_length=50, verbose_name='color in arabic')),
+                ('size', models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='size')),
+                ('stock', models.PositiveIntegerField(blank=True, help_text='Leave empty to only track the product quantity', null=True, verbose_name='stock')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='variants', related_query_name='variants', to='products.Product', verbose_name='product')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='productvariant',
+            index=models.Index(fields=['color', 'product'], name='products_pr_color_ebee5f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productvariant',
+            index=models.Index(fields=['size', 'product'], name='products_pr_size_9408b6_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='productvariant',
+            unique_together={('product', 'color', 'size')},
+        ),
+        migrations.RunPython(create_variants, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 2.2 on 2026-10-18 07:35
+
+from datetime import datetime
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def refresh_discounts(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    Discount = apps.get_model('products', 'Discount')
+    best = Discount.objects.filter(
+        product=models.OuterRef('pk'), finish_date__gt=datetime.now()
+    ).order_by().values('product').annotate(
+        best=models.Max('percentage')).values('best')
+    percentage = Coalesce(models.Subquery(best), 0)
+    Product.objects.update(
+        active_discount_percentage=percentage,
+        effective_price=models.ExpressionWrapper(
+            models.F('price') * (100 - percentage) / 100.0,
+            output_field=models.FloatField()))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0008_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='discount',
+            name='start_date',
+            field=models.DateField(blank=True, help_text='Leave empty to start the discount right away', null=True, verbose_name='start date'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='active_discount_percentage',
+            field=models.PositiveSmallIntegerField(default=0, editable=False, verbose_name='active discount percentage'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='effective_price',
+            field=models.FloatField(default=0, editable=False, verbose_name='effective price'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['effective_price', 'id'], name='products_pr_effecti_5873d8_idx'),
+        ),
+        migrations.RunPython(refresh_discounts, migrations.RunPython.noop),
+    ]
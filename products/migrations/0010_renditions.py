@@ -0,0 +1,23 @@
+# Generated by Django 2.2 on 2026-10-18 07:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0009_effective_price'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='renditions',
+            field=models.TextField(blank=True, default='', editable=False, verbose_name='renditions'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='renditions',
+            field=models.TextField(blank=True, default='', editable=False, verbose_name='renditions'),
+        ),
+    ]
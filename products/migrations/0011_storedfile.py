@@ -0,0 +1,61 @@
+# Generated by Django 2.2 on 2026-10-18 07:38
+
+from collections import Counter
+import os
+import re
+
+from django.core.files.storage import default_storage
+from django.db import migrations, models
+
+
+# Copied from `products.storage` as it was, so later changes there don't
+# change what this migration does.
+def digest_from_name(name):
+    stem = os.path.splitext(os.path.basename(name))[0]
+    return stem if re.match(r'^[0-9a-f]{64}$', stem) else ''
+
+
+def count_references(apps, schema_editor):
+    # Files uploaded before this keep their names, they are only counted.
+    Product = apps.get_model('products', 'Product')
+    Image = apps.get_model('products', 'Image')
+    StoredFile = apps.get_model('products', 'StoredFile')
+    counts = Counter(Product.objects.values_list('image', flat=True))
+    counts.update(Image.objects.values_list('image', flat=True))
+    stored_files = []
+    for name, count in counts.items():
+        if not name:
+            continue
+        try:
+            size = default_storage.size(name)
+        except OSError:
+            size = 0
+        stored_files.append(StoredFile(
+            name=name, digest=digest_from_name(name), size=size,
+            reference_count=count))
+    StoredFile.objects.bulk_create(stored_files, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0010_renditions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredFile',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True, verbose_name='name')),
+                ('digest', models.CharField(blank=True, max_length=64, verbose_name='digest')),
+                ('size', models.PositiveIntegerField(verbose_name='size')),
+                ('reference_count', models.PositiveIntegerField(default=0, verbose_name='reference count')),
+                ('date_added', models.DateTimeField(auto_now_add=True, verbose_name='date added')),
+            ],
+            options={
+                'verbose_name': 'stored file',
+            },
+        ),
+        migrations.RunPython(count_references, migrations.RunPython.noop),
+    ]
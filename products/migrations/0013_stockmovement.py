@@ -0,0 +1,46 @@
+# Generated by Django 2.2 on 2026-10-18 07:59
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def open_balances(apps, schema_editor):
+    # The current quantities are where the ledger starts.
+    Product = apps.get_model('products', 'Product')
+    StockMovement = apps.get_model('products', 'StockMovement')
+    StockMovement.objects.bulk_create([
+        StockMovement(product_id=pk, change=quantity, reason='o',
+                      is_settled=True)
+        for pk, quantity in Product.objects.values_list('pk', 'quantity')
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0014_stockreservation'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('products', '0012_product_reserved'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('change', models.IntegerField(verbose_name='change')),
+                ('reason', models.CharField(choices=[('o', 'Opening balance'), ('a', 'Adjustment'), ('i', 'Import'), ('s', 'Sale')], max_length=1, verbose_name='reason')),
+                ('date_added', models.DateTimeField(auto_now_add=True, verbose_name='date added')),
+                ('is_settled', models.BooleanField(default=False, verbose_name='is settled')),
+                ('cart', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stock_movements', related_query_name='stock_movements', to='users.Cart', verbose_name='cart')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_movements', related_query_name='stock_movements', to='products.Product', verbose_name='product')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stock_movements', related_query_name='stock_movements', to=settings.AUTH_USER_MODEL, verbose_name='user')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['is_settled', 'product'], name='products_st_is_sett_58594a_idx'),
+        ),
+        migrations.RunPython(open_balances, migrations.RunPython.noop),
+    ]
@@ -1,13 +1,17 @@
-import os
 from datetime import datetime
+from django.conf import settings
 from django.db import models
 from django.core.validators import RegexValidator
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 
 
 class Category(models.Model):
     name = models.CharField(_("name"), max_length=50)
     name_ar = models.CharField(_("name in arabic"), max_length=50)
+    updated_at = models.DateTimeField(_("updated at"), auto_now=True)
+
     class Meta:
         ordering = ['name']
         verbose_name = _("category")
@@ -21,6 +25,8 @@ class SubCategory(models.Model):
     name = models.CharField(_("name"), max_length=50)
     name_ar = models.CharField(_("name in arabic"), max_length=50)
     categories = models.ManyToManyField(Category, related_name="sub_categories")
+    updated_at = models.DateTimeField(_("updated at"), auto_now=True)
+
     class Meta:
         ordering = ['name']
         verbose_name = _("sub category")
@@ -33,6 +39,8 @@ class SubCategory(models.Model):
 class Brand(models.Model):
     name = models.CharField(_("name"), max_length=50)
     name_ar = models.CharField(_("name in arabic"), max_length=50)
+    updated_at = models.DateTimeField(_("updated at"), auto_now=True)
+
     class Meta:
         ordering = ['name']
         verbose_name = _("brand")
@@ -42,12 +50,46 @@ class Brand(models.Model):
 
 
 def get_upload_path(instance, filename):
-    try:
-        return os.path.join("product_images/secondary_images/", "%s_%s" % (
-            instance.product.name,
-            filename))
-    except:
-        return os.path.join("images/", "%s_%s" % (datetime.now(),filename))
+    # Only the extension is kept, files are stored under the hash of their
+    # content, see `products.storage`.
+    return filename
+
+
+class ProductQuerySet(models.QuerySet):
+    def for_catalog(self):
+        """
+        Load everything `ProductSerializer` renders in a fixed number of
+        queries: the FKs are joined and images and live discounts are
+        prefetched once per page.
+        """
+        return self.select_related(
+            'brand', 'category', 'sub_category'
+        ).prefetch_related(
+            'images',
+            models.Prefetch(
+                'discounts',
+                queryset=Discount.objects.active(),
+                to_attr='active_discounts'
+            )
+        )
+
+    def refresh_discounts(self):
+        """
+        Recompute `active_discount_percentage` and `effective_price` from
+        the currently active discounts, in a single UPDATE.
+        """
+        best = Discount.objects.active().filter(
+            product=models.OuterRef('pk')
+        ).order_by().values('product').annotate(
+            best=models.Max('percentage')).values('best')
+        percentage = Coalesce(models.Subquery(best), 0)
+        return self.update(
+            active_discount_percentage=percentage,
+            effective_price=models.ExpressionWrapper(
+                models.F('price') * (100 - percentage) / 100.0,
+                output_field=models.FloatField()),
+            updated_at=timezone.now()
+        )
 
 
 class Product(models.Model):
@@ -69,10 +111,23 @@ class Product(models.Model):
     )
     image = models.ImageField(_("main image"), upload_to=get_upload_path,
                               help_text="Main image for the product")
+    # Resized variants of `image`, see `products.images`.
+    renditions = models.TextField(_("renditions"), blank=True, default='',
+                                  editable=False)
     price = models.FloatField(_("price"))
     quantity = models.PositiveIntegerField(_("quantity"))
+    # Held by carts, see `users.reservations`. Available stock is
+    # `quantity - reserved`.
+    reserved = models.PositiveIntegerField(_("reserved"), default=0,
+                                           editable=False)
     sku = models.CharField(_("sku"), max_length=40, unique=True)
     date_added = models.DateTimeField(_("date added"), auto_now_add=True)
+    updated_at = models.DateTimeField(_("updated at"), auto_now=True)
+    # Maintained from the active discounts, see `refresh_discounts()`.
+    active_discount_percentage = models.PositiveSmallIntegerField(
+        _("active discount percentage"), default=0, editable=False)
+    effective_price = models.FloatField(_("effective price"), default=0,
+                                        editable=False)
     sizes = models.TextField(_("size"),
                              help_text="Comma seperated list of available sizes",
                              validators=[RegexValidator(r"^(\d+,)*\d+$")])
@@ -88,12 +143,30 @@ class Product(models.Model):
                                      related_query_name="products",
                                      verbose_name=_("sub category"))
 
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        # Stable page order; the indexes back keyset pagination.
+        ordering = ['-date_added', '-id']
+        indexes = [
+            models.Index(fields=['date_added', 'id']),
+            models.Index(fields=['price', 'id']),
+            models.Index(fields=['effective_price', 'id']),
+        ]
+
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        self.effective_price = (self.price *
+                                (100 - self.active_discount_percentage) / 100)
+        super().save(*args, **kwargs)
+
 
 class Image(models.Model):
     image = models.ImageField(_("image"), upload_to=get_upload_path)
+    renditions = models.TextField(_("renditions"), blank=True, default='',
+                                  editable=False)
     product = models.ForeignKey("products.Product",  models.CASCADE,
                                 related_name='images',
                                 related_query_name='images',
@@ -114,13 +187,131 @@ class Image(models.Model):
         return self.id
 
 
+class DiscountQuerySet(models.QuerySet):
+    def active(self):
+        today = datetime.now()
+        return self.filter(
+            models.Q(start_date__isnull=True) |
+            models.Q(start_date__lte=today),
+            finish_date__gt=today
+        )
+
+
 class Discount(models.Model):
     product = models.ForeignKey(Product, models.CASCADE,
                                 related_name="discounts",
                                 related_query_name="discounts",
                                 verbose_name=_("product"))
+    start_date = models.DateField(
+        _("start date"), blank=True, null=True,
+        help_text="Leave empty to start the discount right away")
     finish_date = models.DateField(_("finish date"))
     percentage = models.PositiveSmallIntegerField(_("percentage"))
 
+    objects = DiscountQuerySet.as_manager()
+
     class Meta:
         unique_together = ['product', 'finish_date', 'percentage']
+
+
+class ProductSearchDocument(models.Model):
+    """
+    Normalized search text of a product. Indexed with FTS5 on SQLite and
+    a GIN indexed tsvector on Postgres, see `products.search`.
+    """
+    product = models.OneToOneField(Product, models.CASCADE,
+                                   primary_key=True,
+                                   related_name="search_document",
+                                   related_query_name="search_document",
+                                   verbose_name=_("product"))
+    document = models.TextField(_("document"))
+
+
+class ProductVariant(models.Model):
+    """
+    A color/size combination of a product, kept in sync with the comma
+    separated `Product.colors`, `colors_ar` and `sizes` fields.
+    """
+    product = models.ForeignKey(Product, models.CASCADE,
+                                related_name="variants",
+                                related_query_name="variants",
+                                verbose_name=_("product"))
+    color = models.CharField(_("color"), max_length=50)
+    color_ar = models.CharField(_("color in arabic"), max_length=50,
+                                blank=True)
+    size = models.PositiveSmallIntegerField(_("size"), blank=True, null=True)
+    stock = models.PositiveIntegerField(
+        _("stock"), blank=True, null=True,
+        help_text="Leave empty to only track the product quantity")
+
+    class Meta:
+        unique_together = ['product', 'color', 'size']
+        indexes = [
+            models.Index(fields=['color', 'product']),
+            models.Index(fields=['size', 'product']),
+        ]
+
+    def __str__(self):
+        return "%s %s %s" % (self.product_id, self.color, self.size)
+
+
+class StockMovement(models.Model):
+    """
+    A change of a product's stock, with why and by whom. Movements are
+    only ever inserted; pending ones are folded into `Product.quantity`,
+    see `products.ledger`.
+    """
+    OPENING = 'o'
+    ADJUSTMENT = 'a'
+    IMPORT = 'i'
+    SALE = 's'
+    REASONS = [
+        (OPENING, _("Opening balance")),
+        (ADJUSTMENT, _("Adjustment")),
+        (IMPORT, _("Import")),
+        (SALE, _("Sale")),
+    ]
+
+    product = models.ForeignKey(Product, models.CASCADE,
+                                related_name="stock_movements",
+                                related_query_name="stock_movements",
+                                verbose_name=_("product"))
+    change = models.IntegerField(_("change"))
+    reason = models.CharField(_("reason"), max_length=1, choices=REASONS)
+    cart = models.ForeignKey("users.Cart", models.SET_NULL,
+                             related_name="stock_movements",
+                             related_query_name="stock_movements",
+                             verbose_name=_("cart"), blank=True, null=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, models.SET_NULL,
+                             related_name="stock_movements",
+                             related_query_name="stock_movements",
+                             verbose_name=_("user"), blank=True, null=True)
+    date_added = models.DateTimeField(_("date added"), auto_now_add=True)
+    is_settled = models.BooleanField(_("is settled"), default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['is_settled', 'product']),
+        ]
+
+    def __str__(self):
+        return "%s %+d" % (self.product_id, self.change)
+
+
+class StoredFile(models.Model):
+    """
+    A file in the content addressed media storage and how many images and
+    products use it, see `products.storage`.
+    """
+    name = models.CharField(_("name"), max_length=100, unique=True)
+    digest = models.CharField(_("digest"), max_length=64, blank=True)
+    size = models.PositiveIntegerField(_("size"))
+    reference_count = models.PositiveIntegerField(_("reference count"),
+                                                  default=0)
+    date_added = models.DateTimeField(_("date added"), auto_now_add=True)
+
+    class Meta:
+        verbose_name = _("stored file")
+
+    def __str__(self):
+        return self.name
@@ -0,0 +1,184 @@
+import json
+from base64 import b64decode, b64encode
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework import exceptions
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(LimitOffsetPagination):
+    """
+    Limit/offset pagination with an opt-in keyset (cursor) mode.
+
+    Clients opt in with `?pagination=cursor` (or by following a `cursor`
+    link). In cursor mode pages are fetched with
+    `WHERE (field, id) > (last_value, last_id)` on an indexed ordering,
+    so a deep page costs the same as the first one, and `COUNT(*)` only
+    runs when the client sends `?count=true`.
+
+    Views pick the orderings they allow with `cursor_ordering_fields` and
+    the default with `cursor_default_ordering`. Ordering fields must not be
+    nullable; `id` is always appended as a tie breaker.
+    """
+    mode_query_param = 'pagination'
+    cursor_query_param = 'cursor'
+    ordering_query_param = 'ordering'
+    count_query_param = 'count'
+    cursor_default_limit = 20
+    max_limit = 100
+    invalid_cursor_message = 'Invalid cursor'
+
+    cursor_mode = False
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_mode = (
+            request.query_params.get(self.mode_query_param) == 'cursor' or
+            self.cursor_query_param in request.query_params
+        )
+        if not self.cursor_mode:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_cursor_limit(request)
+        self.count = None
+        if request.query_params.get(self.count_query_param) in ('1', 'true'):
+            self.count = queryset.count()
+
+        cursor = self.decode_cursor(request)
+        if cursor:
+            self.ordering = cursor['ordering']
+            if self.ordering not in self.get_valid_orderings(view):
+                raise self.invalid_cursor()
+        else:
+            self.ordering = self.get_ordering(request, view)
+
+        field = self.ordering.lstrip('-')
+        descending = self.ordering.startswith('-')
+        # Previous pages are read backwards and flipped afterwards.
+        backwards = bool(cursor) and cursor['reverse']
+        if backwards:
+            descending = not descending
+
+        prefix = '-' if descending else ''
+        if field in ('id', 'pk'):
+            queryset = queryset.order_by(prefix + 'pk')
+        else:
+            queryset = queryset.order_by(prefix + field, prefix + 'pk')
+
+        if cursor:
+            queryset = queryset.filter(
+                self.get_keyset_filter(queryset, field, descending, cursor))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+
+        if backwards:
+            results.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, bool(cursor)
+
+        self.results = results
+        return results
+
+    def get_paginated_response(self, data):
+        if not self.cursor_mode:
+            return super().get_paginated_response(data)
+        content = []
+        if self.count is not None:
+            content.append(('count', self.count))
+        content += [
+            ('next', self.get_cursor_link(self.has_next, -1, False)),
+            ('previous', self.get_cursor_link(self.has_previous, 0, True)),
+            ('results', data),
+        ]
+        return Response(OrderedDict(content))
+
+    def invalid_cursor(self):
+        return exceptions.ValidationError(
+            {'details': self.invalid_cursor_message})
+
+    def get_cursor_limit(self, request):
+        try:
+            limit = int(request.query_params[self.limit_query_param])
+        except (KeyError, ValueError):
+            return self.cursor_default_limit
+        return min(max(limit, 1), self.max_limit)
+
+    def get_valid_orderings(self, view):
+        fields = getattr(view, 'cursor_ordering_fields', ['id'])
+        return set(fields) | {'-' + field for field in fields}
+
+    def get_ordering(self, request, view):
+        ordering = request.query_params.get(self.ordering_query_param)
+        if ordering in self.get_valid_orderings(view):
+            return ordering
+        return getattr(view, 'cursor_default_ordering', '-id')
+
+    def get_keyset_filter(self, queryset, field, descending, cursor):
+        lookup = 'lt' if descending else 'gt'
+        try:
+            pk = queryset.model._meta.pk.to_python(cursor['pk'])
+            if pk is None:
+                raise self.invalid_cursor()
+            if field in ('id', 'pk'):
+                return Q(**{'pk__' + lookup: pk})
+            value = queryset.model._meta.get_field(field)\
+                .to_python(cursor['value'])
+        except (ValidationError, TypeError, ValueError):
+            raise self.invalid_cursor()
+        # Ordering fields aren't nullable, so neither is a cursor's value.
+        if value is None:
+            raise self.invalid_cursor()
+        return (Q(**{field + '__' + lookup: value}) |
+                Q(**{field: value, 'pk__' + lookup: pk}))
+
+    def get_cursor_link(self, exists, index, reverse):
+        if not exists or not self.results:
+            return None
+        cursor = self.make_cursor(self.results[index], self.ordering, reverse)
+        url = remove_query_param(self.base_url, self.offset_query_param)
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def make_cursor(self, obj, ordering, reverse=False):
+        """
+        Return the cursor of the page right after (or, when `reverse`,
+        right before) `obj` in `ordering`.
+        """
+        field_name = ordering.lstrip('-')
+        value = None
+        if field_name not in ('id', 'pk'):
+            field = obj._meta.get_field(field_name)
+            value = field.value_to_string(obj)
+        return self.encode_cursor({
+            'ordering': ordering,
+            'value': value,
+            'pk': obj.pk,
+            'reverse': reverse,
+        })
+
+    def encode_cursor(self, cursor):
+        data = json.dumps(cursor, separators=(',', ':')).encode('utf-8')
+        return b64encode(data, altchars=b'-_').decode('ascii')
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            cursor = json.loads(
+                b64decode(encoded.encode('ascii'), altchars=b'-_'))
+            return {
+                'ordering': str(cursor['ordering']),
+                'value': cursor['value'],
+                'pk': cursor['pk'],
+                'reverse': bool(cursor['reverse']),
+            }
+        except (TypeError, ValueError, KeyError):
+            raise self.invalid_cursor()
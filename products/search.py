@@ -0,0 +1,162 @@
+import re
+
+from django.db import connections, transaction
+from django.db.models import BooleanField, F, FloatField, Func, Value
+
+from . import models
+
+
+# Harakat, superscript alef, Quranic marks and tatweel.
+ARABIC_DIACRITICS = re.compile(
+    '[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]')
+
+ARABIC_FOLDING = str.maketrans({
+    '\u0623': '\u0627',  # Alef with hamza above -> alef
+    '\u0625': '\u0627',  # Alef with hamza below -> alef
+    '\u0622': '\u0627',  # Alef with madda -> alef
+    '\u0671': '\u0627',  # Alef wasla -> alef
+    '\u0649': '\u064a',  # Alef maksura -> ya
+    '\u0629': '\u0647',  # Ta marbuta -> ha
+})
+
+TOKEN_RE = re.compile(r'\w+')
+
+# Name of the SQLite FTS5 table that indexes `ProductSearchDocument`.
+FTS_TABLE = 'products_search_fts'
+
+
+def normalize_text(text):
+    """
+    Fold Arabic letter variants, strip diacritics and lowercase `text`.
+    The same normalization is applied to documents and queries.
+    """
+    text = ARABIC_DIACRITICS.sub('', text or '')
+    return text.translate(ARABIC_FOLDING).casefold()
+
+
+def build_document(*values):
+    return normalize_text(' '.join(value for value in values if value))
+
+
+def update_search_documents(product_ids):
+    """
+    Rebuild the search documents of the given products.
+    """
+    product_ids = list(product_ids)
+    if not product_ids:
+        return
+    documents = [
+        models.ProductSearchDocument(
+            product_id=product['id'],
+            document=build_document(
+                product['name'], product['name_ar'],
+                product['description'], product['description_ar'],
+                product['brand__name'], product['brand__name_ar'],
+                product['sku']
+            )
+        )
+        for product in models.Product.objects.filter(
+            id__in=product_ids
+        ).order_by().values('id', 'name', 'name_ar', 'description',
+                            'description_ar', 'brand__name',
+                            'brand__name_ar', 'sku')
+    ]
+    with transaction.atomic():
+        # Delete and insert so the index triggers see plain row changes.
+        models.ProductSearchDocument.objects.filter(
+            product_id__in=product_ids).delete()
+        models.ProductSearchDocument.objects.bulk_create(documents)
+
+
+class SearchRank(Func):
+    """
+    Correlated relevance subquery. `rank_sql` is formatted with the SQL of
+    the search query and of the outer product id, so the expression keeps
+    working when the queryset is relabeled as a subquery.
+    """
+
+    def __init__(self, rank_sql, query):
+        self.rank_sql = rank_sql
+        super().__init__(Value(query), F('pk'), output_field=FloatField())
+
+    def as_sql(self, compiler, connection):
+        query, pk = self.get_source_expressions()
+        query_sql, query_params = compiler.compile(query)
+        pk_sql, pk_params = compiler.compile(pk)
+        sql = self.rank_sql % {'query': query_sql, 'pk': pk_sql}
+        return sql, list(query_params) + list(pk_params)
+
+
+class InSubquery(Func):
+    """
+    Condition `<expression> IN (<sql>)` on the ids a raw `SELECT` finds,
+    filtered on as an annotation equal to true.
+
+    An `__in` lookup would wrap the raw SQL in a second pair of
+    parentheses, which SQLite reads as a list of one value.
+    """
+    template = '(%(expressions)s IN (%(subquery)s))'
+
+    def __init__(self, expression, sql, params):
+        self.sql, self.params = sql, list(params)
+        super().__init__(expression, output_field=BooleanField())
+
+    def as_sql(self, compiler, connection, **extra_context):
+        sql, params = super().as_sql(compiler, connection,
+                                     subquery=self.sql, **extra_context)
+        return sql, list(params) + self.params
+
+
+def filter_matching(queryset, sql, params):
+    """
+    Filter `queryset` down to the products whose id the raw `sql` selects.
+    """
+    return queryset.annotate(
+        search_match=InSubquery(F('pk'), sql, params)
+    ).filter(search_match=True)
+
+
+def search_products(queryset, query):
+    """
+    Filter `queryset` down to products matching `query`, ordered by
+    relevance.
+
+    SQLite uses the FTS5 table and Postgres the GIN indexed tsvector
+    column, both created in migration 0006. Other databases fall back to
+    substring matching on the normalized document.
+    """
+    terms = TOKEN_RE.findall(normalize_text(query))
+    if not terms:
+        return queryset
+
+    vendor = connections[queryset.db].vendor
+    document_table = models.ProductSearchDocument._meta.db_table
+
+    if vendor == 'sqlite':
+        # Every term is matched as a prefix, like the `icontains` search
+        # this replaces.
+        match = ' '.join('"%s"*' % term for term in terms)
+        queryset = filter_matching(
+            queryset, 'SELECT rowid FROM {fts} WHERE {fts} MATCH %s'
+            .format(fts=FTS_TABLE), [match])
+        rank = SearchRank('(SELECT rank FROM {fts} WHERE {fts} MATCH '
+                          '%(query)s AND rowid = %(pk)s)'
+                          .format(fts=FTS_TABLE), match)
+        return queryset.annotate(search_rank=rank).order_by('search_rank')
+
+    if vendor == 'postgresql':
+        tsquery = ' & '.join('%s:*' % term for term in terms)
+        queryset = filter_matching(
+            queryset, "SELECT product_id FROM {table} "
+            "WHERE vector @@ to_tsquery('simple', %s)"
+            .format(table=document_table), [tsquery])
+        rank = SearchRank("(SELECT ts_rank(vector, to_tsquery('simple', "
+                          "%(query)s)) FROM {table} "
+                          "WHERE product_id = %(pk)s)"
+                          .format(table=document_table), tsquery)
+        return queryset.annotate(search_rank=rank).order_by('-search_rank')
+
+    for term in terms:
+        queryset = queryset.filter(
+            search_document__document__contains=term)
+    return queryset
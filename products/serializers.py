@@ -1,7 +1,46 @@
-from datetime import datetime
+import json
+
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Prefetch
+from django.utils.http import urlencode
 from rest_framework import serializers
+from rest_framework.reverse import reverse
+
+from . import ledger, models
+from .fieldsets import SparseFieldsetMixin
+from .images import create_images
+from .pagination import KeysetPagination
+
+
+class RenditionsField(serializers.Field):
+    """
+    Map of an image's resized variants to their URLs, by rendition and
+    format. Empty until the renditions of the current image are ready.
+    """
 
-from . import models
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, obj):
+        try:
+            data = json.loads(obj.renditions)
+        except ValueError:
+            return {}
+        if data.get('source') != obj.image.name:
+            return {}
+        request = self.context.get('request')
+        result = {}
+        for rendition, variants in data['renditions'].items():
+            result[rendition] = {'width': variants.pop('width')}
+            for fmt, name in variants.items():
+                url = default_storage.url(name)
+                if request is not None:
+                    url = request.build_absolute_uri(url)
+                result[rendition][fmt] = url
+        return result
 
 
 class DiscountSerializer(serializers.ModelSerializer):
@@ -10,10 +49,13 @@ class DiscountSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
-class ImageSerializer(serializers.ModelSerializer):
+class ImageSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    renditions = RenditionsField()
+
     class Meta:
         model = models.Image
-        fields = ['image', 'product', 'category', 'sub_category']
+        fields = ['image', 'renditions', 'product', 'category',
+                  'sub_category']
         extra_kwargs = { 
             'product': { 'write_only': True },
             'category': { 'write_only': True },
@@ -21,7 +63,8 @@ class ImageSerializer(serializers.ModelSerializer):
             }
 
 
-class ProductSerializer(serializers.HyperlinkedModelSerializer):
+class ProductSerializer(SparseFieldsetMixin,
+                        serializers.HyperlinkedModelSerializer):
     id = serializers.IntegerField(read_only=True)
     brand = serializers.PrimaryKeyRelatedField(read_only=True)
     brand_name = serializers.StringRelatedField(
@@ -36,13 +79,28 @@ class ProductSerializer(serializers.HyperlinkedModelSerializer):
     colors = serializers.SerializerMethodField()
     colors_ar = serializers.SerializerMethodField()
     images = ImageSerializer(many=True)
+    renditions = RenditionsField()
     discounts = serializers.SerializerMethodField()
     # wishlist_id = serializers.SerializerMethodField()
     in_wishlist = serializers.SerializerMethodField()
 
+    expandable_fields = ['images']
+    select_related_fields = {
+        'brand_name': 'brand',
+        'category_name': 'category',
+        'sub_category_name': 'sub_category',
+    }
+    prefetch_related_fields = {
+        'discounts': lambda: Prefetch(
+            'discounts', queryset=models.Discount.objects.active(),
+            to_attr='active_discounts'),
+    }
+
     class Meta:
         model = models.Product
-        fields = '__all__'
+        # Cart holds change `reserved` all the time, cached lists would
+        # only show stale values.
+        exclude = ['reserved']
 
     def get_sizes(self, obj):
         return map(int, obj.sizes.split(','))
@@ -54,14 +112,32 @@ class ProductSerializer(serializers.HyperlinkedModelSerializer):
         return obj.colors_ar.split(',')
 
     def get_discounts(self, obj):
-        objs = obj.discounts.filter(finish_date__gt=datetime.now())
+        # Use the discounts prefetched by `Product.objects.for_catalog()`
+        # when available.
+        objs = getattr(obj, 'active_discounts', None)
+        if objs is None:
+            objs = obj.discounts.active()
         return DiscountSerializer(objs, many=True).data
 
     def get_in_wishlist(self, obj):
-        user = self.context.get('request').user
-        if not user.is_authenticated:
-            return False
-        return bool(obj.wishlist_items.filter(user=user))
+        return obj.id in self.get_wishlist_ids()
+
+    def get_wishlist_ids(self):
+        """
+        Return the ids of the products in the requesting user's wishlist.
+
+        The set is looked up once and kept in the serializer context, which
+        is shared by every row of a list serializer.
+        """
+        if 'wishlist_ids' not in self.context:
+            user = self.context.get('request').user
+            if user.is_authenticated:
+                ids = set(user.wishlist_items.values_list('product_id',
+                                                          flat=True))
+            else:
+                ids = set()
+            self.context['wishlist_ids'] = ids
+        return self.context['wishlist_ids']
 
     # def get_wishlist_id(self, obj):
     #     user = self.context.get('request').user
@@ -72,20 +148,146 @@ class ProductSerializer(serializers.HyperlinkedModelSerializer):
 
 class ProductCreateSerializer(serializers.ModelSerializer):
     images = ImageSerializer(many=True, read_only=True)
+    renditions = RenditionsField()
 
     class Meta:
         model = models.Product
         fields = '__all__'
 
+    def to_internal_value(self, data):
+        request = self.context.get('request')
+        rejected = getattr(request, 'rejected_uploads', None)
+        if rejected:
+            raise serializers.ValidationError(rejected)
+        return super().to_internal_value(data)
+
     def create(self, validated_data):
-        files = self.context.get('request').FILES
+        files = self.context.get('request').FILES.copy()
         files.pop('image')
-        product = models.Product.objects.create(**validated_data)
-
-        for image in files.values():
-            models.Image.objects.create(product=product, image=image)
+        upload = validated_data['image']
+        # Already stored by `StoredImageUploadHandler`.
+        validated_data['image'] = getattr(upload, 'stored_name', upload)
+        with transaction.atomic():
+            product = models.Product.objects.create(**validated_data)
+            models.StockMovement.objects.create(
+                product=product, change=product.quantity,
+                reason=models.StockMovement.OPENING, user=self.get_user(),
+                is_settled=True)
+            create_images([
+                models.Image(product=product,
+                             image=getattr(image, 'stored_name', image))
+                for image in files.values()
+            ])
         return product
 
+    def update(self, instance, validated_data):
+        """
+        Save only the edited fields. A new quantity is appended to the
+        stock ledger, so the edit doesn't overwrite concurrent sales, and
+        folded into the product by `compact_stock_ledger` or the next
+        checkout.
+        """
+        quantity = validated_data.pop('quantity', None)
+        for field, value in validated_data.items():
+            setattr(instance, field, value)
+        with transaction.atomic():
+            instance.save(update_fields=list(validated_data) +
+                          ['effective_price', 'updated_at'])
+            if quantity is not None:
+                ledger.adjust({instance.pk: quantity},
+                              models.StockMovement.ADJUSTMENT,
+                              self.get_user())
+                # Respond with the balance the edit asked for.
+                instance.quantity = quantity
+        return instance
+
+    def get_user(self):
+        user = self.context['request'].user
+        return user if user.is_authenticated else None
+
+
+class ProductReportSerializer(serializers.ModelSerializer):
+    """
+    Flat product rows with the columns `products.importer` reads.
+    """
+    image = serializers.ReadOnlyField(source='image.name')
+    brand = serializers.StringRelatedField()
+    category = serializers.StringRelatedField()
+    sub_category = serializers.StringRelatedField()
+
+    class Meta:
+        model = models.Product
+        fields = ['id', 'sku', 'name', 'name_ar', 'description',
+                  'description_ar', 'colors', 'colors_ar', 'sizes', 'price',
+                  'effective_price', 'quantity', 'brand', 'category',
+                  'sub_category', 'image', 'date_added']
+
+
+class ProductPageMixin(serializers.Serializer):
+    """
+    Embed the first page of a brand's or category's products, with the
+    total count and a keyset link to the next page of the product list.
+    The page size is taken from `?products_limit=`.
+    """
+    products = serializers.SerializerMethodField()
+    products_count = serializers.SerializerMethodField()
+    products_next = serializers.SerializerMethodField()
+
+    # Name of the `Product` foreign key and of its `ProductFilter` param.
+    products_filter = None
+    products_limit = 20
+    max_products_limit = 100
+    products_ordering = '-date_added'
+
+    def get_products(self, obj):
+        return ProductSerializer(self.get_products_page(obj)['results'],
+                                 many=True, context=self.context).data
+
+    def get_products_count(self, obj):
+        return self.get_products_page(obj)['count']
+
+    def get_products_next(self, obj):
+        return self.get_products_page(obj)['next']
+
+    def get_products_limit(self):
+        request = self.context.get('request')
+        try:
+            limit = int(request.query_params['products_limit'])
+        except (AttributeError, KeyError, ValueError):
+            return self.products_limit
+        return min(max(limit, 1), self.max_products_limit)
+
+    def get_products_page(self, obj):
+        if not hasattr(obj, '_products_page'):
+            limit = self.get_products_limit()
+            queryset = models.Product.objects.filter(
+                **{self.products_filter: obj})
+            results = list(queryset.for_catalog().order_by(
+                self.products_ordering, '-pk')[:limit + 1])
+            next_url = None
+            if len(results) > limit:
+                results = results[:limit]
+                next_url = self.get_next_url(obj, results[-1], limit)
+            obj._products_page = {
+                'count': queryset.count(),
+                'next': next_url,
+                'results': results,
+            }
+        return obj._products_page
+
+    def get_next_url(self, obj, last, limit):
+        paginator = KeysetPagination()
+        url = reverse('product-list') + '?' + urlencode({
+            self.products_filter: obj.pk,
+            paginator.mode_query_param: 'cursor',
+            paginator.ordering_query_param: self.products_ordering,
+            paginator.limit_query_param: limit,
+            paginator.cursor_query_param: paginator.make_cursor(
+                last, self.products_ordering),
+        })
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
 
 class BrandSerializer(serializers.HyperlinkedModelSerializer):
     id = serializers.IntegerField(read_only=True)
@@ -95,9 +297,9 @@ class BrandSerializer(serializers.HyperlinkedModelSerializer):
         fields = '__all__'
 
 
-class BrandEditSerializer(serializers.ModelSerializer):
+class BrandEditSerializer(ProductPageMixin, serializers.ModelSerializer):
     id = serializers.IntegerField(read_only=True)
-    products = ProductSerializer(many=True, read_only=True)
+    products_filter = 'brand'
 
     class Meta:
         model = models.Brand
@@ -108,9 +310,10 @@ class SubCategorySerializer(serializers.ModelSerializer):
         model = models.SubCategory
         fields = '__all__'
 
-class SubCategoryEditSerializer(serializers.ModelSerializer):
+class SubCategoryEditSerializer(ProductPageMixin,
+                                serializers.ModelSerializer):
     id = serializers.IntegerField(read_only=True)
-    products = ProductSerializer(many=True, read_only=True)
+    products_filter = 'sub_category'
     image = serializers.SerializerMethodField()
     class Meta:
         model = models.SubCategory
@@ -127,9 +330,9 @@ class CategorySerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
-class CategoryEditSerializer(serializers.ModelSerializer):
+class CategoryEditSerializer(ProductPageMixin, serializers.ModelSerializer):
     id = serializers.IntegerField(read_only=True)
-    products = ProductSerializer(many=True, read_only=True)
+    products_filter = 'category'
     image = serializers.SerializerMethodField()
     class Meta:
         model = models.Category
@@ -0,0 +1,110 @@
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_save)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import caching, images, models, search, storage, variants
+
+
+# Response cache tag of each catalog model, see `products.caching`.
+CACHE_TAGS = {
+    models.Product: 'product',
+    models.Discount: 'discount',
+    models.Image: 'image',
+    models.Brand: 'brand',
+    models.Category: 'category',
+    models.SubCategory: 'subcategory',
+    models.SubCategory.categories.through: 'subcategory',
+}
+
+
+@receiver(post_save, sender=models.Product)
+def product_post_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.update_search_documents([instance.pk])
+        variants.sync_variants([instance.pk])
+        if images.needs_renditions(instance):
+            images.enqueue(instance.image.name)
+
+
+@receiver(post_save, sender=models.Image)
+def image_post_save(sender, instance, raw=False, **kwargs):
+    if not raw and images.needs_renditions(instance):
+        images.enqueue(instance.image.name)
+
+
+@receiver(post_save, sender=models.Brand)
+def brand_post_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.update_search_documents(
+            instance.products.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=models.Discount)
+@receiver(post_delete, sender=models.Discount)
+def discount_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        models.Product.objects.filter(pk=instance.product_id)\
+            .refresh_discounts()
+
+
+@receiver(post_save, sender=models.Image)
+@receiver(post_delete, sender=models.Image)
+def touch_owner(sender, instance, raw=False, **kwargs):
+    """
+    Bump `updated_at` of the product, category or sub category an image
+    belongs to, so their conditional GETs see the change.
+    """
+    if raw:
+        return
+    now = timezone.now()
+    if instance.product_id:
+        models.Product.objects.filter(pk=instance.product_id)\
+            .update(updated_at=now)
+    if instance.category_id:
+        models.Category.objects.filter(pk=instance.category_id)\
+            .update(updated_at=now)
+    if instance.sub_category_id:
+        models.SubCategory.objects.filter(pk=instance.sub_category_id)\
+            .update(updated_at=now)
+
+
+@receiver(pre_save, sender=models.Product)
+@receiver(pre_save, sender=models.Image)
+def remember_stored_image(sender, instance, raw=False, **kwargs):
+    if raw or instance.pk is None:
+        return
+    instance._stored_image = sender.objects.filter(
+        pk=instance.pk).values_list('image', flat=True).first()
+
+
+@receiver(post_save, sender=models.Product)
+@receiver(post_save, sender=models.Image)
+def count_stored_image(sender, instance, raw=False, **kwargs):
+    """
+    Keep `StoredFile.reference_count` in step with the images and products
+    using each file.
+    """
+    if raw:
+        return
+    previous = getattr(instance, '_stored_image', None)
+    if previous != instance.image.name:
+        storage.add_references([instance.image.name])
+        storage.remove_references([previous])
+
+
+@receiver(post_delete, sender=models.Product)
+@receiver(post_delete, sender=models.Image)
+def release_stored_image(sender, instance, **kwargs):
+    storage.remove_references([instance.image.name])
+
+
+def invalidate_cache_tag(sender, **kwargs):
+    caching.invalidate_tags(CACHE_TAGS[sender])
+
+
+for model in CACHE_TAGS:
+    post_save.connect(invalidate_cache_tag, sender=model)
+    post_delete.connect(invalidate_cache_tag, sender=model)
+m2m_changed.connect(invalidate_cache_tag,
+                    sender=models.SubCategory.categories.through)
@@ -0,0 +1,143 @@
+import hashlib
+import os
+import re
+import tempfile
+from collections import Counter
+
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db.models import F
+
+
+EXTENSION_RE = re.compile(r'^\.[a-z0-9]{1,10}$')
+
+
+def hashed_name(digest, extension):
+    """
+    Sharded name of content hashing to `digest`, `ab/cd/abcd....ext`.
+    """
+    return '%s/%s/%s%s' % (digest[:2], digest[2:4], digest, extension)
+
+
+def get_extension(name):
+    extension = os.path.splitext(name or '')[1].lower()
+    return extension if EXTENSION_RE.match(extension) else ''
+
+
+class HashingWriter:
+    """
+    Write a file into `storage`'s `tmp/` directory while hashing it, then
+    move it to its content addressed name with `commit()`.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        directory = storage.path('tmp')
+        os.makedirs(directory, exist_ok=True)
+        fd, self.temp_path = tempfile.mkstemp(dir=directory)
+        self.file = os.fdopen(fd, 'wb')
+        self.hash = hashlib.sha256()
+        self.size = 0
+
+    def write(self, chunk):
+        self.file.write(chunk)
+        self.hash.update(chunk)
+        self.size += len(chunk)
+
+    @property
+    def digest(self):
+        return self.hash.hexdigest()
+
+    def commit(self, extension):
+        """
+        Move the file to its final name and return that name. When the
+        same content is already stored the temporary copy is dropped.
+        """
+        self.file.close()
+        name = hashed_name(self.digest, extension)
+        path = self.storage.path(name)
+        if os.path.exists(path):
+            os.remove(self.temp_path)
+            # Fresh files are left alone by `gc_media`, even unreferenced.
+            os.utime(path)
+            return name
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if self.storage.file_permissions_mode is not None:
+            os.chmod(self.temp_path, self.storage.file_permissions_mode)
+        # Atomic, so readers never see a partially written file.
+        os.replace(self.temp_path, path)
+        return name
+
+    def discard(self):
+        self.file.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Store files under the SHA-256 of their content, so identical uploads
+    share one file and stored names never change meaning.
+
+    Only the extension of the requested name is kept. Which rows use a
+    file is tracked by `StoredFile`, see `add_references()`.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # Names are derived from the content, an existing file is the same
+        # file.
+        return name
+
+    def _save(self, name, content):
+        writer = HashingWriter(self)
+        try:
+            if hasattr(content, 'seek'):
+                content.seek(0)
+            for chunk in content.chunks():
+                writer.write(chunk)
+            return writer.commit(get_extension(name))
+        except BaseException:
+            writer.discard()
+            raise
+
+
+def digest_from_name(name):
+    stem = os.path.splitext(os.path.basename(name))[0]
+    return stem if re.match(r'^[0-9a-f]{64}$', stem) else ''
+
+
+def add_references(names):
+    """
+    Count one more use of each of the stored files `names`.
+    """
+    from .models import StoredFile
+
+    for name, count in Counter(name for name in names if name).items():
+        updated = StoredFile.objects.filter(name=name).update(
+            reference_count=F('reference_count') + count)
+        if updated:
+            continue
+        try:
+            size = default_storage.size(name)
+        except OSError:
+            size = 0
+        stored, created = StoredFile.objects.get_or_create(
+            name=name, defaults={'digest': digest_from_name(name),
+                                 'size': size, 'reference_count': count})
+        if not created:
+            StoredFile.objects.filter(pk=stored.pk).update(
+                reference_count=F('reference_count') + count)
+
+
+def remove_references(names):
+    """
+    Count one less use of each of the stored files `names`. Files nothing
+    refers to anymore are deleted by `manage.py gc_media`.
+    """
+    from .models import StoredFile
+
+    for name, count in Counter(name for name in names if name).items():
+        updated = StoredFile.objects.filter(
+            name=name, reference_count__gte=count
+        ).update(reference_count=F('reference_count') - count)
+        if not updated:
+            StoredFile.objects.filter(name=name).update(reference_count=0)
@@ -1,3 +1,1051 @@
-from django.test import TestCase
+import csv
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import zlib
 
-# Create your tests here.
+from datetime import date, timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.test import (RequestFactory, SimpleTestCase, TestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
+import brotli
+import msgpack
+from PIL import Image as PILImage
+from rest_framework.test import APIClient
+
+from botekana.middleware import CompressionMiddleware
+from botekana.renderers import FastJSONRenderer
+from users.models import Cart, CartItem, User, WishlistItem
+from . import (images, importer, ledger, models, search, storage, tree,
+               variants, views)
+from .caching import get_tag_versions
+from .pagination import KeysetPagination
+
+
+class CatalogMixin:
+    def create_product(self, sku, **fields):
+        # Created in bulk, the save signals would render renditions.
+        values = dict(
+            sku=sku, name=sku, name_ar='منتج', description='-',
+            description_ar='-', colors='red', colors_ar='أحمر', sizes='1',
+            image='%s.jpg' % sku, price=10, effective_price=10, quantity=5,
+            brand=self.brand, category=self.category,
+            sub_category=self.sub_category)
+        values.update(fields)
+        models.Product.objects.bulk_create([models.Product(**values)])
+        return models.Product.objects.get(sku=sku)
+
+    def setUp(self):
+        cache.clear()
+        self.brand = models.Brand.objects.create(name='Brand',
+                                                 name_ar='علامة')
+        self.category = models.Category.objects.create(name='Category',
+                                                       name_ar='فئة')
+        self.sub_category = models.SubCategory.objects.create(
+            name='Sub', name_ar='فرعية')
+        self.user = User.objects.create(username='shopper')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+
+class ProductListTests(CatalogMixin, TestCase):
+    def test_query_count_is_constant(self):
+        for index in range(12):
+            product = self.create_product('p%d' % index)
+            models.Image.objects.bulk_create([
+                models.Image(image='p%d-%d.jpg' % (index, image),
+                             product=product)
+                for image in range(2)])
+            models.Discount.objects.create(
+                product=product, percentage=10,
+                finish_date=date.today() + timedelta(days=1))
+        WishlistItem.objects.create(user=self.user, product=product)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/products/', {'limit': 2})
+        self.assertEqual(len(response.data['results']), 2)
+        cache.clear()
+        with self.assertNumQueries(len(queries)):
+            response = self.client.get('/api/products/', {'limit': 12})
+        self.assertEqual(len(response.data['results']), 12)
+        self.assertEqual(len(response.data['results'][0]['images']), 2)
+        self.assertEqual(len(response.data['results'][0]['discounts']), 1)
+        self.assertTrue(response.data['results'][0]['in_wishlist'])
+
+
+class FacetTests(CatalogMixin, TestCase):
+    def get_facets(self, **params):
+        response = self.client.get('/api/products/facets/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_counts(self):
+        other = models.Brand.objects.create(name='Other', name_ar='أخرى')
+        shirt = self.create_product('shirt', colors='red,blue',
+                                    colors_ar='أحمر,أزرق', sizes='1,2')
+        jeans = self.create_product('jeans', colors='blue', colors_ar='أزرق',
+                                    price=60, effective_price=60,
+                                    brand=other)
+        variants.sync_variants([shirt.pk, jeans.pk])
+        facets = self.get_facets()
+        self.assertEqual(facets['count'], 2)
+        self.assertEqual([(row['name'], row['count'])
+                          for row in facets['brands']],
+                         [('Brand', 1), ('Other', 1)])
+        self.assertEqual(facets['categories'][0]['count'], 2)
+        self.assertEqual([(row['color'], row['count'])
+                          for row in facets['colors']],
+                         [('blue', 2), ('red', 1)])
+        self.assertEqual([row['count'] for row in facets['prices']],
+                         [1, 1, 0, 0, 0, 0])
+        # Facets follow the filters, a product counts once per color.
+        facets = self.get_facets(color='red')
+        self.assertEqual(facets['count'], 1)
+        self.assertEqual([row['name'] for row in facets['brands']],
+                         ['Brand'])
+        self.assertEqual([(row['color'], row['count'])
+                          for row in facets['colors']],
+                         [('blue', 1), ('red', 1)])
+
+    def test_cached_until_products_change(self):
+        shirt = self.create_product('shirt')
+        self.assertEqual(self.get_facets()['count'], 1)
+        # Bulk inserts send no signals, the cached counts stay.
+        self.create_product('jeans')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_facets()['count'], 1)
+        # The limit doesn't change the counts, it shares the entry.
+        with self.assertNumQueries(0):
+            self.get_facets(limit=5)
+        shirt.save()
+        self.assertEqual(self.get_facets()['count'], 2)
+
+
+class DiscountTests(CatalogMixin, TestCase):
+    def get_prices(self, product):
+        product.refresh_from_db()
+        return (product.active_discount_percentage, product.effective_price)
+
+    def test_effective_price_follows_discounts(self):
+        shirt = self.create_product('shirt', price=100, effective_price=100)
+        tomorrow = date.today() + timedelta(days=1)
+        models.Discount.objects.create(
+            product=shirt, percentage=50, start_date=tomorrow,
+            finish_date=tomorrow + timedelta(days=1))
+        self.assertEqual(self.get_prices(shirt), (0, 100))
+        models.Discount.objects.create(product=shirt, percentage=10,
+                                       finish_date=tomorrow)
+        best = models.Discount.objects.create(product=shirt, percentage=30,
+                                              finish_date=tomorrow)
+        self.assertEqual(self.get_prices(shirt), (30, 70))
+        response = self.client.get('/api/products/',
+                                   {'price_max': 75, 'limit': 10})
+        self.assertEqual([row['sku'] for row in response.data['results']],
+                         ['shirt'])
+        best.delete()
+        self.assertEqual(self.get_prices(shirt), (10, 90))
+
+    def test_expire_discounts(self):
+        today = date.today()
+        finished = self.create_product(
+            'finished', price=100, effective_price=50,
+            active_discount_percentage=50)
+        started = self.create_product('started', price=100,
+                                      effective_price=100)
+        untouched = self.create_product('untouched', price=100,
+                                        effective_price=100)
+        # Created in bulk, as if the dates had just passed.
+        models.Discount.objects.bulk_create([
+            models.Discount(product=finished, percentage=50,
+                            finish_date=today),
+            models.Discount(product=started, percentage=20, start_date=today,
+                            finish_date=today + timedelta(days=1)),
+        ])
+        out = StringIO()
+        call_command('expire_discounts', stdout=out)
+        self.assertIn('Refreshed prices of 2 products.', out.getvalue())
+        self.assertEqual(self.get_prices(finished), (0, 100))
+        self.assertEqual(self.get_prices(started), (20, 80))
+        self.assertEqual(self.get_prices(untouched), (0, 100))
+
+
+class ProductGroupTests(CatalogMixin, TestCase):
+    def test_paginated_products(self):
+        for index in range(5):
+            product = self.create_product('p%d' % index)
+            models.Image.objects.bulk_create([
+                models.Image(image='p%d.jpg' % index, product=product)])
+            models.Discount.objects.create(
+                product=product, percentage=10,
+                finish_date=date.today() + timedelta(days=1))
+        url = '/api/products/categories/%d/' % self.category.pk
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'products_limit': 1})
+        self.assertEqual(len(response.data['products']), 1)
+        with self.assertNumQueries(len(queries)):
+            response = self.client.get(url, {'products_limit': 2})
+        self.assertEqual(response.data['products_count'], 5)
+        skus = [row['sku'] for row in response.data['products']]
+        self.assertEqual(len(response.data['products'][0]['images']), 1)
+        self.assertEqual(len(response.data['products'][0]['discounts']), 1)
+        # The next link continues the embedded page in the product list.
+        next_url = response.data['products_next']
+        while next_url:
+            response = self.client.get(next_url)
+            skus += [row['sku'] for row in response.data['results']]
+            next_url = response.data['next']
+        self.assertEqual(skus, ['p4', 'p3', 'p2', 'p1', 'p0'])
+
+    def test_all_products_fit(self):
+        self.create_product('shirt')
+        response = self.client.get(
+            '/api/products/brands/%d/' % self.brand.pk)
+        self.assertEqual(response.data['products_count'], 1)
+        self.assertIsNone(response.data['products_next'])
+
+
+class CategoryTreeTests(CatalogMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        # The snapshot is per process, start every test from scratch.
+        tree.snapshot = tree.TreeSnapshot()
+
+    def test_tree(self):
+        self.sub_category.categories.add(self.category)
+        models.Image.objects.bulk_create([
+            models.Image(image='old.jpg', category=self.category),
+            models.Image(image='new.jpg', category=self.category),
+            models.Image(image='sub.jpg', sub_category=self.sub_category)])
+        self.create_product('shirt')
+        self.create_product('jeans')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/products/tree/')
+        [category] = response.data
+        self.assertEqual((category['name'], category['product_count']),
+                         ('Category', 2))
+        self.assertTrue(category['image']['image'].endswith('new.jpg'))
+        [sub_category] = category['sub_categories']
+        self.assertEqual((sub_category['name'],
+                          sub_category['product_count']), ('Sub', 2))
+        self.assertTrue(sub_category['image']['image'].endswith('sub.jpg'))
+
+        # More rows don't take more queries.
+        for index in range(3):
+            other = models.Category.objects.create(name='Other %d' % index,
+                                                   name_ar='أخرى')
+            self.sub_category.categories.add(other)
+            models.Image.objects.create(image='o%d.jpg' % index,
+                                        category=other)
+        with self.assertNumQueries(len(queries)):
+            response = self.client.get('/api/products/tree/')
+        self.assertEqual(len(response.data), 4)
+
+    def test_snapshot_is_rebuilt_on_changes(self):
+        self.client.get('/api/products/tree/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/products/tree/')
+        self.assertEqual(response.data[0]['product_count'], 0)
+        # Bulk inserts send no signals, the snapshot stays.
+        shirt = self.create_product('shirt')
+        with self.assertNumQueries(0):
+            self.client.get('/api/products/tree/')
+        shirt.save()
+        response = self.client.get('/api/products/tree/')
+        self.assertEqual(response.data[0]['product_count'], 1)
+        self.category.name = 'Renamed'
+        self.category.save()
+        response = self.client.get('/api/products/tree/')
+        self.assertEqual(response.data[0]['name'], 'Renamed')
+
+
+class ExportTests(CatalogMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user.is_staff = True
+        self.user.save()
+        for sku, price in [('shirt', 10), ('jeans', 30), ('hat', 50)]:
+            self.create_product(sku, price=price, effective_price=price)
+
+    def export(self, params=None, **headers):
+        response = self.client.get('/api/products/export/', params,
+                                   **headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response
+
+    def test_csv(self):
+        response = self.export({'price_max': 30})
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertEqual(response['Content-Disposition'],
+                         'attachment; filename="products.csv"')
+        rows = list(csv.DictReader(StringIO(
+            b''.join(response.streaming_content).decode('utf-8'))))
+        self.assertEqual([(row['sku'], row['brand'], row['colors_ar'])
+                          for row in rows],
+                         [('jeans', 'Brand', 'أحمر'),
+                          ('shirt', 'Brand', 'أحمر')])
+
+    def test_ndjson(self):
+        for params, headers in [
+                ({'export_format': 'ndjson'}, {}),
+                (None, {'HTTP_ACCEPT': 'application/x-ndjson'})]:
+            response = self.export(params, **headers)
+            self.assertEqual(response['Content-Type'],
+                             'application/x-ndjson; charset=utf-8')
+            rows = [json.loads(line) for line in b''.join(
+                response.streaming_content).decode('utf-8').splitlines()]
+            self.assertEqual([row['sku'] for row in rows],
+                             ['hat', 'jeans', 'shirt'])
+            self.assertEqual(rows[0]['price'], 50)
+
+    def test_accept_header(self):
+        response = self.export(HTTP_ACCEPT='text/csv')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        # Errors are answered in JSON whatever format was asked for.
+        response = self.client.get('/api/products/export/',
+                                   {'export_format': 'xml'},
+                                   HTTP_ACCEPT='text/csv')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('export_format', json.loads(response.content))
+        self.client.force_authenticate(User.objects.create(username='x'))
+        response = self.client.get('/api/products/export/',
+                                   HTTP_ACCEPT='text/csv')
+        self.assertEqual(response.status_code, 403)
+
+    def test_rows_are_streamed_in_chunks(self):
+        with mock.patch.object(views.ProductExportView,
+                               'export_chunk_size', 2):
+            response = self.export()
+            # Nothing is read until the body is.
+            with self.assertNumQueries(0):
+                chunks = iter(response.streaming_content)
+                self.assertTrue(next(chunks).startswith(b'id,sku,'))
+            self.assertEqual(next(chunks).count(b'\n'), 2)
+            self.assertEqual(next(chunks).count(b'\n'), 1)
+            self.assertEqual(list(chunks), [])
+
+
+class SparseFieldsetTests(CatalogMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        for index in range(3):
+            product = self.create_product('p%d' % index)
+            models.Image.objects.bulk_create([
+                models.Image(image='p%d.jpg' % index, product=product)])
+
+    def get_rows(self, **params):
+        response = self.client.get('/api/products/', dict(params, limit=10))
+        self.assertEqual(response.status_code, 200)
+        return response.data['results']
+
+    def test_shapes(self):
+        rows = self.get_rows(fields='id,name,price')
+        self.assertEqual(set(rows[0]), {'id', 'name', 'price'})
+        rows = self.get_rows(omit='description,description_ar,images')
+        self.assertFalse({'description', 'description_ar', 'images'} &
+                         set(rows[0]))
+        self.assertIn('name_ar', rows[0])
+        image_id = models.Image.objects.get(image='p0.jpg').pk
+        rows = self.get_rows(expand='')
+        self.assertEqual(rows[-1]['images'], [image_id])
+        rows = self.get_rows(fields='sku,images.image')
+        self.assertEqual(rows[-1]['sku'], 'p0')
+        self.assertEqual(list(rows[-1]['images'][0]), ['image'])
+        rows = self.get_rows(omit='images.renditions')
+        self.assertNotIn('renditions', rows[0]['images'][0])
+        self.assertIn('image', rows[0]['images'][0])
+
+    def test_skipped_fields_skip_their_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.get_rows(fields='id,name')
+        tables = ' '.join(query['sql'] for query in queries)
+        for table in ('products_image', 'products_discount',
+                      'products_brand', 'users_wishlistitem'):
+            self.assertNotIn(table, tables)
+        cache.clear()
+        with CaptureQueriesContext(connection) as full:
+            self.get_rows()
+        # Images and discounts are prefetched, the wishlist is overlaid.
+        self.assertEqual(len(full), len(queries) + 3)
+
+
+class RendererTests(CatalogMixin, TestCase):
+    def test_msgpack_responses(self):
+        self.create_product('shirt')
+        response = self.client.get('/api/products/', {'limit': 5},
+                                   HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        data = msgpack.unpackb(response.content, raw=False)
+        self.assertEqual(data['results'][0]['sku'], 'shirt')
+        self.assertEqual(data['results'][0]['name_ar'], 'منتج')
+        # JSON stays the default.
+        response = self.client.get('/api/products/', {'limit': 5})
+        self.assertEqual(response['Content-Type'], 'application/json')
+
+    def test_msgpack_requests(self):
+        shirt = self.create_product('shirt')
+        response = self.client.post(
+            '/api/users/wishlist/', msgpack.packb({'product_id': shirt.pk}),
+            content_type='application/msgpack')
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(WishlistItem.objects.filter(
+            user=self.user, product=shirt).exists())
+
+    def test_malformed_bodies(self):
+        for body, content_type in [(b'\xc1', 'application/msgpack'),
+                                   (b'{"product_id": ', 'application/json'),
+                                   (b'{"a": NaN}', 'application/json')]:
+            response = self.client.post('/api/users/wishlist/', body,
+                                        content_type=content_type)
+            self.assertEqual(response.status_code, 400, body)
+
+    def test_non_finite_floats_raise(self):
+        renderer = FastJSONRenderer()
+        data = {'products': [{'price': 1.5, 'brand': None}]}
+        self.assertEqual(renderer.render(data),
+                         b'{"products":[{"price":1.5,"brand":null}]}')
+        for value in (float('nan'), float('inf'), float('-inf')):
+            data['products'][0]['price'] = value
+            # Both the orjson and the indented, stdlib, encoders refuse.
+            for media_type in ('application/json',
+                               'application/json; indent=2'):
+                with self.assertRaises(ValueError):
+                    renderer.render(data, media_type)
+
+
+@override_settings(COMPRESSION_MIN_SIZE=100)
+class CompressionTests(SimpleTestCase):
+    body = json.dumps([{'name': 'shirt %d' % i} for i in range(50)]).encode()
+
+    def process(self, response, accept='gzip, deflate, br'):
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING=accept)
+        return CompressionMiddleware(lambda request: response)(request)
+
+    def json_response(self, body=None, **kwargs):
+        return HttpResponse(self.body if body is None else body,
+                            content_type='application/json', **kwargs)
+
+    def test_size_threshold(self):
+        response = self.process(self.json_response(b'[]'))
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response.content, b'[]')
+        response = self.process(self.json_response())
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(response.content), self.body)
+        self.assertEqual(response['Content-Length'],
+                         str(len(response.content)))
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+
+    def test_encoding_preference(self):
+        for accept, encoding in [('gzip', 'gzip'),
+                                 ('br;q=0, gzip', 'gzip'),
+                                 ('gzip;q=0.5, br;q=0.8', 'br'),
+                                 ('*', 'br'),
+                                 ('identity', None),
+                                 ('br;q=0, gzip;q=0', None)]:
+            response = self.process(self.json_response(), accept)
+            self.assertEqual(response.get('Content-Encoding'), encoding,
+                             accept)
+        response = self.process(self.json_response(), 'gzip')
+        self.assertEqual(gzip.decompress(response.content), self.body)
+
+    def test_etags_are_weakened(self):
+        response = self.json_response()
+        response['ETag'] = '"abc"'
+        self.assertEqual(self.process(response)['ETag'], 'W/"abc"')
+        response = self.json_response()
+        response['ETag'] = 'W/"abc"'
+        self.assertEqual(self.process(response)['ETag'], 'W/"abc"')
+
+    def test_skipped_responses(self):
+        encoded = self.json_response()
+        encoded['Content-Encoding'] = 'gzip'
+        partial = self.json_response(status=206)
+        image = HttpResponse(self.body, content_type='image/png')
+        file = FileResponse(BytesIO(self.body),
+                            content_type='application/json')
+        for response in (encoded, partial, image, file):
+            result = self.process(response)
+            self.assertIs(result, response)
+            self.assertFalse(result.has_header('Vary'))
+        self.assertEqual(encoded['Content-Encoding'], 'gzip')
+        self.assertEqual(partial.content, self.body)
+
+    def test_streaming(self):
+        produced = []
+
+        def chunks():
+            for index in range(3):
+                produced.append(index)
+                yield b'{"row": %d}\n' % index
+
+        response = self.process(StreamingHttpResponse(
+            chunks(), content_type='application/x-ndjson'), 'gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertFalse(response.has_header('Content-Length'))
+        parts = iter(response.streaming_content)
+        # Every chunk is flushed as soon as it's produced.
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.assertEqual(decompressor.decompress(next(parts)),
+                         b'{"row": 0}\n')
+        self.assertEqual(produced, [0])
+        body = b''.join(decompressor.decompress(part) for part in parts)
+        self.assertEqual(body, b'{"row": 1}\n{"row": 2}\n')
+
+
+class CachedListTests(CatalogMixin, TestCase):
+    def get_wishlisted(self, client, **headers):
+        response = client.get('/api/products/', **headers)
+        self.assertEqual(response.status_code, 200)
+        content = response.content
+        if response.get('Content-Encoding') == 'gzip':
+            content = gzip.decompress(content)
+        return {row['sku'] for row in json.loads(content)
+                if row['in_wishlist']}
+
+    def test_wishlist_flags_stay_per_user(self):
+        # Enough products for the shared response to be compressed.
+        for index in range(6):
+            self.create_product('p%d' % index)
+        shirt = self.create_product('shirt')
+        WishlistItem.objects.create(user=self.user, product=shirt)
+        other = APIClient()
+        other.force_authenticate(User.objects.create(username='other'))
+        anonymous = APIClient()
+        # The anonymous response is cached rendered and shared.
+        response = anonymous.get('/api/products/',
+                                 HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(self.get_wishlisted(anonymous,
+                                             HTTP_ACCEPT_ENCODING='gzip'),
+                         set())
+        self.assertEqual(self.get_wishlisted(self.client), {'shirt'})
+        self.assertEqual(self.get_wishlisted(other), set())
+        self.assertEqual(self.get_wishlisted(self.client), {'shirt'})
+        self.assertEqual(self.get_wishlisted(anonymous), set())
+
+
+class KeysetPaginationTests(CatalogMixin, TestCase):
+    def get_page(self, url, params=None):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return ([row['price'] for row in response.data['results']],
+                response.data['next'])
+
+    def test_pages_are_stable_under_inserts(self):
+        for price in range(1, 6):
+            self.create_product('p%d' % price, price=price)
+        prices, next_url = self.get_page('/api/products/', {
+            'pagination': 'cursor', 'ordering': 'price', 'limit': 2})
+        self.assertEqual(prices, [1, 2])
+        # Rows inserted before the cursor don't shift the next page.
+        self.create_product('cheap', price=0.5)
+        self.create_product('between', price=1.5)
+        prices, next_url = self.get_page(next_url)
+        self.assertEqual(prices, [3, 4])
+        prices, next_url = self.get_page(next_url)
+        self.assertEqual((prices, next_url), ([5], None))
+
+    def test_invalid_cursor(self):
+        for cursor in ('not-base64!', 'e30=',
+                       KeysetPagination().encode_cursor({
+                           'ordering': 'quantity', 'value': 1, 'pk': 1,
+                           'reverse': False}),
+                       KeysetPagination().encode_cursor({
+                           'ordering': 'price', 'value': 'cheap', 'pk': 1,
+                           'reverse': False}),
+                       KeysetPagination().encode_cursor({
+                           'ordering': '-date_added', 'value': None,
+                           'pk': 1, 'reverse': False}),
+                       KeysetPagination().encode_cursor({
+                           'ordering': '-id', 'value': 1, 'pk': None,
+                           'reverse': False})):
+            response = self.client.get('/api/products/',
+                                       {'cursor': cursor})
+            self.assertEqual(response.status_code, 400, cursor)
+
+
+class SearchTests(CatalogMixin, TestCase):
+    def search(self, query):
+        response = self.client.get('/api/products/', {'search': query})
+        self.assertEqual(response.status_code, 200)
+        return [row['sku'] for row in response.data]
+
+    def test_arabic_folding_and_diacritics(self):
+        shoes = self.create_product('shoes', name='Running shoes',
+                                    name_ar='أحذية رياضيّة')
+        dress = self.create_product('dress', name='Dress',
+                                    name_ar='فُسْتَان سهرة')
+        search.update_search_documents([shoes.pk, dress.pk])
+        # Hamza, ta marbuta and shadda are folded away on both sides.
+        self.assertEqual(self.search('احذيه رياضية'), ['shoes'])
+        self.assertEqual(self.search('فستان'), ['dress'])
+        self.assertEqual(self.search('فَسْتان'), ['dress'])
+        self.assertEqual(self.search('RUNN'), ['shoes'])
+        self.assertEqual(self.search('جاكيت'), [])
+
+
+class ConditionalGetTests(CatalogMixin, TestCase):
+    def test_wishlist_changes_revalidate(self):
+        shirt = self.create_product('shirt')
+        url = '/api/products/%d/' % shirt.pk
+        response = self.client.get(url)
+        self.assertFalse(response.data['in_wishlist'])
+        etag = response['ETag']
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        item = WishlistItem.objects.create(user=self.user, product=shirt)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['in_wishlist'])
+        item.delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.data['in_wishlist'])
+        # Only the user's own validators change, the product isn't written.
+        self.assertEqual(models.Product.objects.get(pk=shirt.pk).updated_at,
+                         shirt.updated_at)
+
+    def test_sub_category_changes_revalidate(self):
+        shirt = self.create_product('shirt')
+        url = '/api/products/%d/' % shirt.pk
+        etag = self.client.get(url)['ETag']
+        self.sub_category.name_ar = 'أخرى'
+        self.sub_category.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class CommandTests(CatalogMixin, TestCase):
+    def test_benchmark_renderers(self):
+        shirt = self.create_product('shirt')
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.bulk_create([CartItem(
+            cart=cart, product=shirt, quantity=1, color='red', size=1,
+            price=10)])
+        out = StringIO()
+        call_command('benchmark_renderers', limit=5, repeat=1, stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 6)
+        self.assertTrue(lines[0].startswith('products  json'))
+        # Both lists rendered their row.
+        self.assertTrue(all(int(line.split()[2]) > 100 for line in lines))
+
+
+class MediaMixin:
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings = override_settings(MEDIA_ROOT=self.media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def write_media(self, name, content):
+        path = os.path.join(self.media_root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as file:
+            file.write(content)
+        return path
+
+
+class MediaTests(MediaMixin, TestCase):
+    def test_internal_files_are_not_served(self):
+        self.write_media('tmp/gc_media.checkpoint', b'ab/cd')
+        self.write_media('tmp/upload', b'partial')
+        for path in ('tmp/gc_media.checkpoint', 'tmp/upload',
+                     'ab/../tmp/upload'):
+            self.assertEqual(self.client.get('/media/' + path).status_code,
+                             404, path)
+
+    def test_ranges_and_validators(self):
+        name = 'ab/cd/%s.txt' % ('ab' * 32)
+        self.write_media(name, b'0123456789')
+        url = '/media/' + name
+        response = self.client.get(url)
+        self.assertEqual(b''.join(response.streaming_content),
+                         b'0123456789')
+        self.assertIn('immutable', response['Cache-Control'])
+        etag = response['ETag']
+        self.assertEqual(self.client.get(
+            url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get(
+            url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+        ).status_code, 304)
+
+        for header, content, content_range in (
+                ('bytes=2-4', b'234', 'bytes 2-4/10'),
+                ('bytes=7-', b'789', 'bytes 7-9/10'),
+                ('bytes=-2', b'89', 'bytes 8-9/10'),
+                ('bytes=8-100', b'89', 'bytes 8-9/10')):
+            response = self.client.get(url, HTTP_RANGE=header)
+            self.assertEqual(response.status_code, 206, header)
+            self.assertEqual(b''.join(response.streaming_content), content)
+            self.assertEqual(response['Content-Range'], content_range)
+            self.assertEqual(response['Content-Length'], str(len(content)))
+
+        response = self.client.get(url, HTTP_RANGE='bytes=10-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */10')
+        # A stale If-Range gets the whole file, a malformed range too.
+        for headers in ({'HTTP_RANGE': 'bytes=2-4',
+                         'HTTP_IF_RANGE': '"stale"'},
+                        {'HTTP_RANGE': 'bytes=0-1,4-5'}):
+            response = self.client.get(url, **headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(b''.join(response.streaming_content),
+                             b'0123456789')
+
+    def test_format_negotiation(self):
+        for extension in ('jpg', 'webp', 'avif'):
+            self.write_media('shirt.' + extension, extension.encode())
+        for accept, content in (
+                ('image/avif,image/webp,image/*,*/*;q=0.8', b'avif'),
+                ('image/webp,image/avif', b'avif'),
+                ('image/avif;q=0,image/webp', b'webp'),
+                ('image/avif;q=0.5, image/webp', b'webp'),
+                ('image/avif;q=oops, image/webp', b'webp'),
+                ('IMAGE/AVIF', b'avif'),
+                ('image/*,*/*', b'jpg'),
+                ('', b'jpg')):
+            response = self.client.get('/media/shirt.jpg',
+                                       HTTP_ACCEPT=accept)
+            self.assertEqual(b''.join(response.streaming_content), content,
+                             accept)
+            self.assertIn('Accept', response['Vary'])
+        os.remove(os.path.join(self.media_root, 'shirt.avif'))
+        response = self.client.get('/media/shirt.jpg',
+                                   HTTP_ACCEPT='image/avif,image/webp')
+        self.assertEqual(b''.join(response.streaming_content), b'webp')
+
+
+class ImageUploadTests(MediaMixin, CatalogMixin, TestCase):
+    def upload(self, product, **files):
+        return self.client.post('/api/products/%d/images/' % product.pk,
+                                files, format='multipart')
+
+    def png(self, name):
+        image = BytesIO()
+        PILImage.new('RGB', (4, 4), 'red').save(image, 'PNG')
+        return SimpleUploadedFile(name, image.getvalue(), 'image/png')
+
+    def tmp_files(self):
+        return os.listdir(os.path.join(self.media_root, 'tmp'))
+
+    def test_uploads_are_stored_once(self):
+        shirt = self.create_product('shirt')
+        response = self.upload(shirt, front=self.png('front.png'),
+                               back=self.png('back.png'))
+        self.assertEqual(response.status_code, 201)
+        names = set(shirt.images.values_list('image', flat=True))
+        # Both uploads have the same content, it's stored once.
+        self.assertEqual(len(names), 1)
+        [name] = names
+        self.assertTrue(name.endswith('.png'))
+        self.assertEqual(models.StoredFile.objects.get(
+            name=name).reference_count, 2)
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, name)))
+        self.assertEqual(self.tmp_files(), [])
+
+    def test_rejects_what_isnt_an_image(self):
+        shirt = self.create_product('shirt')
+        response = self.upload(
+            shirt, front=self.png('front.png'),
+            notes=SimpleUploadedFile('notes.png', b'not an image at all'),
+            empty=SimpleUploadedFile('empty.png', b''))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(sorted(response.data['details']),
+                         ['empty', 'notes'])
+        self.assertFalse(shirt.images.exists())
+        self.assertEqual(self.tmp_files(), [])
+
+
+class ImporterTests(MediaMixin, CatalogMixin, TestCase):
+    def test_upserts_and_reports_row_errors(self):
+        self.write_media('new.jpg', b'jpeg')
+        old = self.create_product('old', quantity=7)
+        models.StockMovement.objects.create(
+            product=old, change=7, reason=models.StockMovement.OPENING,
+            is_settled=True)
+        other = self.create_product('other')
+        models.StockMovement.objects.create(
+            product=other, change=5, reason=models.StockMovement.OPENING,
+            is_settled=True)
+        pending = models.StockMovement.objects.create(
+            product=other, change=-1, reason=models.StockMovement.SALE)
+        rows = importer.read_csv(StringIO(
+            'sku,name,name_ar,description,description_ar,colors,colors_ar,'
+            'sizes,image,price,quantity,brand,category,sub_category\n'
+            'old,Renamed,,,,,,,,,3,,,\n'
+            'new,New,جديد,d,د,red,أحمر,1,new.jpg,4.5,2,brand,فئة,Sub\n'
+            'new,Newer,جديد,d,د,red,أحمر,1,new.jpg,4.5,2,brand,فئة,Sub\n'
+            'bad,Bad,,,,,,,,cheap,,Nobody,,\n'
+            'partial,Partial,,,,,,,,,,,,\n'
+            ',No sku,,,,,,,,,,,,\n'))
+        report = importer.CatalogImporter(chunk_size=2).run(rows)
+        # The second `new` row, in the next chunk, updates the first.
+        self.assertEqual((report['created'], report['updated'],
+                          report['failed']), (1, 2, 3))
+        self.assertEqual(
+            [(error['line'], error['sku'], sorted(error['errors']))
+             for error in report['errors']],
+            [(5, 'bad', ['brand', 'price']),
+             (7, '', ['sku']),
+             (6, 'partial', ['brand', 'category', 'colors', 'colors_ar',
+                             'description', 'description_ar', 'image',
+                             'name_ar', 'price', 'quantity', 'sizes',
+                             'sub_category'])])
+        old.refresh_from_db()
+        self.assertEqual((old.name, old.quantity, old.price),
+                         ('Renamed', 3, 10))
+        new = models.Product.objects.get(sku='new')
+        self.assertEqual((new.name, new.brand, new.category, new.quantity),
+                         ('Newer', self.brand, self.category, 2))
+        self.assertEqual(list(new.variants.values_list('color', 'size')),
+                         [('red', 1)])
+        self.assertEqual(models.StoredFile.objects.get(
+            name='new.jpg').reference_count, 1)
+        self.assertFalse(ledger.get_unreconciled().exists())
+        # Only the imported products' movements are settled.
+        pending.refresh_from_db()
+        self.assertFalse(pending.is_settled)
+
+
+class StorageTests(MediaMixin, CatalogMixin, TestCase):
+    def age(self, name):
+        path = os.path.join(self.media_root, name)
+        hour_ago = os.stat(path).st_mtime - 2 * 60 * 60
+        os.utime(path, (hour_ago, hour_ago))
+
+    def test_reference_counts_and_gc(self):
+        shirt = self.create_product('shirt')
+        first, second = [
+            models.Image.objects.create(
+                image=ContentFile(b'same bytes', name='upload.jpg'),
+                product=shirt)
+            for _ in range(2)]
+        name = first.image.name
+        # Identical content is stored once, under its hash.
+        self.assertEqual(name, second.image.name)
+        self.assertEqual(name, storage.hashed_name(
+            hashlib.sha256(b'same bytes').hexdigest(), '.jpg'))
+        stored = models.StoredFile.objects.get(name=name)
+        self.assertEqual((stored.reference_count, stored.size), (2, 10))
+
+        rendition = name.replace('.jpg', '__thumbnail.jpg')
+        self.write_media(rendition, b'small')
+        self.write_media('orphan.jpg', b'old')
+        self.write_media('fresh.jpg', b'new')
+        self.write_media('tmp/upload', b'partial')
+        for old in (name, rendition, 'orphan.jpg', 'tmp/upload'):
+            self.age(old)
+
+        first.delete()
+        self.assertEqual(models.StoredFile.objects.get(
+            name=name).reference_count, 1)
+        call_command('gc_media', stdout=StringIO())
+        media = set()
+        for directory, _, files in os.walk(self.media_root):
+            media.update(os.path.relpath(os.path.join(directory, file),
+                                         self.media_root).replace(os.sep, '/')
+                         for file in files)
+        # Only the old orphan goes; the file in use keeps its rendition.
+        self.assertEqual(media, {name, rendition, 'fresh.jpg',
+                                 'tmp/upload'})
+
+        second.delete()
+        self.assertEqual(models.StoredFile.objects.get(
+            name=name).reference_count, 0)
+        call_command('gc_media', stdout=StringIO())
+        self.assertFalse(os.path.exists(os.path.join(self.media_root,
+                                                     name)))
+        self.assertFalse(os.path.exists(os.path.join(self.media_root,
+                                                     rendition)))
+        self.assertFalse(models.StoredFile.objects.filter(
+            name=name).exists())
+
+    def test_quarantine(self):
+        self.write_media('orphan.jpg', b'old')
+        self.age('orphan.jpg')
+        for inside in (self.media_root, os.path.join(self.media_root, 'gc'),
+                       os.path.join(self.media_root, 'ab', '..', 'gc')):
+            with self.assertRaises(CommandError):
+                call_command('gc_media', quarantine=inside,
+                             stdout=StringIO())
+        self.assertTrue(os.path.exists(os.path.join(self.media_root,
+                                                    'orphan.jpg')))
+        quarantine = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, quarantine)
+        call_command('gc_media', quarantine=quarantine, stdout=StringIO())
+        self.assertFalse(os.path.exists(os.path.join(self.media_root,
+                                                     'orphan.jpg')))
+        with open(os.path.join(quarantine, 'orphan.jpg'), 'rb') as file:
+            self.assertEqual(file.read(), b'old')
+
+
+class RenditionTests(MediaMixin, CatalogMixin, TestCase):
+    def write_image(self, name):
+        image = BytesIO()
+        PILImage.new('RGB', (40, 20), 'red').save(image, 'JPEG')
+        self.write_media(name, image.getvalue())
+
+    @override_settings(IMAGE_WORKERS=0,
+                       IMAGE_RENDITIONS={'thumbnail': 10, 'medium': 20})
+    def test_batch_invalidates_the_cache_once(self):
+        names = ['a.jpg', 'b.jpg', 'c.jpg']
+        for name in names:
+            self.write_image(name)
+            self.create_product(name[0], image=name)
+        models.Image.objects.bulk_create([models.Image(
+            image='a.jpg', product=models.Product.objects.get(sku='a'))])
+        product, image, brand = get_tag_versions(
+            ['product', 'image', 'brand'])
+        with self.assertLogs('products.images', 'ERROR'):
+            images.submit(names + ['missing.jpg'])
+        # Every image is stored, then each tag changed moves once.
+        self.assertEqual(get_tag_versions(['product', 'image', 'brand']),
+                         [product + 1, image + 1, brand])
+        for row in models.Product.objects.all():
+            renditions = json.loads(row.renditions)['renditions']
+            self.assertEqual(renditions['medium']['width'], 20)
+            self.assertTrue(os.path.exists(os.path.join(
+                self.media_root, renditions['thumbnail']['jpeg'])))
+        self.assertNotEqual(models.Image.objects.get().renditions, '')
+
+    @override_settings(IMAGE_WORKERS=0, IMAGE_RENDITIONS={'thumbnail': 10})
+    def test_renditions_revalidate_product_gets(self):
+        self.write_image('shirt.jpg')
+        shirt = self.create_product('shirt', image='shirt.jpg')
+        url = '/api/products/%d/' % shirt.pk
+        response = self.client.get(url)
+        self.assertEqual(response.data['renditions'], {})
+        images.submit(['shirt.jpg'])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('thumbnail', response.data['renditions'])
+
+
+class LedgerWritePathTests(MediaMixin, CatalogMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user.is_staff = self.user.is_superuser = True
+        self.user.save()
+        self.client.force_login(self.user)
+
+    def get_form_data(self, **fields):
+        data = {
+            'sku': 'shirt', 'name': 'Shirt', 'name_ar': 'قميص',
+            'description': '-', 'description_ar': '-', 'colors': 'red',
+            'colors_ar': 'أحمر', 'sizes': '1', 'price': '10',
+            'quantity': '5', 'brand': self.brand.pk,
+            'category': self.category.pk,
+            'sub_category': self.sub_category.pk,
+            'variants-TOTAL_FORMS': '0', 'variants-INITIAL_FORMS': '0',
+        }
+        data.update(fields)
+        return data
+
+    def get_png(self):
+        content = BytesIO()
+        PILImage.new('RGB', (1, 1)).save(content, 'PNG')
+        return SimpleUploadedFile('shirt.png', content.getvalue(),
+                                  'image/png')
+
+    def test_admin_saves_go_through_the_ledger(self):
+        response = self.client.post(
+            '/admin/products/product/add/',
+            self.get_form_data(image=self.get_png()))
+        self.assertEqual(response.status_code, 302)
+        shirt = models.Product.objects.get(sku='shirt')
+        self.assertEqual(
+            list(shirt.stock_movements.values_list('reason', 'change')),
+            [(models.StockMovement.OPENING, 5)])
+        self.assertFalse(ledger.get_unreconciled().exists())
+
+        models.Product.objects.filter(pk=shirt.pk).update(reserved=2)
+        response = self.client.post(
+            '/admin/products/product/%d/change/' % shirt.pk,
+            self.get_form_data(quantity='8', name='Shirt 2'))
+        self.assertEqual(response.status_code, 302)
+        shirt.refresh_from_db()
+        # Appended, not written over the quantity or the holds.
+        self.assertEqual((shirt.name, shirt.quantity, shirt.reserved),
+                         ('Shirt 2', 5, 2))
+        self.assertEqual(ledger.get_balances([shirt.pk]), {shirt.pk: 8})
+        ledger.compact()
+        shirt.refresh_from_db()
+        self.assertEqual(shirt.quantity, 8)
+        self.assertFalse(ledger.get_unreconciled().exists())
+
+    def test_api_edits_are_folded_later(self):
+        shirt = self.create_product('shirt', quantity=5)
+        response = self.client.patch('/api/products/%d/' % shirt.pk,
+                                     {'quantity': 3}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['quantity'], 3)
+        shirt.refresh_from_db()
+        self.assertEqual(shirt.quantity, 5)
+        self.assertEqual(ledger.compact(), 1)
+        shirt.refresh_from_db()
+        self.assertEqual(shirt.quantity, 3)
+
+
+class ProductAdminTests(CatalogMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user.is_staff = self.user.is_superuser = True
+        self.user.save()
+        self.client.force_login(self.user)
+
+    def test_variant_stock_survives_product_saves(self):
+        shirt = self.create_product('shirt', colors='red,blue',
+                                    colors_ar='أحمر,أزرق')
+        variants.sync_variants([shirt.pk])
+        red, blue = shirt.variants.order_by('color_ar')
+        url = '/admin/products/product/%d/change/' % shirt.pk
+
+        def post(stocks, **fields):
+            data = {
+                'sku': 'shirt', 'name': 'Shirt', 'name_ar': 'قميص',
+                'description': '-', 'description_ar': '-',
+                'colors': 'red,blue', 'colors_ar': 'أحمر,أزرق',
+                'sizes': '1', 'price': '10', 'quantity': '5',
+                'brand': self.brand.pk, 'category': self.category.pk,
+                'sub_category': self.sub_category.pk,
+                'variants-TOTAL_FORMS': len(stocks),
+                'variants-INITIAL_FORMS': len(stocks),
+            }
+            for index, (variant, stock) in enumerate(stocks):
+                data.update({
+                    'variants-%d-id' % index: variant.pk,
+                    'variants-%d-product' % index: shirt.pk,
+                    'variants-%d-stock' % index: stock,
+                })
+            data.update(fields)
+            response = self.client.post(url, data)
+            self.assertEqual(response.status_code, 302)
+            return dict(shirt.variants.values_list('color', 'stock'))
+
+        self.assertEqual(post([(red, 3), (blue, '')]),
+                         {'red': 3, 'blue': None})
+        self.assertEqual(post([(red, 3), (blue, '')], name='Renamed'),
+                         {'red': 3, 'blue': None})
+        self.assertEqual(
+            post([(red, 3), (blue, 4)], colors='red,blue,green',
+                 colors_ar='أحمر,أزرق,أخضر'),
+            {'red': 3, 'blue': 4, 'green': None})
+        # Removing a color drops its variant, even with a stock edit.
+        self.assertEqual(
+            post([(red, 3), (blue, 6)], colors='red', colors_ar='أحمر'),
+            {'red': 3})
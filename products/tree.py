@@ -0,0 +1,99 @@
+import threading
+
+from django.db.models import Count, Max, Q
+
+from . import models
+from .caching import get_tag_versions
+from .serializers import ImageSerializer
+
+
+# Every model the tree renders data from, see `products.caching`.
+TREE_CACHE_TAGS = ['category', 'subcategory', 'image', 'product']
+
+
+def latest_images(field):
+    """
+    Subquery of the latest image id of each object `field` points to.
+    """
+    return models.Image.objects.filter(
+        **{field + '__isnull': False}
+    ).order_by().values(field).annotate(latest=Max('pk')).values('latest')
+
+
+def build_tree(request):
+    """
+    Return the categories, each with its sub categories, their latest
+    image and their product counts, in five queries whatever the size of
+    the catalog.
+    """
+    categories = list(models.Category.objects.values('id', 'name',
+                                                     'name_ar'))
+    sub_categories = {
+        row['id']: row
+        for row in models.SubCategory.objects.values('id', 'name', 'name_ar')
+    }
+    links = models.SubCategory.categories.through.objects.order_by(
+        'subcategory__name', 'subcategory_id'
+    ).values_list('category_id', 'subcategory_id')
+
+    category_images, sub_category_images = {}, {}
+    for image in models.Image.objects.filter(
+            Q(pk__in=latest_images('category')) |
+            Q(pk__in=latest_images('sub_category'))).order_by('pk'):
+        data = ImageSerializer(image, context={'request': request}).data
+        # Ordered by id, so the latest image of each object wins.
+        if image.category_id:
+            category_images[image.category_id] = data
+        if image.sub_category_id:
+            sub_category_images[image.sub_category_id] = data
+
+    counts, category_counts = {}, {}
+    for category_id, sub_category_id, count in models.Product.objects\
+            .order_by().values_list('category', 'sub_category')\
+            .annotate(count=Count('pk')):
+        counts[category_id, sub_category_id] = count
+        category_counts[category_id] = (
+            category_counts.get(category_id, 0) + count)
+
+    children = {}
+    for category_id, sub_category_id in links:
+        children.setdefault(category_id, []).append({
+            **sub_categories[sub_category_id],
+            'image': sub_category_images.get(sub_category_id),
+            'product_count': counts.get((category_id, sub_category_id), 0),
+        })
+    return [{
+        **category,
+        'image': category_images.get(category['id']),
+        'product_count': category_counts.get(category['id'], 0),
+        'sub_categories': children.get(category['id'], []),
+    } for category in categories]
+
+
+class TreeSnapshot:
+    """
+    The tree of each host, kept in process until one of `TREE_CACHE_TAGS`
+    is invalidated. Checking costs one cache read instead of the queries.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.versions = None
+        self.trees = {}
+
+    def get(self, request):
+        versions = get_tag_versions(TREE_CACHE_TAGS)
+        host = request.build_absolute_uri('/')
+        with self.lock:
+            if versions != self.versions:
+                self.versions, self.trees = versions, {}
+            tree = self.trees.get(host)
+        if tree is None:
+            tree = build_tree(request)
+            with self.lock:
+                if versions == self.versions:
+                    self.trees[host] = tree
+        return tree
+
+
+snapshot = TreeSnapshot()
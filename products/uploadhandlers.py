@@ -0,0 +1,99 @@
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile
+from django.utils.translation import ugettext_lazy as _
+
+from .storage import HashingWriter
+
+
+# Leading bytes of the accepted image formats, with their extension.
+SIGNATURES = [
+    (0, b'\xff\xd8\xff', '.jpg', 'image/jpeg'),
+    (0, b'\x89PNG\r\n\x1a\n', '.png', 'image/png'),
+    (0, b'GIF87a', '.gif', 'image/gif'),
+    (0, b'GIF89a', '.gif', 'image/gif'),
+    (8, b'WEBP', '.webp', 'image/webp'),
+    (4, b'ftypavif', '.avif', 'image/avif'),
+]
+HEADER_SIZE = 16
+
+
+def sniff(header):
+    """
+    Return the extension and content type of an image starting with
+    `header`, or None when it isn't one of the accepted formats.
+    """
+    for offset, signature, extension, content_type in SIGNATURES:
+        if header[offset:offset + len(signature)] == signature:
+            return extension, content_type
+    return None
+
+
+class StoredUpload(UploadedFile):
+    """
+    An upload already moved to its content addressed name, `stored_name`.
+    Assign `stored_name` to image fields, assigning the upload itself
+    would store it again.
+    """
+
+    def __init__(self, stored_name, name, content_type, size):
+        self.stored_name = stored_name
+        file = default_storage.open(stored_name, 'rb')
+        super().__init__(file, name, content_type, size)
+
+    def temporary_file_path(self):
+        return default_storage.path(self.stored_name)
+
+
+class StoredImageUploadHandler(FileUploadHandler):
+    """
+    Stream each uploaded image into the media storage while hashing it,
+    so uploads are never held in memory or copied again on save.
+
+    Uploads that aren't JPEG, PNG, GIF, WebP or AVIF images are dropped
+    and listed in `request.rejected_uploads`.
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        request.rejected_uploads = {}
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.writer = HashingWriter(default_storage)
+        self.header = b''
+        self.image_type = None
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.image_type is None:
+            self.header += raw_data[:HEADER_SIZE - len(self.header)]
+            if len(self.header) >= HEADER_SIZE and not self.check_header():
+                raise SkipFile
+        self.writer.write(raw_data)
+
+    def file_complete(self, file_size):
+        if self.image_type is None and not self.check_header():
+            return None
+        extension, content_type = self.image_type
+        stored_name = self.writer.commit(extension)
+        return StoredUpload(stored_name, self.file_name, content_type,
+                            file_size)
+
+    def check_header(self):
+        self.image_type = sniff(self.header)
+        if self.image_type is None:
+            self.writer.discard()
+            self.request.rejected_uploads[self.field_name] = _(
+                "Upload a valid JPEG, PNG, GIF, WebP or AVIF image.")
+        return self.image_type is not None
+
+
+class StoredImageUploadMixin:
+    """
+    Handle the uploads of POST requests with `StoredImageUploadHandler`.
+    """
+
+    def initialize_request(self, request, *args, **kwargs):
+        if request.method == 'POST':
+            request.upload_handlers = [StoredImageUploadHandler(request)]
+        return super().initialize_request(request, *args, **kwargs)
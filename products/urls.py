@@ -6,10 +6,16 @@ from . import views
 urlpatterns = [
     path("", views.ProductListView.as_view(), name="product-list"),
     path("<int:pk>/", views.ProductEditView.as_view(), name="product-detail"),
+    path("facets/", views.ProductFacetView.as_view(), name="product-facets"),
+    path("cache-stats/", views.CacheStatsView.as_view(),
+         name="catalog-cache-stats"),
+    path("import/", views.ProductImportView.as_view(), name="product-import"),
+    path("export/", views.ProductExportView.as_view(), name="product-export"),
     path("<int:product_id>/images/", views.ImageCreateView.as_view(),
          name="product-image-create"),
     path("has_discount/", views.DiscountedProductListView.as_view(),
          name="discountedproducts-list"),
+    path("tree/", views.CategoryTreeView.as_view(), name="category-tree"),
     path("categories/", views.CategoryListView.as_view(),
          name="category-list"),
     path("categories/<int:pk>/", views.CategoryEditView.as_view(),
@@ -0,0 +1,64 @@
+from collections import OrderedDict
+
+from django.db import transaction
+
+from . import models
+
+
+def split_variants(colors, colors_ar, sizes):
+    """
+    Return the `(color, color_ar, size)` combinations described by the
+    comma separated product fields.
+    """
+    colors = [color for color in (colors or '').split(',') if color]
+    colors_ar = (colors_ar or '').split(',')
+    sizes = [int(size) for size in (sizes or '').split(',') if size] or [None]
+    variants = OrderedDict()
+    for index, color in enumerate(colors):
+        color_ar = colors_ar[index] if index < len(colors_ar) else ''
+        for size in sizes:
+            variants.setdefault((color, size), color_ar)
+    return [(color, color_ar, size)
+            for (color, size), color_ar in variants.items()]
+
+
+def sync_variants(product_ids):
+    """
+    Create, update and delete the variants of the given products so they
+    match the products' colors and sizes. Stock of kept variants is left
+    untouched.
+    """
+    product_ids = list(product_ids)
+    if not product_ids:
+        return
+    wanted = {}
+    for product in models.Product.objects.filter(
+            id__in=product_ids).order_by().values(
+                'id', 'colors', 'colors_ar', 'sizes'):
+        for color, color_ar, size in split_variants(
+                product['colors'], product['colors_ar'], product['sizes']):
+            wanted[(product['id'], color, size)] = color_ar
+
+    stale, changed = [], []
+    existing = models.ProductVariant.objects.filter(product_id__in=product_ids)
+    for variant in existing.only('id', 'product_id', 'color', 'color_ar',
+                                 'size'):
+        key = (variant.product_id, variant.color, variant.size)
+        if key not in wanted:
+            stale.append(variant.id)
+            continue
+        color_ar = wanted.pop(key)
+        if variant.color_ar != color_ar:
+            variant.color_ar = color_ar
+            changed.append(variant)
+
+    with transaction.atomic():
+        if stale:
+            models.ProductVariant.objects.filter(id__in=stale).delete()
+        if changed:
+            models.ProductVariant.objects.bulk_update(changed, ['color_ar'])
+        models.ProductVariant.objects.bulk_create([
+            models.ProductVariant(product_id=product_id, color=color,
+                                  color_ar=color_ar, size=size)
+            for (product_id, color, size), color_ar in wanted.items()
+        ])
@@ -1,32 +1,133 @@
-from datetime import datetime
+import csv
+import io
 
+from django.core.cache import cache
+from django.db.models import Count, F, Q
 from django_filters import rest_framework
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import generics, permissions, status, filters
 from rest_framework.response import Response
-from . import serializers, models, filters as custom_filters
+from . import (serializers, models, caching, images, importer, tree,
+               filters as custom_filters)
+from .conditional import (ConditionalRetrieveMixin,
+                          ProductGroupConditionalMixin)
+from .exports import StreamingExportMixin
+from .fieldsets import SparseFieldsetViewMixin
+from .pagination import KeysetPagination
+from .uploadhandlers import StoredImageUploadMixin
 
+# Every model `ProductSerializer` renders data from.
+PRODUCT_CACHE_TAGS = ['product', 'discount', 'image', 'brand', 'category',
+                      'subcategory']
 
-class ProductListView(generics.ListCreateAPIView):
+
+class ProductListView(caching.CachedListMixin, StoredImageUploadMixin,
+                      SparseFieldsetViewMixin, generics.ListCreateAPIView):
     """
     get:
         ### List all products.
     post:
         ### Create new product.
     """
-    filter_backends = [filters.SearchFilter, DjangoFilterBackend]
+    filter_backends = [custom_filters.ProductFullTextSearchFilter,
+                       DjangoFilterBackend]
+    # Indexed through `ProductSearchDocument`, see `products.search`.
     search_fields = ['name', 'name_ar', 'description', 'description_ar',
                      'brand__name', 'sku']
     filter_class = custom_filters.ProductFilter
+    pagination_class = KeysetPagination
+    cursor_ordering_fields = ['date_added', 'price', 'effective_price', 'id']
+    cursor_default_ordering = '-date_added'
+    cache_tags = PRODUCT_CACHE_TAGS
+    cache_user_fields = ['in_wishlist']
     queryset = models.Product.objects.all()
 
+    def get_queryset(self):
+        if self.request.method == 'GET':
+            return self.optimize_queryset(models.Product.objects.all())
+        return super().get_queryset()
+
     def get_serializer_class(self):
         if self.request.method == 'GET':
             return serializers.ProductSerializer
         return serializers.ProductCreateSerializer
 
 
-class ProductEditView(generics.RetrieveUpdateDestroyAPIView):
+class ProductFacetView(generics.GenericAPIView):
+    """
+    get:
+        ### Count products per brand, category, sub category, color and
+        ### price range. Takes the same filters as the product list.
+    """
+    filter_backends = ProductListView.filter_backends
+    search_fields = ProductListView.search_fields
+    filter_class = ProductListView.filter_class
+    queryset = models.Product.objects.all()
+    price_buckets = [0, 50, 100, 200, 500, 1000]
+    # Query parameters that don't change the counts.
+    ignored_params = ['limit', 'offset', 'cursor', 'pagination', 'ordering',
+                      'count', 'format', 'fields', 'omit', 'expand']
+    cache_timeout = 60 * 10
+
+    def get(self, request, *args, **kwargs):
+        key = caching.make_key('product-facets', request, PRODUCT_CACHE_TAGS,
+                               self.ignored_params)
+        facets = cache.get(key)
+        if facets is None:
+            caching.record('misses')
+            facets = self.get_facets(self.filter_queryset(self.get_queryset()))
+            cache.set(key, facets, self.cache_timeout)
+        else:
+            caching.record('hits')
+        return Response(facets)
+
+    def get_facets(self, queryset):
+        # Drop the default ordering so it doesn't leak into GROUP BY.
+        queryset = queryset.order_by()
+        return {
+            'brands': self.count_by(queryset, 'brand'),
+            'categories': self.count_by(queryset, 'category'),
+            'sub_categories': self.count_by(queryset, 'sub_category'),
+            'colors': list(
+                queryset.filter(variants__isnull=False).values(
+                    color=F('variants__color'),
+                    color_ar=F('variants__color_ar')
+                ).annotate(
+                    count=Count('pk', distinct=True)
+                ).order_by('-count', 'color')
+            ),
+            **self.count_prices(queryset),
+        }
+
+    def count_by(self, queryset, field):
+        rows = queryset.values(
+            field, field + '__name', field + '__name_ar'
+        ).annotate(count=Count('pk')).order_by('-count', field)
+        return [{'id': row[field],
+                 'name': row[field + '__name'],
+                 'name_ar': row[field + '__name_ar'],
+                 'count': row['count']} for row in rows]
+
+    def count_prices(self, queryset):
+        edges = self.price_buckets + [None]
+        buckets = list(zip(edges, edges[1:]))
+        aggregates = {'count': Count('pk')}
+        for index, (low, high) in enumerate(buckets):
+            condition = Q(effective_price__gte=low)
+            if high is not None:
+                condition &= Q(effective_price__lt=high)
+            aggregates['price_%d' % index] = Count('pk', filter=condition)
+        counts = queryset.aggregate(**aggregates)
+        return {
+            'count': counts['count'],
+            'prices': [{'min': low, 'max': high,
+                        'count': counts['price_%d' % index]}
+                       for index, (low, high) in enumerate(buckets)],
+        }
+
+
+class ProductEditView(ConditionalRetrieveMixin, SparseFieldsetViewMixin,
+                      generics.RetrieveUpdateDestroyAPIView):
     """
     get:
         ### Retrieve product info.
@@ -39,26 +140,43 @@ class ProductEditView(generics.RetrieveUpdateDestroyAPIView):
     """
     queryset = models.Product.objects.all()
 
+    def get_queryset(self):
+        if self.request.method == 'GET':
+            # Images and discounts are only loaded once the conditional
+            # checks have passed.
+            return models.Product.objects.select_related(
+                'brand', 'category', 'sub_category')
+        return super().get_queryset()
+
+    def get_etag_parts(self, instance):
+        return [instance.brand.updated_at, instance.category.updated_at,
+                instance.sub_category.updated_at]
+
     def get_serializer_class(self):
         if self.request.method == 'GET':
             return serializers.ProductSerializer
         return serializers.ProductCreateSerializer
 
 
-class DiscountedProductListView(generics.ListAPIView):
+class DiscountedProductListView(caching.CachedListMixin,
+                                SparseFieldsetViewMixin,
+                                generics.ListAPIView):
     """
     get:
         ### List discounted products.
     """
     serializer_class = serializers.ProductSerializer
+    cache_tags = PRODUCT_CACHE_TAGS
+    cache_user_fields = ['in_wishlist']
 
     def get_queryset(self):
-        return models.Product.objects.filter(
-            discounts__finish_date__gt=datetime.now()
-        )
+        return self.optimize_queryset(models.Product.objects.filter(
+            active_discount_percentage__gt=0
+        ))
 
 
-class BrandListView(generics.ListCreateAPIView):
+class BrandListView(caching.CachedListMixin,
+                    generics.ListCreateAPIView):
     """
     get:
         ### List all brands.
@@ -66,10 +184,12 @@ class BrandListView(generics.ListCreateAPIView):
         ### Create new brand.
     """
     serializer_class = serializers.BrandSerializer
+    cache_tags = ['brand']
     queryset = models.Brand.objects.all()
 
 
-class BrandEditView(generics.RetrieveUpdateDestroyAPIView):
+class BrandEditView(ProductGroupConditionalMixin,
+                    generics.RetrieveUpdateDestroyAPIView):
     """
     get:
         ### Retrieve brand info.
@@ -84,7 +204,8 @@ class BrandEditView(generics.RetrieveUpdateDestroyAPIView):
     queryset = models.Brand.objects.all()
 
 
-class CategoryListView(generics.ListCreateAPIView):
+class CategoryListView(caching.CachedListMixin,
+                       generics.ListCreateAPIView):
     """
     get:
         ### List all categories.
@@ -92,10 +213,23 @@ class CategoryListView(generics.ListCreateAPIView):
         ### Create new category.
     """
     serializer_class = serializers.CategorySerializer
+    cache_tags = ['category']
     queryset = models.Category.objects.all()
 
 
-class CategoryEditView(generics.RetrieveUpdateDestroyAPIView):
+class CategoryTreeView(generics.views.APIView):
+    """
+    get:
+        ### Categories with their sub categories, latest image and product
+        ### count, for the navigation menu.
+    """
+
+    def get(self, request, *args, **kwargs):
+        return Response(tree.snapshot.get(request))
+
+
+class CategoryEditView(ProductGroupConditionalMixin,
+                       generics.RetrieveUpdateDestroyAPIView):
     """
     get:
         ### Retrieve category info.
@@ -110,7 +244,8 @@ class CategoryEditView(generics.RetrieveUpdateDestroyAPIView):
     queryset = models.Category.objects.all()
 
 
-class SubCategoryListView(generics.ListCreateAPIView):
+class SubCategoryListView(caching.CachedListMixin,
+                          generics.ListCreateAPIView):
     """
     get:
         ### List all sub categories.
@@ -118,6 +253,7 @@ class SubCategoryListView(generics.ListCreateAPIView):
         ### Create new sub category.
     """
     serializer_class = serializers.SubCategorySerializer
+    cache_tags = ['subcategory']
     queryset = models.SubCategory.objects.all()
 
 
@@ -161,7 +297,7 @@ class DiscountEditView(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = serializers.DiscountSerializer
     queryset = models.Discount.objects.all()
 
-class ImageCreateView(generics.views.APIView):
+class ImageCreateView(StoredImageUploadMixin, generics.views.APIView):
     """
     post:
         ### Create image and associate with product.
@@ -171,9 +307,15 @@ class ImageCreateView(generics.views.APIView):
 
     def post(self, request, *args, **kwargs):
         try:
-            for image in request.FILES.values():
-                models.Image.objects.create(
-                    image=image, **kwargs)
+            uploads = request.FILES.values()
+            if request.rejected_uploads:
+                return Response({'success': False,
+                                 'details': request.rejected_uploads},
+                                status.HTTP_400_BAD_REQUEST)
+            images.create_images([
+                models.Image(image=upload.stored_name, **kwargs)
+                for upload in uploads
+            ])
             return Response({'success': True}, status.HTTP_201_CREATED)
         except Exception as e:
             return Response({'success': False, 'details': e.__str__()},
@@ -188,4 +330,58 @@ class ImageEditView(generics.RetrieveUpdateDestroyAPIView):
     queryset = models.Image.objects.all()
 
     def get_object(self):
-        return models.Image.objects.get(**self.kwargs)
\ No newline at end of file
+        return models.Image.objects.get(**self.kwargs)
+
+
+class CacheStatsView(generics.views.APIView):
+    """
+    get:
+        ### Catalog cache hit and miss counters. `Admin users only`
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(caching.get_stats())
+
+
+class ProductExportView(StreamingExportMixin, generics.GenericAPIView):
+    """
+    get:
+        ### Download the products as CSV, or as JSON lines with
+        ### `?export_format=ndjson`. Takes the same filters as the product
+        ### list. `Admin users only`
+    """
+    permission_classes = [permissions.IsAdminUser]
+    filter_backends = ProductListView.filter_backends
+    search_fields = ProductListView.search_fields
+    filter_class = ProductListView.filter_class
+    serializer_class = serializers.ProductReportSerializer
+    queryset = models.Product.objects.select_related('brand', 'category',
+                                                     'sub_category')
+    export_filename = 'products'
+
+
+class ProductImportView(generics.views.APIView):
+    """
+    post:
+        ### Create or update products by sku from an uploaded `file`.
+        ### CSV with a header line, or JSON lines when the file name ends
+        ### with `.jsonl`. Brands and categories are given by name.
+        ### `Admin users only`
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def post(self, request, *args, **kwargs):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'file': ["No file was submitted."]},
+                            status.HTTP_400_BAD_REQUEST)
+        file_format = 'jsonl' if upload.name.endswith('.jsonl') else 'csv'
+        stream = io.TextIOWrapper(upload.file, encoding='utf-8-sig',
+                                  newline='')
+        try:
+            report = importer.CatalogImporter().run(
+                importer.READERS[file_format](stream))
+        except (UnicodeDecodeError, csv.Error) as e:
+            return Response({'file': [str(e)]}, status.HTTP_400_BAD_REQUEST)
+        return Response(report)
@@ -3,7 +3,18 @@ from django.contrib import admin
 from . import models
 
 
+@admin.register(models.Cart)
+class CartAdmin(admin.ModelAdmin):
+    list_display = ['id', 'user', 'date_added', 'total_price', 'item_count',
+                    'line_count', 'is_active', 'payment_status']
+    list_filter = ['is_active', 'payment_status', 'payment_method']
+    list_select_related = ['user']
+    readonly_fields = ['total_price', 'item_count', 'line_count']
+    ordering = ['-id']
+
+
 admin.site.register([models.User, models.Feedback,
-                     models.Cart, models.CartItem,
-                     models.WishlistItem, models.UserPermissions
+                     models.CartItem,
+                     models.WishlistItem, models.UserPermissions,
+                     models.StockReservation
                      ])
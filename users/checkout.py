@@ -0,0 +1,164 @@
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Q, Value, When
+from django.utils import timezone
+
+from products import ledger
+from products.caching import invalidate_tags
+from products.ledger import sum_by_product
+from products.models import Product, ProductVariant, StockMovement
+from . import models
+from .reservations import release
+
+
+class CheckoutError(Exception):
+    pass
+
+
+class AlreadySubmitted(CheckoutError):
+    def __init__(self):
+        super().__init__("Cart already submitted")
+
+
+class OutOfStock(CheckoutError):
+    """
+    Some lines of the cart ask for more than is in stock, they're listed
+    in `short_lines`. Nothing was taken from stock.
+    """
+
+    def __init__(self, short_lines):
+        self.short_lines = short_lines
+        names = ', '.join(sorted({line['name'] for line in short_lines}))
+        super().__init__("Not enough quantity for {0};"
+                         "كمية غير كافية للمنتج {0}".format(names))
+
+
+def decrement(queryset, field, amounts, floor=None, **values):
+    """
+    Take `amounts[pk]` from `field` of the rows holding at least that
+    much over their `floor` field, in a single UPDATE also setting
+    `values`. Return the number of rows updated.
+    """
+    enough = Q()
+    for pk, amount in amounts.items():
+        minimum = F(floor) + amount if floor else amount
+        enough |= Q(pk=pk, **{field + '__gte': minimum})
+    taken = Case(*[When(pk=pk, then=Value(amount))
+                   for pk, amount in amounts.items()],
+                 output_field=IntegerField())
+    return queryset.filter(enough).update(**{field: F(field) - taken},
+                                          **values)
+
+
+def short_line(line, requested, available):
+    return {
+        'id': line['pk'],
+        'product': line['product'],
+        'name': line['product__name'],
+        'color': line['color'],
+        'size': line['size'],
+        'requested': requested,
+        'available': available,
+    }
+
+
+def checkout(cart):
+    """
+    Submit `cart`, taking its lines from the product quantities and from
+    the stock of the variants tracking one, all or nothing, in one short
+    transaction. Raise `AlreadySubmitted` or `OutOfStock`.
+
+    The cart is claimed first so a cart is only submitted once. Live holds
+    of the cart are turned into sales without touching the product rows,
+    see `users.reservations`. What isn't held is taken with one
+    conditional UPDATE that never lets the available quantity drop below
+    zero, so concurrent checkouts can't oversell, and recorded in the
+    stock ledger.
+    """
+    lines = list(cart.items.order_by('pk').values(
+        'pk', 'product', 'product__name', 'color', 'size', 'quantity'))
+    products, variants = {}, {}
+    for line in lines:
+        key = (line['product'], line['color'], line['size'])
+        products[line['product']] = (products.get(line['product'], 0) +
+                                     line['quantity'])
+        variants[key] = variants.get(key, 0) + line['quantity']
+
+    now = timezone.now()
+    with transaction.atomic():
+        claimed = models.Cart.objects.filter(
+            pk=cart.pk, date_added__isnull=True
+        ).update(date_added=now, updated_at=now)
+        if not claimed:
+            raise AlreadySubmitted()
+
+        # Pending adjustments count before checking the quantities. The
+        # conditional UPDATE below is what keeps concurrent checkouts from
+        # overselling, and it writes these product rows anyway, so folding
+        # their movements in here costs no extra hot row write.
+        settled = ledger.settle_products(products)
+        holds = models.StockReservation.objects.filter(
+            cart_item__cart=cart, is_sold=False)
+        release(holds.filter(expires_at__lte=now))
+        live = list(holds.select_for_update().values_list(
+            'pk', 'product', 'quantity'))
+        held = sum_by_product(row[1:] for row in live)
+        unheld = {pk: quantity - held.get(pk, 0)
+                  for pk, quantity in products.items()
+                  if quantity > held.get(pk, 0)}
+
+        short_lines = []
+        product_rows = Product.objects.filter(pk__in=list(unheld))
+        if unheld:
+            savepoint = transaction.savepoint()
+            if decrement(product_rows, 'quantity', unheld, floor='reserved',
+                         updated_at=now) == len(unheld):
+                transaction.savepoint_commit(savepoint)
+            else:
+                # Put back what the rows with enough quantity gave, the
+                # short ones are those that can't cover their amount.
+                transaction.savepoint_rollback(savepoint)
+                available = {
+                    pk: quantity for pk, quantity in product_rows.values_list(
+                        'pk', F('quantity') - F('reserved'))
+                    if quantity < unheld[pk]}
+                short_lines += [
+                    short_line(line, products[line['product']],
+                               available[line['product']] +
+                               held.get(line['product'], 0))
+                    for line in lines if line['product'] in available]
+
+        # Variant rows are locked until commit. SQLite has no row locks,
+        # but claiming the cart already took its database wide write lock.
+        tracked = {}
+        for pk, product_id, color, size, stock in ProductVariant.objects\
+                .select_for_update().filter(product__in=list(products),
+                                            stock__isnull=False)\
+                .order_by('pk').values_list('pk', 'product', 'color', 'size',
+                                            'stock'):
+            if (product_id, color, size) in variants:
+                tracked[product_id, color, size] = (pk, stock)
+        amounts = {}
+        for key, (pk, stock) in tracked.items():
+            amounts[pk] = variants[key]
+            if stock < variants[key]:
+                short_lines += [
+                    short_line(line, variants[key], stock) for line in lines
+                    if (line['product'], line['color'],
+                        line['size']) == key]
+
+        if short_lines:
+            raise OutOfStock(short_lines)
+        if amounts:
+            decrement(ProductVariant.objects.all(), 'stock', amounts)
+        StockMovement.objects.bulk_create([
+            StockMovement(product_id=pk, change=-quantity,
+                          reason=StockMovement.SALE, cart=cart,
+                          is_settled=True)
+            for pk, quantity in unheld.items()
+        ])
+        if live:
+            models.StockReservation.objects.filter(
+                pk__in=[pk for pk, _, _ in live]).update(is_sold=True)
+
+    if unheld or settled:
+        invalidate_tags('product')
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from users import totals
+
+
+class Command(BaseCommand):
+    help = ("Recompute the cart totals that drifted from the cart items, "
+            "e.g. after items were changed in bulk.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help="Carts checked per query.")
+
+    def handle(self, *args, **options):
+        repaired = totals.repair(options['batch_size'])
+        self.stdout.write("Repaired the totals of %d carts." % repaired)
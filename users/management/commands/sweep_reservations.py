@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from users import reservations
+
+
+class Command(BaseCommand):
+    help = ("Give the stock of expired cart holds back and take sold holds "
+            "from product quantities. Run every minute, e.g. from cron.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help="Holds handled per transaction.")
+
+    def handle(self, *args, **options):
+        released, settled = reservations.sweep(options['batch_size'])
+        self.stdout.write("Released %d and settled %d holds." % (
+            released, settled))
@@ -0,0 +1,30 @@
+# Generated by Django 2.2 on 2026-10-18 07:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0012_product_reserved'),
+        ('users', '0013_cart_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField(verbose_name='quantity')),
+                ('expires_at', models.DateTimeField(verbose_name='expires at')),
+                ('is_sold', models.BooleanField(default=False, verbose_name='is sold')),
+                ('cart_item', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='reservations', related_query_name='reservations', to='users.CartItem', verbose_name='cart item')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', related_query_name='reservations', to='products.Product', verbose_name='product')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='stockreservation',
+            index=models.Index(fields=['is_sold', 'expires_at'], name='users_stock_is_sold_c186e3_idx'),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 2.2 on 2026-10-18 08:05
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def count_items(apps, schema_editor):
+    Cart = apps.get_model('users', 'Cart')
+    CartItem = apps.get_model('users', 'CartItem')
+    items = CartItem.objects.filter(
+        cart=models.OuterRef('pk')).order_by().values('cart')
+
+    def total(aggregate, output_field):
+        return Coalesce(models.Subquery(
+            items.annotate(total=aggregate).values('total'),
+            output_field=output_field), 0)
+
+    Cart.objects.update(
+        total_price=total(models.Sum('price'), models.FloatField()),
+        item_count=total(models.Sum('quantity'), models.IntegerField()),
+        line_count=total(models.Count('pk'), models.IntegerField()))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0014_stockreservation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='item count'),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='line_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='line count'),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='total_price',
+            field=models.FloatField(default=0, editable=False, verbose_name='total price'),
+        ),
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(fields=['total_price', 'id'], name='users_cart_total_p_e84851_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(fields=['item_count', 'id'], name='users_cart_item_co_4b5ef5_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(fields=['line_count', 'id'], name='users_cart_line_co_5d39bc_idx'),
+        ),
+        migrations.RunPython(count_items, migrations.RunPython.noop),
+    ]
@@ -64,9 +64,23 @@ class Cart(models.Model):
                                       choices=[('c', 'Cash'), ('v', 'Visa')],
                                       blank=True, null=True)
     payment_status = models.BooleanField(_('payment status'), default=False)
+    updated_at = models.DateTimeField(_("updated at"), auto_now=True)
+    # Maintained from the items, see `users.totals`.
+    total_price = models.FloatField(_("total price"), default=0,
+                                    editable=False)
+    item_count = models.PositiveIntegerField(_("item count"), default=0,
+                                             editable=False)
+    line_count = models.PositiveIntegerField(_("line count"), default=0,
+                                             editable=False)
 
     class Meta:
         ordering = ['date_added']
+        # Back sorting and filtering the cart lists on their totals.
+        indexes = [
+            models.Index(fields=['total_price', 'id']),
+            models.Index(fields=['item_count', 'id']),
+            models.Index(fields=['line_count', 'id']),
+        ]
 
 
 class CartItem(models.Model):
@@ -83,6 +97,43 @@ class CartItem(models.Model):
     def __str__(self):
         return self.product.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        item = super().from_db(db, field_names, values)
+        # What the item adds to the totals of its cart, see `users.totals`.
+        if {'cart_id', 'price', 'quantity'}.issubset(field_names):
+            item.counted = (item.cart_id, item.price, item.quantity)
+        return item
+
+
+class StockReservation(models.Model):
+    """
+    Stock of a product held for a cart item until `expires_at`, counted in
+    `Product.reserved`. Checkout turns the holds of a cart into sales,
+    which are taken from the product quantity later, see
+    `users.reservations`.
+    """
+    cart_item = models.ForeignKey(CartItem, models.SET_NULL,
+                                  related_name="reservations",
+                                  related_query_name="reservations",
+                                  verbose_name=_("cart item"),
+                                  blank=True, null=True)
+    product = models.ForeignKey(Product, models.CASCADE,
+                                related_name="reservations",
+                                related_query_name="reservations",
+                                verbose_name=_("product"))
+    quantity = models.PositiveIntegerField(_("quantity"))
+    expires_at = models.DateTimeField(_("expires at"))
+    is_sold = models.BooleanField(_("is sold"), default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['is_sold', 'expires_at']),
+        ]
+
+    def __str__(self):
+        return "%s x %s" % (self.product_id, self.quantity)
+
 
 class WishlistItem(models.Model):
     user = models.ForeignKey(User, models.CASCADE,
@@ -126,3 +177,4 @@ def user_post_save(sender, instance, created, *args, **kwargs):
 
 
 # post_save.connect(user_post_save, settings.AUTH_USER_MODEL)
+
@@ -18,6 +18,11 @@ class IsOwner(permissions.BasePermission):
         return obj.user == request.user
 
 
+class IsCartOwner(permissions.BasePermission):
+    def has_object_permission(self, request, view, obj):
+        return obj.cart.user == request.user
+
+
 class IsOwnerOrAdminReadOnly(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
         if request.user.is_staff and obj.user != request.user:
@@ -0,0 +1,173 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, IntegerField, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from products import ledger
+from products.caching import invalidate_tags
+from products.ledger import amounts_case, sum_by_product
+from products.models import Product, StockMovement
+from . import models
+
+
+def hold(item):
+    """
+    Hold stock for the cart item `item` for `settings.RESERVATION_TTL`
+    seconds, growing or shrinking its hold to the item's quantity. Return
+    whether it's all held; when stock is short the hold is left as it was
+    and checkout takes the rest if it still can.
+    """
+    expires_at = timezone.now() + timedelta(seconds=settings.RESERVATION_TTL)
+    with transaction.atomic():
+        # Extending the hold first locks it, and on SQLite takes the write
+        # lock before anything is read.
+        holds = models.StockReservation.objects.filter(cart_item=item,
+                                                       is_sold=False)
+        holds.update(expires_at=expires_at)
+        reservation = holds.first()
+        if (reservation is not None and
+                reservation.product_id != item.product_id):
+            release(models.StockReservation.objects.filter(
+                pk=reservation.pk))
+            reservation = None
+        if ledger.settle_products([item.product_id]):
+            transaction.on_commit(lambda: invalidate_tags('product'))
+        held = reservation.quantity if reservation is not None else 0
+        change = item.quantity - held
+        if change > 0:
+            # Only hold what's neither held nor sold already.
+            if not Product.objects.filter(
+                    pk=item.product_id,
+                    quantity__gte=F('reserved') + change
+            ).update(reserved=F('reserved') + change):
+                return False
+        elif change < 0:
+            Product.objects.filter(pk=item.product_id).update(
+                reserved=F('reserved') + change)
+        if reservation is None:
+            models.StockReservation.objects.create(
+                cart_item=item, product_id=item.product_id,
+                quantity=item.quantity, expires_at=expires_at)
+        elif change:
+            reservation.quantity = item.quantity
+            reservation.save(update_fields=['quantity'])
+    return True
+
+
+def hold_items(items):
+    """
+    Hold stock for cart items without a hold yet, like `hold()` but in a
+    fixed number of queries. Return the items that are held.
+    """
+    items = list(items)
+    product_ids = {item.product_id for item in items}
+    expires_at = timezone.now() + timedelta(seconds=settings.RESERVATION_TTL)
+    with transaction.atomic():
+        if ledger.settle_products(product_ids):
+            transaction.on_commit(lambda: invalidate_tags('product'))
+        available = dict(Product.objects.select_for_update().filter(
+            pk__in=list(product_ids)
+        ).values_list('pk', F('quantity') - F('reserved')))
+        held, amounts = [], {}
+        for item in items:
+            if 0 < item.quantity <= available.get(item.product_id, 0):
+                available[item.product_id] -= item.quantity
+                amounts[item.product_id] = (
+                    amounts.get(item.product_id, 0) + item.quantity)
+                held.append(item)
+        if amounts:
+            Product.objects.filter(pk__in=list(amounts)).update(
+                reserved=F('reserved') + amounts_case(amounts))
+        models.StockReservation.objects.bulk_create([
+            models.StockReservation(cart_item=item,
+                                    product_id=item.product_id,
+                                    quantity=item.quantity,
+                                    expires_at=expires_at)
+            for item in held
+        ])
+    return held
+
+
+def release(reservations):
+    """
+    Delete the unsold holds of the `reservations` queryset and give their
+    stock back. Return how many were released.
+    """
+    with transaction.atomic():
+        rows = list(reservations.filter(is_sold=False).select_for_update()
+                    .values_list('pk', 'product', 'quantity'))
+        if not rows:
+            return 0
+        models.StockReservation.objects.filter(
+            pk__in=[pk for pk, _, _ in rows]).delete()
+        amounts = sum_by_product(row[1:] for row in rows)
+        Product.objects.filter(pk__in=list(amounts)).update(
+            reserved=F('reserved') - amounts_case(amounts))
+    return len(rows)
+
+
+def settle(reservations):
+    """
+    Take the sold holds of the `reservations` queryset from the quantity
+    of their products, never below zero, recording the sales in the stock
+    ledger, and delete them. Return how many were settled.
+    """
+    with transaction.atomic():
+        rows = list(reservations.filter(is_sold=True)
+                    .select_for_update(of=('self',))
+                    .values_list('pk', 'product', 'quantity',
+                                 'cart_item__cart'))
+        if not rows:
+            return 0
+        models.StockReservation.objects.filter(
+            pk__in=[row[0] for row in rows]).delete()
+        StockMovement.objects.bulk_create([
+            StockMovement(product_id=product_id, change=-quantity,
+                          reason=StockMovement.SALE, cart_id=cart_id,
+                          is_settled=True)
+            for _, product_id, quantity, cart_id in rows
+        ])
+        amounts = sum_by_product(row[1:3] for row in rows)
+        taken = amounts_case(amounts)
+        # The quantity may have been set below what was sold since; it
+        # stops at zero and the product shows up in
+        # `ledger.get_unreconciled()`, like in `ledger.settle()`.
+        Product.objects.filter(pk__in=list(amounts)).update(
+            quantity=Greatest(F('quantity') - taken, Value(0),
+                              output_field=IntegerField()),
+            reserved=Greatest(F('reserved') - taken, Value(0),
+                              output_field=IntegerField()),
+            updated_at=timezone.now())
+    return len(rows)
+
+
+def sweep(batch_size=1000):
+    """
+    Release the expired holds and settle the sold ones, `batch_size` at a
+    time, each batch in its own transaction. Return the number of holds
+    released and settled.
+    """
+    released = settled = 0
+    expired = models.StockReservation.objects.filter(
+        is_sold=False, expires_at__lte=timezone.now()).order_by('pk')
+    sold = models.StockReservation.objects.filter(
+        is_sold=True).order_by('pk')
+    for queryset, apply in ((expired, release), (sold, settle)):
+        while True:
+            with transaction.atomic():
+                pks = list(queryset.select_for_update(skip_locked=True)
+                           .values_list('pk', flat=True)[:batch_size])
+                count = apply(models.StockReservation.objects.filter(
+                    pk__in=pks)) if pks else 0
+            if apply is release:
+                released += count
+            else:
+                settled += count
+            if len(pks) < batch_size:
+                break
+    if settled:
+        invalidate_tags('product')
+    return released, settled
@@ -1,7 +1,11 @@
+from django.db import transaction
+from django.db.models import prefetch_related_objects
 from rest_framework import serializers
 from rest_auth.registration.serializers import RegisterSerializer
 
-from . import models
+from . import models, reservations
+from products.fieldsets import Fieldset, SparseFieldsetMixin
+from products.models import ProductVariant
 from products.serializers import ProductSerializer
 
 
@@ -16,10 +20,12 @@ class CartItemCreateSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
-class CartItemSerializer(serializers.ModelSerializer):
+class CartItemSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
     id = serializers.IntegerField(source='product_id', write_only=True)
 
+    expandable_fields = ['product']
+
     class Meta:
         model = models.CartItem
         fields = '__all__'
@@ -41,7 +47,6 @@ class CartItemReportSerializer(serializers.ModelSerializer):
 class CartReportSerializer(serializers.ModelSerializer):
     items = serializers.SerializerMethodField()
     user = serializers.StringRelatedField()
-    deliverer = serializers.StringRelatedField()
     date_added = serializers.SerializerMethodField()
     date_finished = serializers.SerializerMethodField()
 
@@ -58,7 +63,9 @@ class CartReportSerializer(serializers.ModelSerializer):
         return ','.join(items)
 
     def get_date_added(self, obj):
-        return obj.date_added.strftime("%Y-%m-%d %H:%M")
+        if obj.date_added:
+            return obj.date_added.strftime("%Y-%m-%d %H:%M")
+        return None
 
     def get_date_finished(self, obj):
         if obj.date_finished:
@@ -66,11 +73,14 @@ class CartReportSerializer(serializers.ModelSerializer):
         return None
 
 
-class CartSerializer(serializers.ModelSerializer):
+class CartSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     user_name = serializers.SerializerMethodField()
     user_phone = serializers.CharField(source='user.phone', read_only=True)
     items = CartItemSerializer(many=True, read_only=True)
 
+    expandable_fields = ['items']
+    select_related_fields = {'user_name': 'user', 'user_phone': 'user'}
+
     class Meta:
         model = models.Cart
         fields = '__all__'
@@ -89,43 +99,60 @@ class CartCreateSerializer(serializers.ModelSerializer):
         read_only_fields = ['user', 'is_active', 'date_finished']
 
     def create(self, validated_data):
-        # Get the request object
+        """
+        Validate every item against the products and their variants,
+        loaded once, then create the cart and its items in one
+        transaction, holding their stock. An invalid cart writes nothing.
+        """
         request = self.context.get('request')
-        # Cart items
         cart_items = validated_data.pop('items')
-        # Create a cart first
-        cart = models.Cart.objects.create(**validated_data, user=request.user)
-
-        for cart_item in cart_items:
-            try:
-                product = models.Product.objects.get(
-                    id=cart_item['product_id'])
-
-                # Validate that the color and size of the product are available
-                if cart_item['color'] not in product.colors.split(',') or \
-                        str(cart_item['size']) not in product.sizes.split(','):
-                    raise serializers.ValidationError(
-                        {'details': "Color or size not available"})
-
-                # Check if the price is supplied from the client side
-                if cart_item.get('price'):
-                    price = cart_item.get('price')
-                # Else, calculate the price manually.
-                else:
-                    price = product.price * float(cart_item['quantity'])
-                models.CartItem.objects.create(
-                    **cart_item, price=price, cart=cart)
-            except models.Product.DoesNotExist:
-                cart.delete()
+        product_ids = {item['product_id'] for item in cart_items}
+        products = models.Product.objects.only('id', 'price').in_bulk(
+            list(product_ids))
+        if len(products) != len(product_ids):
+            raise serializers.ValidationError(
+                {'details': "Product does not exist"})
+        # Validate that the color and size of the products are available
+        variants = set(ProductVariant.objects.filter(
+            product__in=list(product_ids)
+        ).values_list('product', 'color', 'size'))
+        for item in cart_items:
+            if (item['product_id'], item['color'],
+                    item.get('size')) not in variants:
                 raise serializers.ValidationError(
-                    {'details': "Product does not exist"})
+                    {'details': "Color or size not available"})
+
+        for item in cart_items:
+            # Use the price supplied from the client side, if any.
+            item['price'] = item.get('price') or (
+                products[item['product_id']].price * float(item['quantity']))
+
+        with transaction.atomic():
+            # Created in bulk, the items don't count themselves in.
+            cart = models.Cart.objects.create(
+                **validated_data, user=request.user,
+                total_price=sum(item['price'] for item in cart_items),
+                item_count=sum(item['quantity'] for item in cart_items),
+                line_count=len(cart_items))
+            models.CartItem.objects.bulk_create([
+                models.CartItem(**item, cart=cart) for item in cart_items
+            ])
+            # Created in bulk, without the signal holding their stock.
+            reservations.hold_items(cart.items.all())
+        # Render the created cart without queries per item.
+        _, prefetch = CartItemSerializer.get_lookups(Fieldset(), 'items__',
+                                                     many=True)
+        prefetch_related_objects([cart], 'items', *prefetch)
         return cart
 
 
-class WishlistItemSerializer(serializers.ModelSerializer):
+class WishlistItemSerializer(SparseFieldsetMixin,
+                             serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
     product_id = serializers.IntegerField(write_only=True)
 
+    expandable_fields = ['product']
+
     class Meta:
         model = models.WishlistItem
         fields = '__all__'
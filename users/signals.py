@@ -0,0 +1,30 @@
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import models, reservations, totals
+
+
+@receiver(post_save, sender=models.CartItem)
+def hold_cart_item(sender, instance, raw=False, **kwargs):
+    """
+    Hold stock for the items of carts that weren't submitted yet.
+    """
+    if not raw and models.Cart.objects.filter(
+            pk=instance.cart_id, date_added__isnull=True).exists():
+        reservations.hold(instance)
+
+
+@receiver(pre_delete, sender=models.CartItem)
+def release_cart_item(sender, instance, **kwargs):
+    reservations.release(instance.reservations.all())
+
+
+@receiver(post_save, sender=models.CartItem)
+def count_cart_item(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        totals.count(instance, created)
+
+
+@receiver(post_delete, sender=models.CartItem)
+def uncount_cart_item(sender, instance, **kwargs):
+    totals.uncount(instance)
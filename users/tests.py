@@ -1,3 +1,487 @@
-from django.test import TestCase
+import csv
+import json
+import threading
 
-# Create your tests here.
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from products import ledger
+from products.models import (Brand, Category, Product, ProductVariant,
+                             StockMovement, SubCategory)
+from . import checkout, models, reservations, totals
+
+
+class CheckoutMixin:
+    def create_product(self, sku, quantity):
+        # Created in bulk, the save signals would render renditions.
+        Product.objects.bulk_create([Product(
+            sku=sku, name=sku, name_ar='منتج', description='-',
+            description_ar='-', colors='red', colors_ar='أحمر', sizes='1',
+            image='%s.jpg' % sku, price=10, effective_price=10,
+            quantity=quantity, brand=self.brand, category=self.category,
+            sub_category=self.sub_category,
+        )])
+        return Product.objects.get(sku=sku)
+
+    def create_cart(self, user, *lines):
+        cart = models.Cart.objects.create(user=user)
+        models.CartItem.objects.bulk_create([
+            models.CartItem(cart=cart, product=product, quantity=quantity,
+                            color='red', size=1, price=10 * quantity)
+            for product, quantity in lines
+        ])
+        return cart
+
+    def setUp(self):
+        self.brand = Brand.objects.create(name='Brand', name_ar='علامة')
+        self.category = Category.objects.create(name='Category',
+                                                name_ar='فئة')
+        self.sub_category = SubCategory.objects.create(name='Sub',
+                                                       name_ar='فرعية')
+        self.user = models.User.objects.create(username='buyer')
+
+
+class CheckoutTests(CheckoutMixin, TestCase):
+    def test_takes_every_line_from_stock(self):
+        shirt = self.create_product('shirt', 5)
+        hat = self.create_product('hat', 5)
+        cart = self.create_cart(self.user, (shirt, 2), (hat, 1), (shirt, 1))
+        checkout.checkout(cart)
+        shirt.refresh_from_db()
+        hat.refresh_from_db()
+        cart.refresh_from_db()
+        self.assertEqual((shirt.quantity, hat.quantity), (2, 4))
+        self.assertIsNotNone(cart.date_added)
+
+    def test_short_lines_leave_stock_untouched(self):
+        shirt = self.create_product('shirt', 1)
+        hat = self.create_product('hat', 5)
+        cart = self.create_cart(self.user, (shirt, 2), (hat, 1))
+        with self.assertRaises(checkout.OutOfStock) as raised:
+            checkout.checkout(cart)
+        self.assertEqual(
+            [(line['product'], line['requested'], line['available'])
+             for line in raised.exception.short_lines],
+            [(shirt.pk, 2, 1)])
+        hat.refresh_from_db()
+        cart.refresh_from_db()
+        self.assertEqual(hat.quantity, 5)
+        self.assertIsNone(cart.date_added)
+
+    def test_short_lines_ignore_updated_at(self):
+        now = timezone.now()
+        shirt = self.create_product('shirt', 1)
+        # Another writer touched the short product at the same instant.
+        Product.objects.filter(pk=shirt.pk).update(updated_at=now)
+        # Taking the hat leaves less than was asked for, it isn't short.
+        hat = self.create_product('hat', 1)
+        cart = self.create_cart(self.user, (shirt, 2), (hat, 1))
+        with mock.patch('users.checkout.timezone.now', return_value=now):
+            with self.assertRaises(checkout.OutOfStock) as raised:
+                checkout.checkout(cart)
+        self.assertEqual(
+            [(line['product'], line['requested'], line['available'])
+             for line in raised.exception.short_lines],
+            [(shirt.pk, 2, 1)])
+        self.assertEqual(
+            dict(Product.objects.values_list('sku', 'quantity')),
+            {'shirt': 1, 'hat': 1})
+
+    def test_variant_stock(self):
+        shirt = self.create_product('shirt', 5)
+        variant = ProductVariant.objects.create(product=shirt, color='red',
+                                                color_ar='أحمر', size=1,
+                                                stock=1)
+        cart = self.create_cart(self.user, (shirt, 2))
+        with self.assertRaises(checkout.OutOfStock):
+            checkout.checkout(cart)
+        variant.stock = 2
+        variant.save()
+        checkout.checkout(cart)
+        variant.refresh_from_db()
+        self.assertEqual(variant.stock, 0)
+
+    def test_submitted_once(self):
+        shirt = self.create_product('shirt', 5)
+        cart = self.create_cart(self.user, (shirt, 1))
+        checkout.checkout(cart)
+        with self.assertRaises(checkout.AlreadySubmitted):
+            checkout.checkout(cart)
+        shirt.refresh_from_db()
+        self.assertEqual(shirt.quantity, 4)
+
+    def test_finish_view_conflict(self):
+        shirt = self.create_product('shirt', 1)
+        cart = self.create_cart(self.user, (shirt, 3))
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get('/api/users/carts/%d/finish/' % cart.pk)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['short_lines'][0]['available'], 1)
+
+
+class ReservationTests(CheckoutMixin, TestCase):
+    def add_item(self, cart, product, quantity):
+        return models.CartItem.objects.create(
+            cart=cart, product=product, quantity=quantity, color='red',
+            size=1, price=10 * quantity)
+
+    def test_holds_follow_cart_items(self):
+        shirt = self.create_product('shirt', 5)
+        item = self.add_item(models.Cart.objects.create(user=self.user),
+                             shirt, 2)
+        shirt.refresh_from_db()
+        self.assertEqual(shirt.reserved, 2)
+        item.quantity = 4
+        item.save()
+        shirt.refresh_from_db()
+        self.assertEqual(shirt.reserved, 4)
+        item.delete()
+        shirt.refresh_from_db()
+        self.assertEqual(shirt.reserved, 0)
+        self.assertFalse(models.StockReservation.objects.exists())
+
+    def test_checkout_sells_holds(self):
+        shirt = self.create_product('shirt', 3)
+        cart = models.Cart.objects.create(user=self.user)
+        self.add_item(cart, shirt, 2)
+        other = models.Cart.objects.create(user=self.user)
+        self.add_item(other, shirt, 2)
+        checkout.checkout(cart)
+        shirt.refresh_from_db()
+        self.assertEqual((shirt.quantity, shirt.reserved), (3, 2))
+        # Only one is left once the first cart's hold is sold.
+        with self.assertRaises(checkout.OutOfStock) as raised:
+            checkout.checkout(other)
+        self.assertEqual(raised.exception.short_lines[0]['available'], 1)
+        self.assertEqual(reservations.sweep(), (0, 1))
+        shirt.refresh_from_db()
+        self.assertEqual((shirt.quantity, shirt.reserved), (1, 0))
+
+    def test_sweep_settles_holds_sold_below_quantity(self):
+        shirt = self.create_product('shirt', 5)
+        cart = models.Cart.objects.create(user=self.user)
+        self.add_item(cart, shirt, 4)
+        checkout.checkout(cart)
+        # Set below the sold hold before the sweep takes it.
+        Product.objects.filter(pk=shirt.pk).update(quantity=2)
+        self.assertEqual(reservations.sweep(), (0, 1))
+        shirt.refresh_from_db()
+        self.assertEqual((shirt.quantity, shirt.reserved), (0, 0))
+        self.assertFalse(models.StockReservation.objects.exists())
+        self.assertEqual(list(ledger.get_unreconciled()), [shirt])
+        self.assertEqual(reservations.sweep(), (0, 0))
+
+    def test_sweep_releases_expired_holds(self):
+        shirt = self.create_product('shirt', 3)
+        cart = models.Cart.objects.create(user=self.user)
+        self.add_item(cart, shirt, 3)
+        models.StockReservation.objects.update(
+            expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(reservations.sweep(), (1, 0))
+        shirt.refresh_from_db()
+        self.assertEqual(shirt.reserved, 0)
+        checkout.checkout(cart)
+        shirt.refresh_from_db()
+        self.assertEqual((shirt.quantity, shirt.reserved), (0, 0))
+
+    def test_cart_creation_holds_in_bulk(self):
+        shirt = self.create_product('shirt', 3)
+        hat = self.create_product('hat', 5)
+        for product in (shirt, hat):
+            ProductVariant.objects.create(product=product, color='red',
+                                          color_ar='أحمر', size=1)
+        client = APIClient()
+        client.force_authenticate(self.user)
+        url = '/api/users/%d/carts/' % self.user.pk
+        lines = [{'id': shirt.pk, 'color': 'red', 'size': 1, 'quantity': 2,
+                  'price': 20},
+                 {'id': hat.pk, 'color': 'blue', 'size': 1, 'quantity': 1,
+                  'price': 10}]
+        response = client.post(url, {'items': lines}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(models.Cart.objects.exists())
+        lines[1]['color'] = 'red'
+        response = client.post(url, {'items': lines}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data['items']), 2)
+        self.assertEqual(models.StockReservation.objects.count(), 2)
+        self.assertEqual((response.data['total_price'],
+                          response.data['item_count']), (30, 3))
+        shirt.refresh_from_db()
+        self.assertEqual(shirt.reserved, 2)
+
+    def test_cart_creation_takes_constant_queries(self):
+        products = [self.create_product('p%d' % index, 5)
+                    for index in range(101)]
+        ProductVariant.objects.bulk_create([
+            ProductVariant(product=product, color='red', color_ar='أحمر',
+                           size=1)
+            for product in products])
+        client = APIClient()
+        client.force_authenticate(self.user)
+        url = '/api/users/%d/carts/' % self.user.pk
+
+        def lines(products):
+            return {'items': [
+                {'id': product.pk, 'color': 'red', 'size': 1,
+                 'quantity': 2, 'price': 20} for product in products]}
+
+        with CaptureQueriesContext(connection) as queries:
+            response = client.post(url, lines(products[:1]), format='json')
+        self.assertEqual(response.status_code, 201)
+        with self.assertNumQueries(len(queries)):
+            response = client.post(url, lines(products[1:]), format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data['items']), 100)
+        self.assertEqual(models.StockReservation.objects.count(), 101)
+
+
+class LedgerTests(CheckoutMixin, TestCase):
+    def test_checkout_counts_pending_movements(self):
+        shirt = self.create_product('shirt', 5)
+        ledger.adjust({shirt.pk: 2}, StockMovement.ADJUSTMENT, self.user)
+        shirt.refresh_from_db()
+        self.assertEqual(shirt.quantity, 5)
+        with self.assertRaises(checkout.OutOfStock):
+            checkout.checkout(self.create_cart(self.user, (shirt, 3)))
+        checkout.checkout(self.create_cart(self.user, (shirt, 2)))
+        shirt.refresh_from_db()
+        self.assertEqual(shirt.quantity, 0)
+        self.assertFalse(StockMovement.objects.filter(
+            is_settled=False).exists())
+
+    def test_sales_are_recorded(self):
+        shirt = self.create_product('shirt', 5)
+        StockMovement.objects.create(product=shirt, change=5,
+                                     reason=StockMovement.OPENING,
+                                     is_settled=True)
+        cart = self.create_cart(self.user, (shirt, 2))
+        checkout.checkout(cart)
+        ledger.adjust({shirt.pk: 10}, StockMovement.ADJUSTMENT)
+        self.assertEqual(ledger.compact(), 1)
+        shirt.refresh_from_db()
+        self.assertEqual(shirt.quantity, 10)
+        self.assertEqual(
+            list(shirt.stock_movements.order_by('pk').values_list(
+                'reason', 'change', 'cart')),
+            [('o', 5, None), ('s', -2, cart.pk), ('a', 7, None)])
+        self.assertFalse(ledger.get_unreconciled().exists())
+
+
+class TotalsTests(CheckoutMixin, TestCase):
+    def get_totals(self, cart):
+        cart.refresh_from_db()
+        return cart.total_price, cart.item_count, cart.line_count
+
+    def test_totals_follow_cart_items(self):
+        shirt = self.create_product('shirt', 10)
+        cart = models.Cart.objects.create(user=self.user)
+        item = models.CartItem.objects.create(
+            cart=cart, product=shirt, quantity=2, color='red', size=1,
+            price=20)
+        models.CartItem.objects.create(cart=cart, product=shirt, quantity=1,
+                                       color='red', size=1, price=10)
+        self.assertEqual(self.get_totals(cart), (30, 3, 2))
+        item = models.CartItem.objects.get(pk=item.pk)
+        item.quantity, item.price = 4, 40
+        item.save()
+        self.assertEqual(self.get_totals(cart), (50, 5, 2))
+        item.delete()
+        self.assertEqual(self.get_totals(cart), (10, 1, 1))
+
+    def test_repair_drifted_totals(self):
+        shirt = self.create_product('shirt', 10)
+        cart = self.create_cart(self.user, (shirt, 2), (shirt, 3))
+        empty = models.Cart.objects.create(user=self.user)
+        self.assertEqual(list(totals.get_drifted(models.Cart.objects.all())),
+                         [cart])
+        call_command('recompute_cart_totals', stdout=StringIO())
+        self.assertEqual(self.get_totals(cart), (50, 5, 2))
+        self.assertEqual(self.get_totals(empty), (0, 0, 0))
+        self.assertFalse(totals.get_drifted(models.Cart.objects.all()))
+
+
+class ExportTests(CheckoutMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(models.User.objects.create(
+            username='admin', is_staff=True))
+
+    def export(self, url, params=None, **headers):
+        response = self.client.get(url, params, **headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_carts(self):
+        shirt = self.create_product('shirt', 5)
+        hat = self.create_product('hat', 5)
+        submitted = self.create_cart(self.user, (shirt, 1), (hat, 2))
+        submitted.date_added = timezone.now()
+        submitted.save()
+        self.create_cart(self.user, (shirt, 1))
+        rows = list(csv.DictReader(StringIO(self.export(
+            '/api/users/carts/export/', {'is_not_submitted': 'false'},
+            HTTP_ACCEPT='text/csv'))))
+        self.assertEqual([(int(row['id']), row['user'], row['items'])
+                          for row in rows],
+                         [(submitted.pk, 'buyer', 'منتج,منتج')])
+        body = self.export('/api/users/carts/items/export/',
+                           {'export_format': 'ndjson',
+                            'is_not_submitted': 'false'})
+        rows = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual([(row['id'], row['product'], row['quantity'])
+                          for row in rows],
+                         [(submitted.pk, 'shirt', 1),
+                          (submitted.pk, 'hat', 2)])
+
+    def test_query_count_is_constant(self):
+        shirt = self.create_product('shirt', 5)
+        self.create_cart(self.user, (shirt, 1))
+        with CaptureQueriesContext(connection) as queries:
+            self.export('/api/users/carts/export/')
+        for _ in range(3):
+            self.create_cart(self.user, (shirt, 1), (shirt, 2))
+        with self.assertNumQueries(len(queries)):
+            body = self.export('/api/users/carts/export/')
+        self.assertEqual(len(body.splitlines()), 5)
+
+
+class SparseFieldsetTests(CheckoutMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.shirt = self.create_product('shirt', 5)
+
+    def get(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_cart_shapes(self):
+        cart = self.create_cart(self.user, (self.shirt, 2))
+        url = '/api/users/carts/%d/' % cart.pk
+        data = self.get(url, fields='id,items.quantity')
+        self.assertEqual(set(data), {'id', 'items'})
+        self.assertEqual(data['items'], [{'quantity': 2}])
+        data = self.get(url, expand='')
+        self.assertEqual(data['items'], [cart.items.get().pk])
+        data = self.get(url, expand='items')
+        self.assertEqual(data['items'][0]['product'], self.shirt.pk)
+        data = self.get(url, fields='items.product.name', omit='user_name')
+        self.assertEqual(data, {'items': [{'product': {'name': 'shirt'}}]})
+
+    def test_cart_query_count_is_constant(self):
+        cart = self.create_cart(self.user, (self.shirt, 1))
+        url = '/api/users/carts/%d/' % cart.pk
+        with CaptureQueriesContext(connection) as queries:
+            self.get(url)
+        with CaptureQueriesContext(connection) as sparse:
+            self.get(url, fields='id,items.quantity')
+        self.assertLess(len(sparse), len(queries))
+        hat = self.create_product('hat', 5)
+        models.CartItem.objects.bulk_create([
+            models.CartItem(cart=cart, product=product, quantity=1,
+                            color='red', size=1, price=10)
+            for product in (self.shirt, hat, hat)])
+        with self.assertNumQueries(len(queries)):
+            data = self.get(url)
+        self.assertEqual(len(data['items']), 4)
+        with self.assertNumQueries(len(sparse)):
+            self.get(url, fields='id,items.quantity')
+
+    def test_wishlist_shapes(self):
+        models.WishlistItem.objects.create(user=self.user,
+                                           product=self.shirt)
+        self.assertEqual(self.get('/api/users/wishlist/', expand='',
+                                  fields='product'),
+                         [{'product': self.shirt.pk}])
+        [item] = self.get('/api/users/wishlist/',
+                          fields='product.sku,product.in_wishlist')
+        self.assertEqual(item['product'], {'sku': 'shirt',
+                                           'in_wishlist': True})
+
+
+class ConcurrentCheckoutTests(CheckoutMixin, TransactionTestCase):
+    threads = 8
+    carts_per_thread = 5
+
+    def run_checkouts(self, carts):
+        def submit(cart):
+            try:
+                checkout.checkout(cart)
+                return 'sold'
+            except checkout.CheckoutError as e:
+                return e.__class__.__name__
+
+        return self.run_in_threads(submit, carts)
+
+    def run_in_threads(self, function, arguments):
+        results = []
+        barrier = threading.Barrier(self.threads)
+
+        def worker(arguments):
+            barrier.wait()
+            try:
+                for argument in arguments:
+                    results.append(function(argument))
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker,
+                                    args=(arguments[index::self.threads],))
+                   for index in range(self.threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        return results
+
+    def test_parallel_checkouts_never_oversell(self):
+        shirt = self.create_product('shirt', 15)
+        hat = self.create_product('hat', 1000)
+        carts = [self.create_cart(self.user, (shirt, 1), (hat, 2))
+                 for _ in range(self.threads * self.carts_per_thread)]
+        results = self.run_checkouts(carts)
+        shirt.refresh_from_db()
+        hat.refresh_from_db()
+        self.assertEqual(results.count('sold'), 15)
+        self.assertEqual(results.count('OutOfStock'), len(carts) - 15)
+        self.assertEqual(shirt.quantity, 0)
+        self.assertEqual(hat.quantity, 1000 - 2 * 15)
+        self.assertEqual(models.Cart.objects.filter(
+            date_added__isnull=False).count(), 15)
+
+    def test_parallel_submits_of_one_cart(self):
+        shirt = self.create_product('shirt', 100)
+        cart = self.create_cart(self.user, (shirt, 3))
+        results = self.run_checkouts([cart] * self.threads)
+        shirt.refresh_from_db()
+        self.assertEqual(results.count('sold'), 1)
+        self.assertEqual(shirt.quantity, 97)
+
+    def test_parallel_holds_never_oversell(self):
+        shirt = self.create_product('shirt', 15)
+        carts = [self.create_cart(self.user, (shirt, 1))
+                 for _ in range(self.threads * self.carts_per_thread)]
+        items = list(models.CartItem.objects.all())
+        held = self.run_in_threads(reservations.hold, items)
+        shirt.refresh_from_db()
+        self.assertEqual(held.count(True), 15)
+        self.assertEqual(shirt.reserved, 15)
+        results = self.run_checkouts(carts)
+        self.assertEqual(results.count('sold'), 15)
+        self.assertEqual(reservations.sweep(), (0, 15))
+        shirt.refresh_from_db()
+        self.assertEqual((shirt.quantity, shirt.reserved), (0, 0))
@@ -0,0 +1,103 @@
+from django.db.models import (Count, F, FloatField, IntegerField, OuterRef,
+                              Subquery, Sum)
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import models
+
+
+def change(cart_id, price, quantity, lines):
+    """
+    Add to the totals of a cart, in one UPDATE also touching it for
+    conditional GETs.
+    """
+    return models.Cart.objects.filter(pk=cart_id).update(
+        total_price=F('total_price') + price,
+        item_count=F('item_count') + quantity,
+        line_count=F('line_count') + lines,
+        updated_at=timezone.now())
+
+
+def count(item, created):
+    """
+    Count the saved cart item `item` in the totals of its cart, in place
+    of what it counted for when it was loaded or last saved.
+    """
+    counted = getattr(item, 'counted', None)
+    if created:
+        change(item.cart_id, item.price, item.quantity, 1)
+    elif counted is None:
+        # Nothing tells what the item counted for before.
+        recompute(models.Cart.objects.filter(pk=item.cart_id))
+    elif counted[0] == item.cart_id:
+        change(item.cart_id, item.price - counted[1],
+               item.quantity - counted[2], 0)
+    else:
+        change(counted[0], -counted[1], -counted[2], -1)
+        change(item.cart_id, item.price, item.quantity, 1)
+    item.counted = (item.cart_id, item.price, item.quantity)
+
+
+def uncount(item):
+    """
+    Take the deleted cart item `item` out of the totals of its cart.
+    """
+    cart_id, price, quantity = getattr(
+        item, 'counted', (item.cart_id, item.price, item.quantity))
+    change(cart_id, -price, -quantity, -1)
+
+
+def item_totals():
+    """
+    Expressions of the totals of each cart, summed from its items.
+    """
+    items = models.CartItem.objects.filter(
+        cart=OuterRef('pk')).order_by().values('cart')
+
+    def total(aggregate, output_field):
+        return Coalesce(Subquery(items.annotate(total=aggregate)
+                                 .values('total'),
+                                 output_field=output_field), 0)
+
+    return {
+        'total_price': total(Sum('price'), FloatField()),
+        'item_count': total(Sum('quantity'), IntegerField()),
+        'line_count': total(Count('pk'), IntegerField()),
+    }
+
+
+def recompute(carts):
+    """
+    Set the totals of the `carts` queryset from their items and touch
+    them, in one UPDATE. Return the number of carts updated.
+    """
+    return carts.update(updated_at=timezone.now(), **item_totals())
+
+
+def get_drifted(carts):
+    """
+    Return the carts of the `carts` queryset whose totals don't match
+    their items.
+    """
+    totals = item_totals()
+    return carts.annotate(**{
+        'items_' + name: expression for name, expression in totals.items()
+    }).exclude(**{name: F('items_' + name) for name in totals})
+
+
+def repair(batch_size=1000):
+    """
+    Recompute the totals that drifted from the items, going through the
+    carts `batch_size` at a time. Return the number of carts repaired.
+    """
+    repaired, last = 0, 0
+    while True:
+        pks = list(models.Cart.objects.filter(pk__gt=last).order_by('pk')
+                   .values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            break
+        drifted = get_drifted(models.Cart.objects.filter(pk__in=pks))
+        repaired += recompute(models.Cart.objects.filter(
+            pk__in=list(drifted.values_list('pk', flat=True))))
+        last = pks[-1]
+    return repaired
@@ -10,9 +10,13 @@ urlpatterns = [
     path("<int:id>/wishlist/", views.WishlistEditView.as_view(),
          name="user-wishlist"),
     path("carts/", views.CartListView.as_view(), name="cart-list"),
+    path("carts/export/", views.CartExportView.as_view(), name="cart-export"),
+    path("carts/items/export/", views.CartItemExportView.as_view(),
+         name="cartitem-export"),
     path("carts/<int:pk>/", views.CartEditView.as_view(),
          name="cart-detail"),
-    path("carts/finish/", views.CartFinishView.as_view(), name="cart-finish"),
+    path("carts/<int:pk>/finish/", views.CartFinishView.as_view(),
+         name="cart-finish"),
     path("cart_item/", views.CartItemCreateView.as_view(),
          name="cartitem-create"),
     path("cart_item/<int:pk>/", views.CartItemEditView.as_view(),
@@ -1,8 +1,8 @@
 from datetime import datetime
 # import simplify
 
-from django.db import IntegrityError, transaction
-from django.db.models import Sum
+from django.db import IntegrityError
+from django.db.models import Max
 from django.shortcuts import get_object_or_404, Http404
 from django.contrib.auth.models import AnonymousUser
 from django_filters import rest_framework
@@ -10,9 +10,13 @@ from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import generics, permissions, status, exceptions, filters, views
 from rest_framework.response import Response
 
-from . import models, serializers
+from products.conditional import ConditionalRetrieveMixin
+from products.exports import StreamingExportMixin
+from products.fieldsets import SparseFieldsetViewMixin
+from products.pagination import KeysetPagination
+from . import checkout, models, serializers
 from .permissions import (IsUserOrReadOnly, IsUser,
-                          IsOwner, IsOwnerOrAdminReadOnly,
+                          IsOwner, IsCartOwner, IsOwnerOrAdminReadOnly,
                           IsUserOrAdminReadOnly, IsUserOrAdmin)
 
 
@@ -51,7 +55,7 @@ class UserEditView(generics.RetrieveUpdateDestroyAPIView):
                             status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-class WishlistEditView(generics.ListCreateAPIView):
+class WishlistEditView(SparseFieldsetViewMixin, generics.ListCreateAPIView):
     """
     get:
         ### Retrieve wishlist contents. `Authenticated users only`
@@ -65,8 +69,12 @@ class WishlistEditView(generics.ListCreateAPIView):
 
     def get_queryset(self):
         if self.kwargs.get('pk'):
-            return models.WishlistItem.objects.filter(user=self.kwargs['pk'])
-        return models.WishlistItem.objects.filter(user=self.request.user)
+            queryset = models.WishlistItem.objects.filter(
+                user=self.kwargs['pk'])
+        else:
+            queryset = models.WishlistItem.objects.filter(
+                user=self.request.user)
+        return self.optimize_queryset(queryset)
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
@@ -110,16 +118,25 @@ class CartFilter(rest_framework.FilterSet):
                                                     lookup_expr='isnull')
     is_not_finished = rest_framework.BooleanFilter(field_name='date_finished',
                                                    lookup_expr='isnull')
+    total_min = rest_framework.NumberFilter(field_name='total_price',
+                                            lookup_expr='gte')
+    total_max = rest_framework.NumberFilter(field_name='total_price',
+                                            lookup_expr='lte')
+    items_min = rest_framework.NumberFilter(field_name='item_count',
+                                            lookup_expr='gte')
+    items_max = rest_framework.NumberFilter(field_name='item_count',
+                                            lookup_expr='lte')
 
     class Meta:
         model = models.Cart
         fields = ['is_active', 'payment_method', 'country',
                   'zip_code', 'is_not_submitted', 'is_not_finished',
                   'added_before', 'added_after',
-                  'finished_before', 'finished_after']
+                  'finished_before', 'finished_after',
+                  'total_min', 'total_max', 'items_min', 'items_max']
 
 
-class CartListView(generics.ListAPIView):
+class CartListView(SparseFieldsetViewMixin, generics.ListAPIView):
     """
     get:
         ### List all carts. `Admin users only`
@@ -130,9 +147,56 @@ class CartListView(generics.ListAPIView):
     filter_backends = [DjangoFilterBackend, filters.SearchFilter]
     search_fields = ['address', 'country']
     filterset_class = CartFilter
+    pagination_class = KeysetPagination
+    cursor_ordering_fields = ['id', 'total_price', 'item_count',
+                              'line_count']
+    cursor_default_ordering = '-id'
+
+    def get_queryset(self):
+        return self.optimize_queryset(super().get_queryset())
+
+
+class CartExportView(StreamingExportMixin, generics.GenericAPIView):
+    """
+    get:
+        ### Download the carts as CSV, or as JSON lines with
+        ### `?export_format=ndjson`. Takes the same filters as the cart
+        ### list. `Admin users only`
+    """
+    permission_classes = [permissions.IsAdminUser]
+    queryset = models.Cart.objects.select_related('user')
+    serializer_class = serializers.CartReportSerializer
+    filter_backends = CartListView.filter_backends
+    search_fields = CartListView.search_fields
+    filterset_class = CartFilter
+    export_prefetch = ['items__product']
+    export_filename = 'carts'
 
 
-class UserCartListView(generics.ListCreateAPIView):
+class CartItemExportView(StreamingExportMixin, generics.GenericAPIView):
+    """
+    get:
+        ### Download the items of the carts as CSV, or as JSON lines with
+        ### `?export_format=ndjson`. Takes the filters of the cart list.
+        ### `Admin users only`
+    """
+    permission_classes = [permissions.IsAdminUser]
+    queryset = models.CartItem.objects.select_related('cart__user',
+                                                      'product')
+    serializer_class = serializers.CartItemReportSerializer
+    export_filename = 'cart-items'
+
+    def filter_queryset(self, queryset):
+        carts = CartFilter(self.request.query_params,
+                           queryset=models.Cart.objects.all(),
+                           request=self.request)
+        if not carts.is_valid():
+            raise exceptions.ValidationError(carts.errors)
+        return queryset.filter(cart__in=carts.qs).order_by('cart', 'pk')
+
+
+class UserCartListView(SparseFieldsetViewMixin,
+                       generics.ListCreateAPIView):
     """
     get:
         ### List all carts. `Authenticated users only`
@@ -144,7 +208,10 @@ class UserCartListView(generics.ListCreateAPIView):
     filterset_class = CartFilter
 
     def get_queryset(self):
-        return models.Cart.objects.filter(user=self.kwargs['pk'])
+        queryset = models.Cart.objects.filter(user=self.kwargs['pk'])
+        if self.request.method == 'GET':
+            return self.optimize_queryset(queryset)
+        return queryset
 
     def get_serializer_class(self):
         if self.request.method == 'POST':
@@ -152,7 +219,8 @@ class UserCartListView(generics.ListCreateAPIView):
         return serializers.CartSerializer
 
 
-class CartEditView(generics.RetrieveUpdateDestroyAPIView):
+class CartEditView(ConditionalRetrieveMixin, SparseFieldsetViewMixin,
+                   generics.RetrieveUpdateDestroyAPIView):
     """
     get:
         ### Retrieve cart content.
@@ -167,6 +235,14 @@ class CartEditView(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = serializers.CartSerializer
     queryset = models.Cart.objects.all()
 
+    def get_last_modified(self, instance):
+        # Item changes touch the cart, product changes are picked up here.
+        latest = instance.items.order_by().aggregate(
+            latest=Max('product__updated_at'))['latest']
+        if latest is None:
+            return instance.updated_at
+        return max(instance.updated_at, latest)
+
 
 class CartFinishView(generics.views.APIView):
     """
@@ -179,51 +255,32 @@ class CartFinishView(generics.views.APIView):
     queryset = models.Cart.objects.all()
 
     def get(self, request, *args, **kwargs):
+        cart = get_object_or_404(self.queryset, pk=kwargs['pk'])
+        self.check_object_permissions(request, cart)
         try:
-            cart = get_object_or_404(self.queryset, pk=kwargs['pk'])
-            # Make sure the cart is not submitted already.
-            if cart.date_added:
-                raise Exception("Cart already submitted")
-
-            # Get the products in the cart
-            products = models.Product.objects.select_for_update().filter(
-                cartitem__cart=cart)
-
-            with transaction.atomic():
-                # Validate order.
-                for product in products:
-                    # Calculate the new quantity
-                    product.quantity -= cart.items.get(product=product)\
-                        .quantity
-                    # Check if there's enough quantity for the order
-                    if product.quantity < 0:
-                        raise Exception(
-                            "Not enough quantity for {0};"
-                            "كمية غير كافية للمنتج {0}".format(product))
-                # Save the new quantities.
-                for product in products:
-                    product.save()
-
-            # Get the total price of the cart.
-            # price = cart.items.aggregate(Sum('price'))['price__sum']
-            # payment = simplify.Payment.create({
-            #     "token": request.data['token'],
-            #     "amount": price,
-            #     "currency": "QAR"
-            # })
-            # # Verify that the payment is done.
-            # if payment.paymentStatus != 'APPROVED':
-            #     raise Exception('Payment not approved')
-
-            # Update cart.
-            cart.date_added = datetime.now()
-            cart.save()
-
-            return Response({'success': True}, status.HTTP_200_OK)
-        except Exception as e:
+            checkout.checkout(cart)
+        except checkout.OutOfStock as e:
+            return Response({'success': False,
+                             'details': e.__str__(),
+                             'short_lines': e.short_lines},
+                            status.HTTP_409_CONFLICT)
+        except checkout.CheckoutError as e:
             return Response({'success': False,
                              'details': e.__str__()},
-                            status.HTTP_500_INTERNAL_SERVER_ERROR)
+                            status.HTTP_409_CONFLICT)
+
+        # Get the total price of the cart.
+        # price = cart.total_price
+        # payment = simplify.Payment.create({
+        #     "token": request.data['token'],
+        #     "amount": price,
+        #     "currency": "QAR"
+        # })
+        # # Verify that the payment is done.
+        # if payment.paymentStatus != 'APPROVED':
+        #     raise Exception('Payment not approved')
+
+        return Response({'success': True}, status.HTTP_200_OK)
 
     def post(self, request, *args, **kwargs):
         try:
@@ -253,7 +310,8 @@ class CartItemCreateView(generics.CreateAPIView):
     queryset = models.CartItem.objects.all()
 
 
-class CartItemEditView(generics.RetrieveUpdateDestroyAPIView):
+class CartItemEditView(SparseFieldsetViewMixin,
+                       generics.RetrieveUpdateDestroyAPIView):
     """
     get:
         ### Retrieve cart item content.
@@ -264,9 +322,9 @@ class CartItemEditView(generics.RetrieveUpdateDestroyAPIView):
     delete:
         ### Delete cart item.
     """
-    permission_classes = [IsOwner]
+    permission_classes = [IsCartOwner]
     serializer_class = serializers.CartItemSerializer
-    queryset = models.CartItem.objects.all()
+    queryset = models.CartItem.objects.select_related('cart__user')
 
     def perform_update(self, serializer):
         product = models.Product.objects.get(